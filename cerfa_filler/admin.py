@@ -1,13 +1,20 @@
+import uuid
+
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.utils.timezone import localdate, now
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
+from import_export.instance_loaders import CachedInstanceLoader
 
 from .models import (
     BeneficiaryOrganization,
     Companies,
     CompanyLegalForms,
     DeclarativeStructure,
+    OrderCounter,
     PrivateIndividual,
+    RenderJob,
 )
 
 # Register your models here.
@@ -18,14 +25,81 @@ class CompanyLegalFormsResource(resources.ModelResource):
         model = CompanyLegalForms
 
 
-class CompaniesResource(resources.ModelResource):
+class DonationResource(resources.ModelResource):
+    """Creates the new donations with ``bulk_create``, which numbers them a
+    block at a time, and updates the others with ``bulk_update``.
+
+    The rows without uuid are new donations. The rows are imported in the
+    order of their date, so that the donations are numbered in that order
+    across the batches of ``bulk_create``."""
+
+    def before_import(self, dataset, **kwargs):
+        if "uuid" in dataset.headers:
+            uuids = dataset["uuid"]
+            del dataset["uuid"]
+        else:
+            uuids = [None] * dataset.height
+        dataset.append_col(
+            [value or str(uuid.uuid4()) for value in uuids], header="uuid"
+        )
+        if "date_start" in dataset.headers:
+            headers = dataset.headers
+            rows = sorted(
+                dataset,
+                key=lambda row: self.import_date(dict(zip(headers, row))),
+            )
+            del dataset[:]
+            dataset.extend(rows)
+
+    def import_date(self, row):
+        """Date of the donation of a row, today's (the default) when missing
+        or invalid, the latter being reported by the import"""
+        date_start = self._meta.model._meta.get_field("date_start")
+        try:
+            value = self.fields["date_start"].clean(row)
+            return date_start.to_python(value) or localdate()
+        except (ValueError, ValidationError):
+            return localdate()
+
+    def before_save_instance(self, instance, row, **kwargs):
+        if instance._state.adding:
+            return
+        # Neither done by bulk_update
+        instance.timestamp_update = now()
+        if instance.stored_year() != instance.year:
+            instance.order = OrderCounter.next_order(
+                instance.__class__, instance.year
+            )
+
+    def get_bulk_update_fields(self):
+        generated = {
+            field.name
+            for field in self._meta.model._meta.fields
+            if field.generated
+        }
+        return [
+            name
+            for name in super().get_bulk_update_fields()
+            if name not in generated
+        ]
+
+
+class CompaniesResource(DonationResource):
     class Meta:
         model = Companies
+        import_id_fields = ["uuid"]
+        use_bulk = True
+        batch_size = 1000
+        instance_loader_class = CachedInstanceLoader
 
 
-class PrivateIndividualResource(resources.ModelResource):
+class PrivateIndividualResource(DonationResource):
     class Meta:
         model = PrivateIndividual
+        import_id_fields = ["uuid"]
+        use_bulk = True
+        batch_size = 1000
+        instance_loader_class = CachedInstanceLoader
 
 
 admin.site.register(BeneficiaryOrganization, admin.ModelAdmin)
@@ -55,3 +129,22 @@ class PrivateIndividualAdmin(ImportExportModelAdmin):
         "donation_nature",
     )
     list_filter = ["donation_nature"]
+
+
+@admin.register(OrderCounter)
+class OrderCounterAdmin(admin.ModelAdmin):
+    list_display = ("model_name", "year", "last_order")
+    list_filter = ["model_name"]
+
+
+@admin.register(RenderJob)
+class RenderJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "model_name",
+        "object_id",
+        "status",
+        "attempts",
+        "run_after",
+        "locked_by",
+    )
+    list_filter = ["status", "model_name"]
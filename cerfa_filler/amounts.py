@@ -0,0 +1,92 @@
+"""Amounts in euros written in French words, as printed on the receipts.
+
+Gives the same text as ``num2words(amount, lang="fr", to="currency")``,
+which the receipts used to call on every access to the ``*_as_text``
+properties, several times per rendering, for a fraction of its cost: the
+amount is split in groups of three digits and the words of each group are
+looked up, and the text of the recent amounts is cached.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+UNITS = [
+    "zéro", "un", "deux", "trois", "quatre", "cinq", "six", "sept", "huit",
+    "neuf", "dix", "onze", "douze", "treize", "quatorze", "quinze", "seize",
+    "dix-sept", "dix-huit", "dix-neuf",
+]  # fmt: skip
+TENS = [
+    None, None, "vingt", "trente", "quarante", "cinquante", "soixante",
+    "soixante", "quatre-vingt", "quatre-vingt",
+]  # fmt: skip
+# Names of the groups of three digits, "mille" is invariable
+SCALES = [(10**9, "milliard"), (10**6, "million"), (10**3, "mille")]
+CENT = Decimal("0.01")
+
+
+def _tens(number: int) -> str:
+    if number < 20:
+        return UNITS[number]
+    tens, unit = divmod(number, 10)
+    if tens in (7, 9):
+        # soixante-dix, quatre-vingt-dix...
+        unit += 10
+    if unit == 0:
+        return "quatre-vingts" if tens == 8 else TENS[tens]
+    if unit in (1, 11) and tens != 8 and tens != 9:
+        return f"{TENS[tens]} et {UNITS[unit]}"
+    return f"{TENS[tens]}-{UNITS[unit]}"
+
+
+def _hundreds(number: int, before_mille=False) -> str:
+    """Words of a group of three digits. "vingt" and "cent" are plural at
+    the end of a number, but not before "mille"."""
+    hundreds, rest = divmod(number, 100)
+    words = []
+    if hundreds > 1:
+        words.append(UNITS[hundreds])
+    if hundreds:
+        words.append("cents" if hundreds > 1 and not rest else "cent")
+    if rest:
+        words.append(_tens(rest))
+    text = " ".join(words)
+    if before_mille and text.endswith(("cents", "quatre-vingts")):
+        text = text[:-1]
+    return text
+
+
+@lru_cache(maxsize=4096)
+def number_as_text(number: int) -> str:
+    """A positive integer in French words"""
+    if number == 0:
+        return UNITS[0]
+    words = []
+    for scale, name in SCALES:
+        count, number = divmod(number, scale)
+        if not count:
+            continue
+        if name == "mille":
+            if count > 1:
+                words.append(_hundreds(count, before_mille=True))
+            words.append(name)
+        else:
+            words.append(number_as_text(count))
+            words.append(name if count == 1 else f"{name}s")
+    if number:
+        words.append(_hundreds(number))
+    return " ".join(words)
+
+
+@lru_cache(maxsize=1024)
+def amount_as_text(amount) -> str:
+    """An amount in euros in French words, with its cents, e.g. "mille deux
+    cent trente-quatre euros et cinquante-six centimes"."""
+    amount = Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+    sign = "moins " if amount < 0 else ""
+    euros, cents = divmod(abs(amount) * 100, 100)
+    euros, cents = int(euros), int(cents)
+    return (
+        f"{sign}{number_as_text(euros)} {'euro' if euros == 1 else 'euros'}"
+        f" et {number_as_text(cents)} "
+        f"{'centime' if cents == 1 else 'centimes'}"
+    )
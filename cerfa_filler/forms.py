@@ -44,21 +44,21 @@ class BaseFilterForm(forms.Form):
         required=False,
         label="Statut de validation",
     )
+    # Sort of the list, kept when filtering
+    ordering = forms.CharField(required=False, widget=forms.HiddenInput)
 
     def __init__(self, *args, model=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         if model is not None:
             years = (
-                model.objects.order_by("date_start__year")
-                .values("date_start__year")
+                model.objects.order_by("fiscal_year")
+                .values_list("fiscal_year", flat=True)
                 .distinct()
             )
 
             self.fields["year"].choices = [("", "---------")] + [
-                (y["date_start__year"], y["date_start__year"])
-                for y in years
-                if y["date_start__year"] is not None
+                (year, year) for year in years
             ]
 
 
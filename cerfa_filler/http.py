@@ -0,0 +1,90 @@
+"""Responses serving the receipt files, with byte range support."""
+
+import io
+import os
+import re
+from typing import BinaryIO, Optional, Tuple
+
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_size(file: BinaryIO) -> int:
+    if isinstance(file, io.BytesIO):
+        return file.getbuffer().nbytes
+    return os.fstat(file.fileno()).st_size
+
+
+def byte_range(request, size, etag=None) -> Optional[Tuple[int, int]]:
+    """First and last byte requested by the ``Range`` header, or None when
+    the whole file is to be sent.
+
+    Multiple ranges are not supported, the whole file is sent instead.
+    """
+    header = request.headers.get("Range")
+    if not header:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range != etag:
+        # The client has an outdated copy
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last bytes of the file
+        if not int(last):
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable
+    return first, last
+
+
+def file_response(
+    request, file: BinaryIO, filename, content_type, etag=None
+) -> HttpResponse:
+    """Attachment response of ``file``, or of the byte range requested.
+
+    The whole file is streamed by ``FileResponse`` (with ``sendfile`` when
+    the server supports it), ranges are read from the file.
+    """
+    size = file_size(file)
+    try:
+        requested = byte_range(request, size, etag)
+    except RangeNotSatisfiable:
+        file.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if requested is None:
+        response = FileResponse(
+            file,
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+    else:
+        first, last = requested
+        with file:
+            file.seek(first)
+            response = HttpResponse(
+                file.read(last - first + 1),
+                status=206,
+                content_type=content_type,
+            )
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        response["Content-Disposition"] = content_disposition_header(
+            True, filename
+        )
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -0,0 +1,59 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from num2words import num2words
+
+from ...amounts import amount_as_text
+from .benchmark_templates import best_time
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time spent writing amounts in words with num2words "
+        "and with the amounts speller"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--amounts", type=int, default=1000, help="Amounts per run"
+        )
+        parser.add_argument(
+            "-n", "--number", type=int, default=5, help="Runs per speller"
+        )
+
+    def handle(self, *args, **options):
+        sample = random.Random(0)
+        amounts = [
+            Decimal(sample.randrange(10**7)) / 100
+            for _ in range(options["amounts"])
+        ]
+        spell = amount_as_text.__wrapped__
+
+        reference = best_time(
+            lambda: [
+                num2words(amount, lang="fr", to="currency")
+                for amount in amounts
+            ],
+            options["number"],
+        )
+        uncached = best_time(
+            lambda: [spell(amount) for amount in amounts], options["number"]
+        )
+        # Warm cache, as when a template reads the same amount again
+        amount_as_text.cache_clear()
+        for amount in amounts:
+            amount_as_text(amount)
+        cached = best_time(
+            lambda: [amount_as_text(amount) for amount in amounts],
+            options["number"],
+        )
+        for name, elapsed in (
+            ("num2words", reference),
+            ("speller", uncached),
+            ("speller, cached", cached),
+        ):
+            self.stdout.write(
+                f"{name}: {elapsed / len(amounts) * 1000:.2f} µs per amount "
+                f"(x{reference / elapsed:.0f})"
+            )
@@ -0,0 +1,124 @@
+import io
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from pypdf import PdfReader, PdfWriter
+
+from ...rendering.compiled import render_template
+from ...rendering.weasy import PAGE_BREAK
+from ...rendering.weasy import render_receipt as render_cached
+from ...rendering.weasy import svg_to_pdf
+from ...views import CompaniesCerfaToPdf, PrivateIndividualCerfaToPdf
+from .benchmark_templates import sample_context
+
+RECEIPTS = {
+    "companies": CompaniesCerfaToPdf.templates,
+    "individuals": PrivateIndividualCerfaToPdf.templates,
+}
+
+
+class Timer:
+    """Time spent in each stage of a rendering, in ms"""
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+
+    def __call__(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.stages[stage] += (time.perf_counter() - start) * 1000
+        return result
+
+
+def render_per_page(templates, context, timer) -> bytes:
+    """A WeasyPrint layout per page, merged with pypdf"""
+    pdfs = [
+        timer(
+            "weasyprint",
+            svg_to_pdf,
+            timer("templates", render_template, template_name, context),
+        )
+        for template_name in templates
+    ]
+
+    def merge():
+        writer = PdfWriter()
+        for pdf in pdfs:
+            for page in PdfReader(io.BytesIO(pdf)).pages:
+                writer.add_page(page)
+        output_pdf = io.BytesIO()
+        writer.write(output_pdf)
+        return output_pdf.getvalue()
+
+    return timer("merge", merge)
+
+
+def render_single_pass(templates, context, timer) -> bytes:
+    """A single WeasyPrint layout of all the pages"""
+    svg_content = PAGE_BREAK.join(
+        timer("templates", render_template, template_name, context)
+        for template_name in templates
+    )
+    return timer("weasyprint", svg_to_pdf, svg_content)
+
+
+def render_cached_first_page(templates, context, timer) -> bytes:
+    """The weasyprint renderer: first page served from the page cache"""
+    return timer("total", render_cached, templates, context)
+
+
+FLOWS = {
+    "per page": render_per_page,
+    "single pass": render_single_pass,
+    "cached first page": render_cached_first_page,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time spent in each stage of the WeasyPrint rendering "
+        "of a receipt, one page at a time or in a single pass"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "receipts",
+            nargs="*",
+            default=list(RECEIPTS),
+            help="Receipts to benchmark (companies, individuals), all by "
+            "default",
+        )
+        parser.add_argument(
+            "-n", "--number", type=int, default=5, help="Runs per flow"
+        )
+
+    def handle(self, *args, **options):
+        for name in options["receipts"]:
+            if name not in RECEIPTS:
+                raise CommandError(f"Unknown receipt: {name}")
+            templates = RECEIPTS[name]
+            context = sample_context(templates[0])
+            # Fills the page cache and the compiled templates cache
+            render_cached(templates, context)
+            for flow, render in FLOWS.items():
+                best = None
+                for _ in range(options["number"]):
+                    timer = Timer()
+                    pages = len(
+                        PdfReader(
+                            io.BytesIO(render(templates, context, timer))
+                        ).pages
+                    )
+                    if best is None or sum(timer.stages.values()) < sum(
+                        best.stages.values()
+                    ):
+                        best = timer
+                stages = ", ".join(
+                    f"{stage} {elapsed:.0f} ms"
+                    for stage, elapsed in best.stages.items()
+                )
+                self.stdout.write(
+                    f"{name}, {flow}: {sum(best.stages.values()):.0f} ms "
+                    f"({stages}), {pages} pages"
+                )
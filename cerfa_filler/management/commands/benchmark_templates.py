@@ -0,0 +1,95 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+
+from ...models import BeneficiaryOrganization, Companies, PrivateIndividual
+from ...rendering import signature_data
+from ...rendering.compiled import compile_template
+from .minify_templates import RECEIPT_TEMPLATES
+
+
+def sample_context(template_name) -> dict:
+    """Context of a receipt, with an unsaved donation"""
+    company = BeneficiaryOrganization.get_current()
+    donation = {
+        "street_number": "12",
+        "street": "rue des Mésanges",
+        "postal_code": "69000",
+        "municipality": "Lyon",
+        "cash_donation": Decimal("1234.56"),
+        "cash_payment_type": "Cheque",
+        "date_start": datetime.date.today(),
+        "valid_date": datetime.date.today(),
+        "order": 1,
+    }
+    if template_name.startswith("companies"):
+        donor = Companies(label="Société <test> & cie", **donation)
+    else:
+        donor = PrivateIndividual(
+            first_name="Jean", last_name="Dupont", **donation
+        )
+    return {
+        "object": donor,
+        "company": company,
+        "sign_file": signature_data(company),
+    }
+
+
+def best_time(function, number) -> float:
+    """Best time of ``number`` runs of ``function``, in ms"""
+    timings = []
+    for _ in range(number):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the rendering time of the receipt templates with the "
+        "Django engine and once compiled"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "templates",
+            nargs="*",
+            default=RECEIPT_TEMPLATES,
+            help="Templates to benchmark, all the receipt templates by default",
+        )
+        parser.add_argument(
+            "-n", "--number", type=int, default=20, help="Runs per template"
+        )
+
+    def handle(self, *args, **options):
+        for template_name in options["templates"]:
+            context = sample_context(template_name)
+            compiled = compile_template(template_name)
+            if compiled is None:
+                self.stdout.write(
+                    f"{template_name}: unsupported tags, not compiled"
+                )
+                continue
+            if compiled.render(context) != render_to_string(
+                template_name, context
+            ):
+                raise CommandError(
+                    f"{template_name}: the compiled template renders "
+                    "differently"
+                )
+
+            engine = best_time(
+                lambda: render_to_string(template_name, context),
+                options["number"],
+            )
+            fast = best_time(
+                lambda: compiled.render(context), options["number"]
+            )
+            self.stdout.write(
+                f"{template_name}: render_to_string {engine:.2f} ms, "
+                f"compiled {fast:.2f} ms (x{engine / fast:.1f})"
+            )
@@ -0,0 +1,241 @@
+import multiprocessing
+import os
+import shutil
+import time
+import zipfile
+from collections import defaultdict
+from functools import partial
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ...models import Companies, PrivateIndividual
+from ...rendering import receipt_context
+from ...rendering.batch import merge_receipts
+from ...rendering.cache import cached_receipt
+from ...rendering.pages import write_atomic
+from ...views import (
+    CompaniesCerfaToPdf,
+    PrivateIndividualCerfaToPdf,
+    receipt_filename,
+)
+
+MODELS = {
+    "companies": (Companies, CompaniesCerfaToPdf.templates),
+    "individuals": (PrivateIndividual, PrivateIndividualCerfaToPdf.templates),
+}
+
+
+def init_worker():
+    django.setup()
+
+
+def render(task, store=True):
+    """Render the receipt of a donation, in a worker"""
+    model_name, pk = task
+    model, templates = MODELS[model_name]
+    donor = model.objects.get(pk=pk)
+    start = time.perf_counter()
+    pdf = cached_receipt(templates, receipt_context(donor), store=store)
+    return (
+        task,
+        receipt_filename(donor),
+        pdf,
+        os.getpid(),
+        time.perf_counter() - start,
+    )
+
+
+class Checkpoint:
+    """Donations whose receipt is already written, one per line"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = set()
+        if path.exists():
+            self.done = {
+                tuple(line.split(":", 1))
+                for line in path.read_text().splitlines()
+                if line
+            }
+
+    def add(self, task):
+        with open(self.path, "a") as checkpoint:
+            checkpoint.write(":".join(task) + "\n")
+        self.done.add(task)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the receipts of a fiscal year into a directory or a ZIP "
+        "file. An interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output",
+            help=(
+                "Output directory, ZIP file if ending in .zip, or single "
+                "PDF holding all the receipts (for mailing) if ending in .pdf"
+            ),
+        )
+        parser.add_argument("--year", type=int, help="Year of the donations")
+        parser.add_argument(
+            "--structure", help="Label of the declarative structure"
+        )
+        parser.add_argument(
+            "--model",
+            choices=MODELS,
+            action="append",
+            help="Donors whose receipts are generated, all by default",
+        )
+        parser.add_argument(
+            "--status",
+            choices=("validated", "pending", "all"),
+            default="validated",
+            help="Validation status of the donations (default: validated)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of rendering processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Do not store the receipts in the receipts cache, not to "
+            "evict those downloaded meanwhile",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the receipts generated by a previous run",
+        )
+
+    def get_tasks(self, options):
+        tasks = []
+        for model_name in options["model"] or MODELS:
+            # Donations without a tax receipt never get one
+            queryset = MODELS[model_name][0].objects.filter(tax_receipt=True)
+            if options["year"]:
+                queryset = queryset.filter(fiscal_year=options["year"])
+            if options["structure"]:
+                queryset = queryset.filter(
+                    declarative_structure__label=options["structure"]
+                )
+            if options["status"] != "all":
+                queryset = queryset.filter(
+                    valid_date__isnull=options["status"] == "pending"
+                )
+            tasks.extend(
+                (model_name, str(pk))
+                for pk in queryset.order_by("date_start", "order").values_list(
+                    "pk", flat=True
+                )
+            )
+        return tasks
+
+    def handle(self, *args, **options):
+        output = Path(options["output"])
+        if output.suffix.lower() == ".pdf":
+            return self.write_merged(
+                output, self.get_tasks(options), not options["no_cache"]
+            )
+        as_zip = output.suffix.lower() == ".zip"
+        # Receipts of a ZIP are staged in a directory until they are all done
+        directory = output.with_suffix(".parts") if as_zip else output
+        checkpoint_path = directory / ".checkpoint"
+        if options["restart"]:
+            checkpoint_path.unlink(missing_ok=True)
+            if as_zip:
+                shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True, exist_ok=True)
+        checkpoint = Checkpoint(checkpoint_path)
+
+        tasks = [
+            task
+            for task in self.get_tasks(options)
+            if task not in checkpoint.done
+        ]
+        self.stdout.write(
+            f"{len(tasks)} receipts to generate, "
+            f"{len(checkpoint.done)} already done"
+        )
+
+        workers = max(options["workers"], 1)
+        busy = defaultdict(float)
+        count = defaultdict(int)
+        start = time.perf_counter()
+        render_task = partial(render, store=not options["no_cache"])
+        if workers == 1 or len(tasks) <= 1:
+            pool = None
+            results = map(render_task, tasks)
+        else:
+            # Workers open their own database connections
+            connections.close_all()
+            pool = multiprocessing.Pool(workers, initializer=init_worker)
+            results = pool.imap_unordered(render_task, tasks, chunksize=4)
+        try:
+            for task, filename, pdf, pid, elapsed in results:
+                write_atomic(directory / filename, pdf)
+                checkpoint.add(task)
+                busy[pid] += elapsed
+                count[pid] += 1
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"{filename} ({elapsed:.2f} s)")
+        except KeyboardInterrupt:
+            raise CommandError(
+                f"Interrupted after {sum(count.values())} receipts, run the "
+                "same command again to resume"
+            )
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        elapsed = time.perf_counter() - start
+
+        if as_zip:
+            self.write_zip(directory, output)
+
+        done = sum(count.values())
+        if done:
+            self.stdout.write(
+                f"{done} receipts in {elapsed:.1f} s: "
+                f"{done / elapsed:.2f} receipts/s, "
+                f"{done / elapsed / len(count):.2f} receipts/s per worker"
+            )
+            for pid in sorted(count):
+                self.stdout.write(
+                    f"  worker {pid}: {count[pid]} receipts, "
+                    f"{count[pid] / busy[pid]:.2f} receipts/s while rendering"
+                )
+        self.stdout.write(self.style.SUCCESS(f"Receipts written to {output}"))
+
+    def write_merged(self, output, tasks, store=True):
+        def receipts():
+            for model_name, pk in tasks:
+                model, templates = MODELS[model_name]
+                yield templates, receipt_context(model.objects.get(pk=pk))
+
+        start = time.perf_counter()
+        pdf = merge_receipts(
+            receipts(), receipt=partial(cached_receipt, store=store)
+        )
+        write_atomic(output, pdf)
+        self.stdout.write(
+            f"{len(tasks)} receipts in {time.perf_counter() - start:.1f} s, "
+            f"{len(pdf) / 1024:.0f} KiB"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Receipts written to {output}"))
+
+    def write_zip(self, directory, output):
+        tmp_path = output.with_suffix(".zip.tmp")
+        with zipfile.ZipFile(tmp_path, "w") as archive:
+            for path in sorted(directory.glob("*.pdf")):
+                # PDF streams are already compressed
+                archive.write(path, path.name, zipfile.ZIP_STORED)
+        os.replace(tmp_path, output)
+        shutil.rmtree(directory)
@@ -0,0 +1,188 @@
+import datetime
+import hashlib
+import io
+import os
+import time
+
+import tinyhtml5
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import CharField, DecimalField, TextField
+from django.template import engines
+from pypdf import PdfReader
+from pypdf.generic import ContentStream, FloatObject, NumberObject
+
+from ...models import Companies, PrivateIndividual
+from ...rendering import receipt_context
+from ...rendering.minify import (
+    assets_root,
+    minified_root,
+    minify_svg,
+    source_path,
+)
+from ...rendering.pages import write_atomic
+from ...rendering.weasy import svg_to_pdf
+from ...views import CompaniesCerfaToPdf, PrivateIndividualCerfaToPdf
+
+RECEIPT_TEMPLATES = (
+    CompaniesCerfaToPdf.templates + PrivateIndividualCerfaToPdf.templates
+)
+
+
+def parse_time(svg_content) -> float:
+    """Time spent by the HTML parser of WeasyPrint on a template, in ms"""
+    start = time.perf_counter()
+    tinyhtml5.parse(svg_content)
+    return (time.perf_counter() - start) * 1000
+
+
+def sample_donation(template_name):
+    """Latest donation rendered by ``template_name``, or an unsaved one with
+    all its fields filled in"""
+    if template_name in CompaniesCerfaToPdf.templates:
+        model = Companies
+    else:
+        model = PrivateIndividual
+    donor = model.objects.order_by("-date_start", "-order").first()
+    if donor is not None:
+        return donor
+    donor = model(date_start=datetime.date.today(), order=1)
+    for field in model._meta.concrete_fields:
+        if field.choices:
+            setattr(donor, field.attname, field.choices[0][0])
+        elif isinstance(field, (CharField, TextField)):
+            value = str(field.verbose_name)[: field.max_length]
+            setattr(donor, field.attname, value)
+        elif isinstance(field, DecimalField):
+            setattr(donor, field.attname, 1234.56)
+    return donor
+
+
+def operand(value):
+    """Content stream operand, its numbers as floats"""
+    if isinstance(value, (FloatObject, NumberObject)):
+        return float(value)
+    if isinstance(value, list):
+        return [operand(item) for item in value]
+    if isinstance(value, dict):
+        return {key: operand(item) for key, item in value.items()}
+    return value
+
+
+def page_operations(pdf) -> list:
+    """Size of the pages and drawing operations of a PDF, those of the form
+    XObjects included, the images replaced by a digest of their pixels"""
+    reader = PdfReader(io.BytesIO(pdf))
+    operations = []
+
+    def visit(content, resources):
+        xobjects = resources.get("/XObject", {})
+        for operands, operator in ContentStream(content, reader).operations:
+            operations.append((operator, operand(operands)))
+            if operator != b"Do" or operands[0] not in xobjects:
+                continue
+            xobject = xobjects[operands[0]].get_object()
+            if xobject["/Subtype"] == "/Form":
+                visit(xobject, xobject.get("/Resources", resources))
+            else:
+                digest = hashlib.sha256(xobject.get_data()).hexdigest()
+                operations.append((b"image", digest))
+
+    for page in reader.pages:
+        operations.append((b"page", operand(list(page.mediabox))))
+        visit(page.get_contents(), page["/Resources"])
+    return operations
+
+
+def close(expected, actual, tolerance=0.1) -> bool:
+    """Whether operands are equal, their numbers within ``tolerance``"""
+    if isinstance(expected, float) and isinstance(actual, float):
+        return abs(expected - actual) <= tolerance
+    if isinstance(expected, list) and isinstance(actual, list):
+        return len(expected) == len(actual) and all(
+            close(a, b, tolerance) for a, b in zip(expected, actual)
+        )
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return expected.keys() == actual.keys() and all(
+            close(expected[key], actual[key], tolerance) for key in expected
+        )
+    return expected == actual
+
+
+class Command(BaseCommand):
+    help = (
+        "Write minified copies of the SVG receipt templates, served instead "
+        "of the originals while they are up to date"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "templates",
+            nargs="*",
+            default=RECEIPT_TEMPLATES,
+            help="Templates to minify, all the receipt templates by default",
+        )
+        parser.add_argument(
+            "--precision",
+            type=int,
+            default=3,
+            help="Decimals kept in the coordinates",
+        )
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Render both versions with WeasyPrint for the latest "
+            "donation and check that the PDF draws the same operations",
+        )
+
+    def handle(self, *args, **options):
+        for template_name in options["templates"]:
+            source = source_path(template_name)
+            if not source.exists():
+                raise CommandError(f"Unknown template: {template_name}")
+            original = source.read_text()
+            assets = {}
+            minified = minify_svg(original, options["precision"], assets)
+            # Written first, the minified template is served once written
+            for name, data in assets.items():
+                if not (assets_root() / name).exists():
+                    write_atomic(assets_root() / name, data)
+            if options["verify"]:
+                self.verify(template_name, original, minified)
+
+            path = minified_root() / template_name
+            write_atomic(path, minified.encode())
+            stat = source.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            size = len(original.encode())
+            minified_size = len(minified.encode())
+            self.stdout.write(
+                f"{template_name}: {size} -> {minified_size} bytes "
+                f"({(minified_size - size) / size:+.0%}), parsed in "
+                f"{parse_time(original):.0f} -> {parse_time(minified):.0f} ms"
+                f", {len(assets)} images extracted"
+            )
+
+    def verify(self, template_name, original, minified):
+        context = receipt_context(sample_donation(template_name))
+        engine = engines["django"]
+        expected, actual = (
+            page_operations(
+                svg_to_pdf(engine.from_string(content).render(context))
+            )
+            for content in (original, minified)
+        )
+        if len(expected) != len(actual):
+            raise CommandError(
+                f"{template_name}: the minified template renders "
+                f"{len(actual)} drawing operations instead of {len(expected)}"
+            )
+        for (operator, operands), minified in zip(expected, actual):
+            if operator != minified[0] or not close(operands, minified[1]):
+                raise CommandError(
+                    f"{template_name}: the minified template renders "
+                    f"{minified[0].decode()} {minified[1]} "
+                    f"instead of {operator.decode()} {operands}, try a "
+                    "higher --precision"
+                )
+        self.stdout.write(f"{template_name}: rendering unchanged")
@@ -0,0 +1,37 @@
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...rendering.cache import evict, receipts_root, stats
+
+
+class Command(BaseCommand):
+    help = "Show the usage of the generated receipts cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clear", action="store_true", help="Remove every cached receipt"
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            shutil.rmtree(receipts_root(), ignore_errors=True)
+            # Counts the size of the cache again
+            evict(settings.CERFA_RECEIPTS_CACHE_SIZE)
+
+        files = list(receipts_root().glob("*/*/*.pdf"))
+        size = sum(path.stat().st_size for path in files)
+        self.stdout.write(
+            f"{len(files)} receipts, {size / 1024 / 1024:.1f} MiB in "
+            f"{receipts_root()}"
+        )
+        counters = stats()
+        requests = counters["hits"] + counters["misses"]
+        ratio = counters["hits"] / requests if requests else 0
+        self.stdout.write(
+            "{hits} hits, {misses} misses, {evictions} evictions".format(
+                **counters
+            )
+            + f" (hit ratio {ratio:.0%})"
+        )
@@ -0,0 +1,84 @@
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ...rendering.service import RenderPool, RenderServer
+from .minify_templates import RECEIPT_TEMPLATES
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the render service: a pool of warm processes rendering the "
+        "receipts of the web workers, reached over CERFA_RENDER_SOCKET"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--socket",
+            default=settings.CERFA_RENDER_SOCKET,
+            help="Path of the Unix socket (default: CERFA_RENDER_SOCKET)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of render processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--queue",
+            type=int,
+            default=None,
+            help=(
+                "Requests waiting for a process before new ones are rejected "
+                "(default: twice the number of processes)"
+            ),
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=settings.CERFA_RENDER_TIMEOUT,
+            help="Seconds before a render is killed "
+            "(default: CERFA_RENDER_TIMEOUT)",
+        )
+        parser.add_argument(
+            "--max-jobs",
+            type=int,
+            default=200,
+            help="Renders before a process is replaced (default: 200)",
+        )
+
+    def handle(self, *args, **options):
+        if not options["socket"]:
+            raise CommandError("No socket, set CERFA_RENDER_SOCKET")
+        workers = max(options["workers"], 1)
+        queue_size = options["queue"]
+        if queue_size is None:
+            queue_size = 2 * workers
+
+        # Render processes open their own database connections
+        connections.close_all()
+        pool = RenderPool(
+            workers,
+            queue_size,
+            options["timeout"],
+            options["max_jobs"],
+            args=(RECEIPT_TEMPLATES,),
+        )
+        server = RenderServer(options["socket"], pool)
+        # Stop cleanly when the container is stopped
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self.stdout.write(
+            f"Render service listening on {options['socket']} "
+            f"({workers} processes)"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(options["socket"])
+            pool.close()
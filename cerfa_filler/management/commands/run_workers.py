@@ -0,0 +1,170 @@
+import datetime
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import InterfaceError, OperationalError, connections
+from django.utils import timezone
+
+from ...models import RenderJob
+from ...rendering import receipt_context
+from ...rendering.cache import purge_rendered, render_ahead
+from .generate_receipts import MODELS
+
+# Longest wait between two attempts while the database is unavailable
+MAX_RETRY_DELAY = 300
+
+RECEIPTS = {
+    model._meta.model_name: (model, templates)
+    for model, templates in MODELS.values()
+}
+
+
+def render(job):
+    """Render the receipt of a job ahead of its download"""
+    model, templates = RECEIPTS[job.model_name]
+    render_ahead(
+        templates, receipt_context(model.objects.get(pk=job.object_id))
+    )
+
+
+def close_old_connections():
+    """Close the database connections dropped by the server or older than
+    CONN_MAX_AGE, as Django does around requests, except inside a
+    transaction (that of a test)"""
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def purge(keep):
+    """Remove the jobs done and their receipts after ``keep`` days"""
+    before = timezone.now() - datetime.timedelta(days=keep)
+    RenderJob.purge(before)
+    purge_rendered(before.timestamp())
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the receipts of the validated donations in the background, "
+        "so that they are only read from the receipts cache when downloaded"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Number of processes"
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Stop once there are no more jobs due",
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=5,
+            help="Seconds between two checks of the queue when it is empty",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Attempts before a job is marked as failed",
+        )
+        parser.add_argument(
+            "--backoff",
+            type=float,
+            default=30,
+            help="Seconds before the first retry, doubled on each retry",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=600,
+            help="Seconds after which a running job is considered stalled",
+        )
+        parser.add_argument(
+            "--keep",
+            type=float,
+            default=30,
+            help="Days the jobs done and their receipts are kept",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] <= 1:
+            self.work(options)
+            return
+
+        # Each worker opens its own database connection
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=self.work, args=(options,))
+            for _ in range(options["workers"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+    def work(self, options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        purged = None
+        delay = options["poll"]
+        while True:
+            # Connections dropped by the database, or older than
+            # CONN_MAX_AGE, are reopened, as at the start of a request
+            close_old_connections()
+            try:
+                job = RenderJob.claim(worker, options["timeout"])
+                if job is not None:
+                    self.run(worker, job, options)
+                # Idle, purged at most once an hour
+                elif purged is None or time.monotonic() - purged > 3600:
+                    purge(options["keep"])
+                    purged = time.monotonic()
+            except (OperationalError, InterfaceError) as error:
+                # The claimed job is claimed again once stalled
+                self.stderr.write(
+                    f"{worker}: database unavailable, retrying in "
+                    f"{delay:.0f} s: {error}"
+                )
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            finally:
+                close_old_connections()
+            delay = options["poll"]
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll"])
+
+    def run(self, worker, job, options):
+        start = time.perf_counter()
+        try:
+            render(job)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            job.fail(
+                traceback.format_exc(),
+                options["max_attempts"],
+                options["backoff"],
+            )
+            self.stderr.write(
+                f"{worker}: {job} failed (attempt {job.attempts})"
+            )
+        else:
+            job.finish()
+            if options["verbosity"] > 1:
+                self.stdout.write(
+                    f"{worker}: {job} in {time.perf_counter() - start:.2f} s"
+                )
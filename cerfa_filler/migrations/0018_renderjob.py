@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "cerfa_filler",
+            "0017_alter_companies_declarative_structure_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RenderJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model_name",
+                    models.CharField(max_length=100, verbose_name="Modèle"),
+                ),
+                ("object_id", models.UUIDField(verbose_name="Donation")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "En attente"),
+                            ("running", "En cours"),
+                            ("done", "Terminé"),
+                            ("failed", "Échec"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="Statut",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Essais"
+                    ),
+                ),
+                (
+                    "run_after",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        verbose_name="Exécuter après",
+                    ),
+                ),
+                (
+                    "locked_by",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("locked_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("timestamp_create", models.DateTimeField(auto_now_add=True)),
+                ("timestamp_update", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Rendu de reçu",
+                "verbose_name_plural": "Rendus de reçus",
+                "indexes": [
+                    models.Index(
+                        fields=["status", "run_after"],
+                        name="cerfa_fille_status_828128_idx",
+                    )
+                ],
+            },
+        ),
+    ]
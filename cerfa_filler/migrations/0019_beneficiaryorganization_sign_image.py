@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cerfa_filler", "0018_renderjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="beneficiaryorganization",
+            name="sign_image",
+            field=models.ImageField(
+                blank=True, editable=False, null=True, upload_to="signatures/"
+            ),
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:18
+
+from collections import defaultdict
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+from django.db.models.functions import ExtractYear
+
+
+def renumber_duplicates(apps, schema_editor):
+    # The earliest donation keeps an order number given twice in a year,
+    # the next ones get the following free numbers of the year
+    for model_name in ("companies", "privateindividual"):
+        model = apps.get_model("cerfa_filler", model_name)
+        donations = (
+            model.objects.filter(order__isnull=False)
+            .order_by("date_start", "timestamp_create")
+            .values_list("pk", "date_start", "order")
+        )
+        last_order = defaultdict(int)
+        given = set()
+        duplicates = []
+        for pk, date_start, order in donations:
+            year = date_start.year
+            last_order[year] = max(last_order[year], order)
+            if (year, order) in given:
+                duplicates.append((pk, year))
+            given.add((year, order))
+        for pk, year in duplicates:
+            last_order[year] += 1
+            model.objects.filter(pk=pk).update(order=last_order[year])
+
+
+def create_counters(apps, schema_editor):
+    # Start each counter at the last order number given in the year
+    OrderCounter = apps.get_model("cerfa_filler", "OrderCounter")
+    for model_name in ("companies", "privateindividual"):
+        model = apps.get_model("cerfa_filler", model_name)
+        years = (
+            model.objects.filter(order__isnull=False)
+            .annotate(year=ExtractYear("date_start"))
+            .values("year")
+            .annotate(last_order=models.Max("order"))
+        )
+        OrderCounter.objects.bulk_create(
+            OrderCounter(model_name=model_name, **year) for year in years
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cerfa_filler", "0019_beneficiaryorganization_sign_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model_name",
+                    models.CharField(max_length=100, verbose_name="Modèle"),
+                ),
+                ("year", models.PositiveIntegerField(verbose_name="Année")),
+                (
+                    "last_order",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Dernier numéro d'ordre"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Compteur de numéros d'ordre",
+                "verbose_name_plural": "Compteurs de numéros d'ordre",
+            },
+        ),
+        migrations.RunPython(
+            renumber_duplicates, reverse_code=migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="companies",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.datetime.ExtractYear("date_start"),
+                models.F("order"),
+                name="unique_companies_order",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="privateindividual",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.datetime.ExtractYear("date_start"),
+                models.F("order"),
+                name="unique_privateindividual_order",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ordercounter",
+            constraint=models.UniqueConstraint(
+                fields=("model_name", "year"), name="unique_order_counter"
+            ),
+        ),
+        migrations.RunPython(
+            create_counters, reverse_code=migrations.RunPython.noop
+        ),
+    ]
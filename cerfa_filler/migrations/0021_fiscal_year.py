@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:23
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cerfa_filler", "0020_order_counter"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="companies",
+            name="unique_companies_order",
+        ),
+        migrations.RemoveConstraint(
+            model_name="privateindividual",
+            name="unique_privateindividual_order",
+        ),
+        migrations.AddField(
+            model_name="companies",
+            name="fiscal_year",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.datetime.ExtractYear(
+                    "date_start"
+                ),
+                output_field=models.PositiveIntegerField(),
+                verbose_name="Année fiscale",
+            ),
+        ),
+        migrations.AddField(
+            model_name="privateindividual",
+            name="fiscal_year",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.datetime.ExtractYear(
+                    "date_start"
+                ),
+                output_field=models.PositiveIntegerField(),
+                verbose_name="Année fiscale",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="companies",
+            index=models.Index(
+                fields=["fiscal_year", "declarative_structure", "order"],
+                name="companies_year_structure_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="companies",
+            index=models.Index(
+                condition=models.Q(("valid_date__isnull", True)),
+                fields=["fiscal_year", "order"],
+                name="companies_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateindividual",
+            index=models.Index(
+                fields=["fiscal_year", "declarative_structure", "order"],
+                name="individuals_year_structure_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateindividual",
+            index=models.Index(
+                condition=models.Q(("valid_date__isnull", True)),
+                fields=["fiscal_year", "order"],
+                name="individuals_pending_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="companies",
+            constraint=models.UniqueConstraint(
+                fields=("fiscal_year", "order"), name="unique_companies_order"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="privateindividual",
+            constraint=models.UniqueConstraint(
+                fields=("fiscal_year", "order"),
+                name="unique_privateindividual_order",
+            ),
+        ),
+    ]
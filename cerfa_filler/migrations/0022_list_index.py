@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cerfa_filler", "0021_fiscal_year"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="companies",
+            index=models.Index(
+                fields=["date_start", "order", "uuid"],
+                name="companies_list_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="privateindividual",
+            index=models.Index(
+                fields=["date_start", "order", "uuid"],
+                name="individuals_list_idx",
+            ),
+        ),
+    ]
@@ -1,15 +1,24 @@
 import urllib.parse
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
 from typing import Optional
 from uuid import uuid4
 
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import ExtractYear, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template.defaultfilters import date
 from django.urls import reverse
 from django.utils.timezone import localtime as _localtime
 from django.utils.timezone import now
 from multi_email_field.fields import MultiEmailField
-from num2words import num2words
+
+from .amounts import amount_as_text
 
 
 def localtime(value):
@@ -73,13 +82,15 @@ class EmailBaseModel(models.Model):
     @property
     def mailto(self):
         if self.emails:
+            beneficiary = BeneficiaryOrganization.get_current()
+            label = beneficiary.label if beneficiary else "LPO AuRA"
             formattedBody = (
                 "Bonjour,\n\nVeuillez trouver ci-dessous le lien pour récupérer"
-                " le reçu fiscal suite à votre don à la LPO AuRA.\n\nEn vous remerciant"
+                f" le reçu fiscal suite à votre don à la {label}.\n\nEn vous remerciant"
                 f" pour votre soutien et votre générosité.\n\n{self.cerfa_url}\n\n"
                 "Je reste à votre disposition si nécessaire.\nBien cordialement,"
             )
-            formattedSubject = "Reçu fiscal LPO AuRA"
+            formattedSubject = f"Reçu fiscal {label}"
             mailto = (
                 f"mailto:{','.join(self.emails)}?subject={formattedSubject}"
                 f"&body={urllib.parse.quote(formattedBody)}"
@@ -158,6 +169,13 @@ class BeneficiaryOrganization(BaseOrganization, AddressBaseModel):
         null=True,
         blank=True,
     )
+    # Signature resized and optimized for the receipts on upload
+    sign_image = models.ImageField(
+        upload_to="signatures/",
+        editable=False,
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = "Organisme bénéficiaire"
@@ -166,6 +184,61 @@ class BeneficiaryOrganization(BaseOrganization, AddressBaseModel):
     def __str__(self):
         return self.label
 
+    @classmethod
+    def get_current(cls) -> Optional["BeneficiaryOrganization"]:
+        """Beneficiary organization of the receipts.
+
+        Cached in process until an organization is saved or deleted, which
+        changes its version in the shared cache for every process.
+        """
+        global _current_beneficiary
+        version = cache.get(BENEFICIARY_VERSION_KEY)
+        if version is None:
+            cache.add(BENEFICIARY_VERSION_KEY, uuid4().hex, timeout=None)
+            version = cache.get(BENEFICIARY_VERSION_KEY)
+        if _current_beneficiary[0] != version:
+            _current_beneficiary = (
+                version,
+                cls.objects.order_by("timestamp_create").first(),
+            )
+        return _current_beneficiary[1]
+
+    def save(self, *args, **kwargs):
+        previous = self.sign_image.name
+        if not self.sign_file:
+            self.sign_image = None
+        elif not self.sign_file._committed:
+            # New upload (imported here, the renderers import the models)
+            from .rendering.signature import normalize_signature
+
+            self.sign_file.open("rb")
+            data = normalize_signature(self.sign_file.read())
+            self.sign_file.seek(0)
+            name = f"{Path(self.sign_file.name).stem}.png"
+            self.sign_image.save(name, ContentFile(data), save=False)
+        super().save(*args, **kwargs)
+        if previous and previous != self.sign_image.name:
+            # Deleted once no longer referenced, kept if the save is rolled
+            # back
+            storage = self.sign_image.storage
+            transaction.on_commit(lambda: storage.delete(previous))
+
+
+BENEFICIARY_VERSION_KEY = "cerfa_filler:beneficiary:version"
+_current_beneficiary = (None, None)
+
+
+def bump_beneficiary_version():
+    cache.set(BENEFICIARY_VERSION_KEY, uuid4().hex, timeout=None)
+
+
+@receiver([post_save, post_delete], sender=BeneficiaryOrganization)
+def beneficiary_changed(**kwargs):
+    bump_beneficiary_version()
+    # Again once committed, in case another process cached the previous row
+    # in between
+    transaction.on_commit(bump_beneficiary_version)
+
 
 class CashDonationBaseModel(models.Model):
     cash_donation = models.DecimalField(
@@ -188,7 +261,7 @@ class CashDonationBaseModel(models.Model):
     @property
     def cash_donation_as_text(self) -> Optional[str]:
         if self.cash_donation:
-            return num2words(self.cash_donation, lang="fr", to="currency")
+            return amount_as_text(self.cash_donation)
 
 
 class InkindDonationBaseModel(models.Model):
@@ -212,7 +285,7 @@ class InkindDonationBaseModel(models.Model):
     @property
     def inkind_donation_as_text(self) -> Optional[str]:
         if self.inkind_donation:
-            return num2words(self.inkind_donation, lang="fr", to="currency")
+            return amount_as_text(self.inkind_donation)
 
 
 class CashAndInkindDonationBaseModel(
@@ -223,17 +296,102 @@ class CashAndInkindDonationBaseModel(
 
     @property
     def total_donation_as_text(self):
-        return num2words(
-            self.total_donation,
-            lang="fr",
-            to="currency",
-        )
+        return amount_as_text(self.total_donation)
 
     @property
     def total_donation(self):
         return (self.inkind_donation or 0) + (self.cash_donation or 0)
 
 
+class OrderCounter(models.Model):
+    """Last order number given to the donations of a model in a year"""
+
+    model_name = models.CharField(max_length=100, verbose_name="Modèle")
+    year = models.PositiveIntegerField(verbose_name="Année")
+    last_order = models.PositiveIntegerField(
+        default=0, verbose_name="Dernier numéro d'ordre"
+    )
+
+    class Meta:
+        verbose_name = "Compteur de numéros d'ordre"
+        verbose_name_plural = "Compteurs de numéros d'ordre"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_name", "year"], name="unique_order_counter"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} {self.year}: {self.last_order}"
+
+    @classmethod
+    def next_order(cls, model, year, count=1, after=0) -> int:
+        """Take the next ``count`` order numbers of ``model`` for ``year``,
+        above ``after``, and return the first one.
+
+        The counter row is incremented by a single UPDATE, which locks it
+        until the end of the transaction on PostgreSQL and the whole
+        database on SQLite: concurrent savers wait for each other instead
+        of reading the same numbers. Call it in the transaction saving the
+        donations, so that a failed save gives the numbers back.
+        """
+        counter = cls.objects.filter(
+            model_name=model._meta.model_name, year=year
+        )
+        while True:
+            with transaction.atomic():
+                if counter.update(
+                    last_order=Greatest(models.F("last_order"), after) + count
+                ):
+                    last_order = counter.values_list(
+                        "last_order", flat=True
+                    ).get()
+                    return last_order - count + 1
+            # First donation of the year, or of the model since the
+            # counters exist
+            latest = model.objects.filter(fiscal_year=year).aggregate(
+                order=models.Max("order")
+            )["order"]
+            first = max(latest or 0, after) + 1
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        model_name=model._meta.model_name,
+                        year=year,
+                        last_order=first + count - 1,
+                    )
+                    return first
+            except IntegrityError:
+                # Created meanwhile by another saver, increment it
+                continue
+
+
+class DonationQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Number the new donations with a block of order numbers per year,
+        in ``date_start`` order: as saving them one by one in that order
+        would, without a query per donation"""
+        objs = list(objs)
+        date_start = self.model._meta.get_field("date_start")
+        dates = {id(obj): date_start.to_python(obj.date_start) for obj in objs}
+        years = defaultdict(list)
+        for obj in sorted(objs, key=lambda obj: dates[id(obj)]):
+            years[dates[id(obj)].year].append(obj)
+        with transaction.atomic(using=self.db, savepoint=False):
+            for year, donations in years.items():
+                unnumbered = [obj for obj in donations if not obj.order]
+                if not unnumbered:
+                    continue
+                # Above the numbers given with the donations
+                after = max((obj.order or 0 for obj in donations), default=0)
+                first = OrderCounter.next_order(
+                    self.model, year, len(unnumbered), after
+                )
+                for order, obj in enumerate(unnumbered, first):
+                    obj.order = order
+            return super().bulk_create(objs, *args, **kwargs)
+
+
 class DonationMetadataBaseModel(models.Model):
     order = models.IntegerField(
         verbose_name="Numéro d'ordre",
@@ -250,6 +408,13 @@ class DonationMetadataBaseModel(models.Model):
     date_start = models.DateField(
         default=now, verbose_name="Date du don ou du début de donation"
     )
+    # Stored by the database, for the filters and indexes on the year
+    fiscal_year = models.GeneratedField(
+        expression=ExtractYear("date_start"),
+        output_field=models.PositiveIntegerField(),
+        db_persist=True,
+        verbose_name="Année fiscale",
+    )
     date_end = models.DateField(
         null=True, blank=True, verbose_name="Date de fin de la donation"
     )
@@ -262,6 +427,8 @@ class DonationMetadataBaseModel(models.Model):
         on_delete=models.DO_NOTHING,
     )
 
+    objects = DonationQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
@@ -273,16 +440,39 @@ class DonationMetadataBaseModel(models.Model):
     def order_number(self):
         return f"{self.year}-{self.order}"
 
-    def save(self, *args, **kwargs):
-        if not self.order:
-            current_model = self.__class__
-            latest_record = (
-                current_model.objects.filter(date_start__year=self.year)
-                .order_by("order")
-                .last()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Year of the stored order number, see save()
+        if "date_start" in instance.__dict__:
+            instance._stored_year = instance.date_start.year
+        return instance
+
+    def stored_year(self) -> Optional[int]:
+        if self._state.adding:
+            return None
+        if getattr(self, "_stored_year", None) is None:
+            self._stored_year = (
+                type(self)
+                .objects.filter(pk=self.pk)
+                .values_list("fiscal_year", flat=True)
+                .first()
             )
-            self.order = latest_record.order + 1 if latest_record else 1
-        super().save(*args, **kwargs)
+        return self._stored_year
+
+    def save(self, *args, **kwargs):
+        stored_year = self.stored_year()
+        if self.order and stored_year in (None, self.year):
+            super().save(*args, **kwargs)
+        else:
+            # New donation, or moved to another year: numbered in the year
+            # of its date
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "order"}
+            with transaction.atomic():
+                self.order = OrderCounter.next_order(self.__class__, self.year)
+                super().save(*args, **kwargs)
+        self._stored_year = self.year
 
 
 class Companies(
@@ -315,6 +505,30 @@ class Companies(
             ("change_validation", "Can change the validation status"),
             ("send_email", "Can send email"),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["fiscal_year", "order"],
+                name="unique_companies_order",
+            )
+        ]
+        indexes = [
+            # Lists filtered on the year and the structure
+            models.Index(
+                fields=["fiscal_year", "declarative_structure", "order"],
+                name="companies_year_structure_idx",
+            ),
+            # Donations waiting for their validation
+            models.Index(
+                fields=["fiscal_year", "order"],
+                condition=models.Q(valid_date__isnull=True),
+                name="companies_pending_idx",
+            ),
+            # Keyset of the pages of the lists
+            models.Index(
+                fields=["date_start", "order", "uuid"],
+                name="companies_list_idx",
+            ),
+        ]
 
     @property
     def cerfa_url(self):
@@ -347,6 +561,30 @@ class PrivateIndividual(
             ("change_validation", "Can change the validation status"),
             ("send_email", "Can send email"),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["fiscal_year", "order"],
+                name="unique_privateindividual_order",
+            )
+        ]
+        indexes = [
+            # Lists filtered on the year and the structure
+            models.Index(
+                fields=["fiscal_year", "declarative_structure", "order"],
+                name="individuals_year_structure_idx",
+            ),
+            # Donations waiting for their validation
+            models.Index(
+                fields=["fiscal_year", "order"],
+                condition=models.Q(valid_date__isnull=True),
+                name="individuals_pending_idx",
+            ),
+            # Keyset of the pages of the lists
+            models.Index(
+                fields=["date_start", "order", "uuid"],
+                name="individuals_list_idx",
+            ),
+        ]
 
     @property
     def full_name(self):
@@ -365,3 +603,117 @@ class PrivateIndividual(
 
     def __str__(self):
         return f"{self.full_name}"
+
+
+class RenderJob(models.Model):
+    """Receipt to render in the background (see the run_workers command)"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS = {
+        PENDING: "En attente",
+        RUNNING: "En cours",
+        DONE: "Terminé",
+        FAILED: "Échec",
+    }
+
+    model_name = models.CharField(max_length=100, verbose_name="Modèle")
+    object_id = models.UUIDField(verbose_name="Donation")
+    status = models.CharField(
+        max_length=10, choices=STATUS, default=PENDING, verbose_name="Statut"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Essais")
+    run_after = models.DateTimeField(
+        default=now, verbose_name="Exécuter après"
+    )
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    timestamp_create = models.DateTimeField(auto_now_add=True, editable=False)
+    timestamp_update = models.DateTimeField(auto_now=True, editable=False)
+
+    class Meta:
+        verbose_name = "Rendu de reçu"
+        verbose_name_plural = "Rendus de reçus"
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"{self.model_name} {self.object_id} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, queryset):
+        """Add a job for each donation of ``queryset`` that has none
+        waiting yet"""
+        model_name = queryset.model._meta.model_name
+        waiting = cls.objects.filter(
+            model_name=model_name, status=cls.PENDING
+        ).values_list("object_id", flat=True)
+        cls.objects.bulk_create(
+            cls(model_name=model_name, object_id=pk)
+            for pk in queryset.exclude(pk__in=waiting).values_list(
+                "pk", flat=True
+            )
+        )
+
+    @classmethod
+    def claim(cls, worker, timeout) -> Optional["RenderJob"]:
+        """Lock the next job due for ``worker``.
+
+        Jobs left running for more than ``timeout`` seconds by a crashed
+        worker are claimed again.
+        """
+        current = now()
+        claimable = models.Q(status=cls.PENDING, run_after__lte=current) | (
+            models.Q(
+                status=cls.RUNNING,
+                locked_at__lt=current - timedelta(seconds=timeout),
+            )
+        )
+        for job in cls.objects.filter(claimable).order_by("run_after")[:10]:
+            # Only one worker can switch the job from the state it read
+            claimed = cls.objects.filter(
+                pk=job.pk, status=job.status, locked_at=job.locked_at
+            ).update(
+                status=cls.RUNNING,
+                locked_by=worker,
+                locked_at=current,
+                attempts=models.F("attempts") + 1,
+            )
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
+
+    @classmethod
+    def purge(cls, before):
+        """Delete the jobs done before ``before``"""
+        cls.objects.filter(
+            status=cls.DONE, timestamp_update__lt=before
+        ).delete()
+
+    def finish(self):
+        self.status = self.DONE
+        self.last_error = None
+        self.save(update_fields=["status", "last_error", "timestamp_update"])
+
+    def fail(self, error, max_attempts, backoff):
+        """Retry the job after an exponential backoff, ``backoff`` seconds
+        at first, or give up after ``max_attempts``"""
+        self.last_error = error
+        if self.attempts >= max_attempts:
+            self.status = self.FAILED
+        else:
+            self.status = self.PENDING
+            self.run_after = now() + timedelta(
+                seconds=backoff * 2 ** (self.attempts - 1)
+            )
+        self.save(
+            update_fields=[
+                "status",
+                "run_after",
+                "last_error",
+                "timestamp_update",
+            ]
+        )
@@ -0,0 +1,112 @@
+"""Keyset pagination of the lists of donations.
+
+A page is found with a WHERE on the ordering columns of the list, after
+the last row of the previous page (or before the first row of the next
+page), instead of an OFFSET which reads all the rows before it: every page
+costs the same as the first one. The cursor in the links is the values of
+these columns for that row. The last ordering column must be unique and
+none of them null.
+"""
+
+import base64
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+@dataclass
+class Page:
+    object_list: list
+    next_cursor: Optional[str] = None
+    previous_cursor: Optional[str] = None
+
+
+def encode_cursor(values) -> str:
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    # Values are encoded as strings (dates, decimals, uuids) or integers
+    if (
+        not isinstance(values, list)
+        or len(values) != length
+        or any(
+            isinstance(value, bool) or not isinstance(value, (str, int))
+            for value in values
+        )
+    ):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def reverse_ordering(ordering) -> tuple:
+    return tuple(
+        field[1:] if field.startswith("-") else f"-{field}"
+        for field in ordering
+    )
+
+
+def following(ordering, values) -> Q:
+    """Rows after ``values`` in ``ordering``: the first column greater, or
+    equal and the second one greater..."""
+    condition = None
+    for field, value in reversed(list(zip(ordering, values))):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        greater = Q(**{f"{name}__{lookup}": value})
+        condition = (
+            greater
+            if condition is None
+            else greater | Q(**{name: value}) & condition
+        )
+    # Redundant, but lets the database seek in the index of the ordering
+    # instead of scanning it from the start
+    field, value = ordering[0], values[0]
+    lookup = "lte" if field.startswith("-") else "gte"
+    return Q(**{f"{field.lstrip('-')}__{lookup}": value}) & condition
+
+
+def cursor_of(row, ordering) -> str:
+    return encode_cursor(
+        [getattr(row, field.lstrip("-")) for field in ordering]
+    )
+
+
+def paginate(queryset, ordering, params, size) -> Page:
+    """Page of ``queryset`` sorted by ``ordering``, following the ``after``
+    or preceding the ``before`` cursor of ``params``"""
+    cursor, backwards = params.get("after"), False
+    if not cursor and params.get("before"):
+        cursor, backwards = params["before"], True
+    ordering_used = reverse_ordering(ordering) if backwards else ordering
+    queryset = queryset.order_by(*ordering_used)
+    if cursor:
+        try:
+            queryset = queryset.filter(
+                following(ordering_used, decode_cursor(cursor, len(ordering)))
+            )
+        except (ValueError, ValidationError):
+            # Tampered or outdated link, back to the first page
+            return paginate(queryset, ordering, {}, size)
+
+    rows = list(queryset[: size + 1])
+    more, rows = len(rows) > size, rows[:size]
+    if backwards:
+        rows.reverse()
+    page = Page(rows)
+    if rows and (more or backwards):
+        page.next_cursor = cursor_of(rows[-1], ordering)
+    if rows and (more if backwards else cursor):
+        page.previous_cursor = cursor_of(rows[0], ordering)
+    return page
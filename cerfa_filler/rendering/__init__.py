@@ -0,0 +1,69 @@
+"""PDF rendering of the CERFA receipts"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from . import acroform, cairo, overlay, weasy
+from .optimize import optimize_pdf
+from .signature import signature_data
+from .weasy import render_svg
+
+# A renderer is a function rendering the PDF of a receipt from its
+# templates and context, settings refer to it by name or by dotted path
+RENDERERS = {
+    "weasyprint": weasy.render_receipt,
+    "weasyprint-single": weasy.render_document,
+    "cairosvg": cairo.render_receipt,
+    "overlay": overlay.render_receipt,
+    "acroform": acroform.render_receipt,
+}
+
+
+def receipt_context(donor) -> dict:
+    """Context of the receipt templates of a donation"""
+    # Imported here so that the render processes (see .service) can load
+    # this package before setting up Django
+    from ..models import BeneficiaryOrganization
+
+    company = BeneficiaryOrganization.get_current()
+    return {
+        "object": donor,
+        "company": company,
+        "sign_file": signature_data(company),
+    }
+
+
+def get_renderer(context) -> str:
+    """Name of the renderer configured for the donor model"""
+    return settings.CERFA_RENDERERS.get(
+        context["object"]._meta.model_name, settings.CERFA_RENDERER
+    )
+
+
+def load_renderer(renderer):
+    """Renderer function of a name of :data:`RENDERERS` or a dotted path"""
+    if renderer in RENDERERS:
+        return RENDERERS[renderer]
+    try:
+        return import_string(renderer)
+    except ImportError:
+        raise ImproperlyConfigured(f"Unknown receipt renderer: {renderer}")
+
+
+def render_receipt(templates, context, renderer=None) -> bytes:
+    """Render a receipt with the given renderer, or the one configured for
+    the donor model, optimized for ``CERFA_PDF_TARGET``"""
+    render = load_renderer(renderer or get_renderer(context))
+    return optimize_pdf(render(templates, context), settings.CERFA_PDF_TARGET)
+
+
+__all__ = [
+    "RENDERERS",
+    "get_renderer",
+    "load_renderer",
+    "receipt_context",
+    "render_receipt",
+    "render_svg",
+    "signature_data",
+]
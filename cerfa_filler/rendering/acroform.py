@@ -0,0 +1,263 @@
+"""Official CERFA forms rendering engine.
+
+Instead of the SVG templates, the receipts are printed on the official PDF
+forms shipped in ``data/``:
+
+* 2041-MEC-SD (companies) is an AcroForm, its fields are filled then
+  flattened into the page content so that the receipt can't be edited;
+* 2041-RD (individuals) has no form field, the values are stamped at fixed
+  positions, in PDF points.
+
+No WeasyPrint is involved and the output only depends on the donation and
+the beneficiary organization: rendering twice gives the same bytes. The
+fonts of the forms and of the stamped values only cover WinAnsi (cp1252):
+a receipt with any other character is rendered from the SVG templates by
+WeasyPrint instead.
+"""
+
+import base64
+import io
+import logging
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.utils import dateformat
+from django.utils.formats import localize
+from pypdf import PdfWriter
+from pypdf.generic import NameObject
+
+from . import weasy
+from .layouts import CheckboxSlot, PageLayout, TextSlot, resolve
+from .stamp import PointOverlay, UnencodableText, encode, stamp
+
+logger = logging.getLogger(__name__)
+
+
+class FormField(NamedTuple):
+    """A text field of an AcroForm, filled with ``variable`` (which may be
+    a quoted constant, as in templates).
+
+    ``date_format`` formats dates with the ``date`` template filter syntax,
+    the value is truncated to ``max_length`` characters and split on the
+    ``overflow`` field past ``wrap`` characters.
+    """
+
+    name: str
+    variable: str
+    default: str = ""
+    date_format: Optional[str] = None
+    max_length: Optional[int] = None
+    overflow: Optional[str] = None
+    wrap: Optional[int] = None
+
+    def resolve(self, context) -> dict:
+        value = resolve(self.variable, context)
+        if value in (None, ""):
+            value = self.default
+        elif self.date_format:
+            value = dateformat.format(value, self.date_format)
+        else:
+            value = str(localize(value))
+        value = value[: self.max_length]
+        if self.overflow and len(value) > self.wrap:
+            head, _, tail = value[: self.wrap + 1].rpartition(" ")
+            head = head or value[: self.wrap]
+            return {self.name: head, self.overflow: value[len(head) :].strip()}
+        return {self.name: value}
+
+
+class FormCheckbox(NamedTuple):
+    """A checkbox of an AcroForm, set to ``state`` when ``variable`` is one
+    of ``values``"""
+
+    name: str
+    state: str
+    variable: str
+    values: tuple
+
+    def resolve(self, context) -> dict:
+        if resolve(self.variable, context) in self.values:
+            return {self.name: self.state}
+        return {}
+
+
+class OfficialForm(NamedTuple):
+    filename: str
+    # Fields of each page, AcroForm checkboxes may share their name with a
+    # checkbox of another page so they have to be filled page by page
+    fields: tuple = ()
+    # Stamped texts and checkboxes of each page, in PDF points
+    layouts: tuple = ()
+    # Box of the signature image: lower left and upper right corners
+    signature: Optional[tuple] = None
+
+
+def _cash_payment(name, state, *values):
+    return FormCheckbox(name, state, "object.cash_payment_type", values)
+
+
+OFFICIAL_FORMS = {
+    "companies": OfficialForm(
+        "2041-mec-sd_4811.pdf",
+        fields=(
+            (
+                FormField("a1", "object.order_number"),
+                FormField("a2", "company.label", overflow="a3", wrap=70),
+                FormField("a4", "company.repository_code"),
+                FormField("a5", "company.street_number"),
+                FormField("a6", "company.street"),
+                FormField("a7", "company.postal_code"),
+                FormField("a8", "company.municipality"),
+                FormField("a9", '"France"'),
+                FormField("a10", "company.object_description"),
+            ),
+            (
+                FormField("b4", "object.label"),
+                FormField("b5", "object.legal_status.label"),
+                FormField("b6", "object.repository_code", max_length=9),
+                FormField("b7", "object.street_number"),
+                FormField("b8", "object.street"),
+                FormField("b9", "object.postal_code"),
+                FormField("b10", "object.municipality"),
+                FormField("b11", "object.inkind_donation", max_length=15),
+                FormField(
+                    "b12",
+                    "object.inkind_donation_as_text",
+                    overflow="b13",
+                    wrap=40,
+                ),
+                FormField("b14", "object.inkind_donation_description"),
+                FormField("b15", "object.cash_donation", max_length=15),
+                FormField(
+                    "b16",
+                    "object.cash_donation_as_text",
+                    overflow="b17",
+                    wrap=50,
+                ),
+                _cash_payment("CAC2", "/A", "Cash"),
+                _cash_payment("CAC3", "/A", "Cheque"),
+                _cash_payment("CAC4", "/A", "Bank transfer", "CB"),
+                _cash_payment("CAC5", "/A", "Other"),
+                FormField("b18", "object.total_donation", max_length=15),
+                FormField(
+                    "b19",
+                    "object.total_donation_as_text",
+                    overflow="b20",
+                    wrap=35,
+                ),
+                FormField("b21", "object.date_start", date_format="d"),
+                FormField("b22", "object.date_start", date_format="m"),
+                FormField("b23", "object.date_start", date_format="Y"),
+                FormField("b24", "object.date_end", date_format="d"),
+                FormField("b25", "object.date_end", date_format="m"),
+                FormField("b26", "object.date_end", date_format="Y"),
+                FormField("b27", "object.valid_date", date_format="d/m/Y"),
+            ),
+        ),
+        signature=(1, (400, 160), (560, 200)),
+    ),
+    "privateindividual": OfficialForm(
+        "2041-rd_4298.pdf",
+        layouts=(
+            PageLayout(
+                texts=(
+                    TextSlot("object.order_number", 493, 718, 11, "middle"),
+                    TextSlot("company.label", 165, 675, 10),
+                    TextSlot("company.repository_code", 195, 655, 10),
+                    TextSlot("company.street_number", 52, 627, 10),
+                    TextSlot("company.street", 135, 627, 10),
+                    TextSlot("company.postal_code", 97, 613, 10),
+                    TextSlot("company.municipality", 232, 613, 10),
+                    TextSlot('"France"', 65, 601, 10),
+                    TextSlot("company.object_description", 72, 588, 10),
+                ),
+            ),
+            PageLayout(
+                texts=(
+                    TextSlot("object.last_name", 64, 595, 10),
+                    TextSlot("object.first_name", 355, 594, 10),
+                    TextSlot("object.street_number", 51, 564, 10),
+                    TextSlot("object.street", 135, 564, 10),
+                    TextSlot("object.postal_code", 98, 550, 10),
+                    TextSlot("object.municipality", 232, 550, 10),
+                    TextSlot('"France"', 66, 535, 10),
+                    TextSlot("object.cash_donation", 48, 478, 10),
+                    TextSlot("object.cash_donation_as_text", 355, 482, 9),
+                    TextSlot("object.date_start", 203, 464, 9),
+                    TextSlot("object.valid_date", 312, 207, 10),
+                ),
+                checkboxes=(
+                    CheckboxSlot("object.donation_nature", "Cash", 34, 320, 9),
+                    CheckboxSlot(
+                        "object.donation_nature", "Waiver", 34, 300, 9
+                    ),
+                    CheckboxSlot(
+                        "object.cash_payment_type", "Cash", 34, 252, 9
+                    ),
+                    CheckboxSlot(
+                        "object.cash_payment_type", "Cheque", 150, 252, 9
+                    ),
+                    CheckboxSlot(
+                        "object.cash_payment_type",
+                        ("Bank transfer", "CB"),
+                        290,
+                        252,
+                        9,
+                    ),
+                ),
+            ),
+        ),
+        signature=(1, (400, 182), (515, 226)),
+    ),
+}
+
+
+@lru_cache(maxsize=4)
+def _read(filename) -> bytes:
+    return (settings.BASE_DIR / "data" / filename).read_bytes()
+
+
+def render_form(form: OfficialForm, context) -> bytes:
+    writer = PdfWriter(clone_from=io.BytesIO(_read(form.filename)))
+    for number, page in enumerate(writer.pages):
+        if number < len(form.fields):
+            values = {}
+            if number == 0:
+                values.update(settings.CERFA_ACROFORM_FIELDS)
+            for field in form.fields[number]:
+                values.update(field.resolve(context))
+            for value in values.values():
+                encode(value)
+            writer.update_page_form_field_values(
+                page, values, auto_regenerate=False, flatten=True
+            )
+
+        overlay = PointOverlay(page.mediabox.width, page.mediabox.height)
+        if number < len(form.layouts):
+            overlay.draw(form.layouts[number], context)
+        sign_file = context.get("sign_file")
+        if form.signature and form.signature[0] == number and sign_file:
+            overlay.image(form.signature[1:], base64.b64decode(sign_file))
+        stamp(page, overlay)
+
+    # Flattened: drop the widgets and the form itself
+    writer.remove_annotations(subtypes="/Widget")
+    if "/AcroForm" in writer.root_object:
+        del writer.root_object[NameObject("/AcroForm")]
+
+    output_pdf = io.BytesIO()
+    writer.write(output_pdf)
+    return output_pdf.getvalue()
+
+
+def render_receipt(templates, context) -> bytes:
+    """Render the receipt on the official form of the donor model, the SVG
+    ``templates`` are only used for the text the forms can't print"""
+    try:
+        return render_form(
+            OFFICIAL_FORMS[context["object"]._meta.model_name], context
+        )
+    except UnencodableText as error:
+        logger.info("Laid out by WeasyPrint, unencodable text: %s", error)
+        return weasy.render_receipt(templates, context)
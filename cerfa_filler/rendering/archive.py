@@ -0,0 +1,37 @@
+"""ZIP archives of receipts, streamed while they are rendered."""
+
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+
+class _Buffer:
+    """Unseekable file collecting what the archive writes, so that
+    ``zipfile`` writes the sizes in data descriptors after each member"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Chunks of a ZIP archive of ``(name, data)`` files, each file being
+    yielded as soon as it is produced by ``files``"""
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in files:
+            # PDF streams are already compressed
+            with archive.open(name, "w") as member:
+                member.write(data)
+            yield buffer.pop()
+    yield buffer.pop()
@@ -0,0 +1,188 @@
+"""Receipts of a batch merged into a single PDF, for postal mailing.
+
+Concatenating the receipts would repeat the fonts, images and vector
+artwork of every page in each receipt. Here the donor-independent page of
+each template (see :mod:`.pages`) is added once to the document as a form
+XObject, and every page of a receipt is a short content stream drawing
+that form and stamping the fields of the donation on top of it, so the
+document only grows by a few kilobytes per receipt.
+
+Only the ``overlay`` renderer produces its receipts that way (see
+:data:`BACKGROUNDS`), so the pages of the other renderers are the receipts
+they render, taken from the cache (see :mod:`.cache`): the identical fonts
+and images of their pages are then merged when the document is optimized.
+A receipt with text the standard fonts can't print (see :mod:`.stamp`) is
+added as it is rendered too.
+
+The document is linearized with ``qpdf`` when it is installed, so that
+viewers can show the first pages before the whole file is read.
+"""
+
+import io
+import logging
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from pypdf import PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+)
+
+from . import get_renderer, weasy
+from .cache import cached_receipt
+from .layouts import LAYOUTS
+from .optimize import optimize
+from .pages import static_page
+from .stamp import Overlay, UnencodableText
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_NAME = "/CerfaBg"
+
+# SVG engine of the backgrounds of the renderers stamping the fields
+BACKGROUNDS = {
+    "overlay": weasy.render_svg,
+}
+
+
+def form_xobject(writer, page) -> IndirectObject:
+    """Form XObject drawing ``page``, added to ``writer``"""
+    form = DecodedStreamObject()
+    form.set_data(page.get_contents().get_data())
+    form.update(
+        {
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject(
+                FloatObject(value) for value in page.mediabox
+            ),
+            NameObject("/Resources"): page["/Resources"].clone(writer),
+        }
+    )
+    return writer._add_object(form.flate_encode())
+
+
+class Batch:
+    """Single PDF document of the receipts of many donations"""
+
+    def __init__(self, render=None, target="print", receipt=None):
+        # Engine of every background, instead of the configured ones
+        self.render = render
+        self.target = target
+        # Receipts of the other renderers
+        self.receipt = receipt or cached_receipt
+        self.writer = PdfWriter()
+        self.backgrounds = {}
+        self.fonts = None
+
+    def background(self, template_name, company, render):
+        key = (template_name, company.pk if company else None, render)
+        if key not in self.backgrounds:
+            page = static_page(template_name, company, render)
+            self.backgrounds[key] = (
+                form_xobject(self.writer, page),
+                page.mediabox,
+            )
+        return self.backgrounds[key]
+
+    def add(self, templates, context):
+        """Append the pages of a receipt"""
+        render = self.render or BACKGROUNDS.get(get_renderer(context))
+        if render is None:
+            self.append(templates, context)
+            return
+
+        overlays = []
+        for template in templates:
+            form, mediabox = self.background(
+                template, context["company"], render
+            )
+            overlay = Overlay(mediabox.width, mediabox.height)
+            try:
+                overlay.draw(LAYOUTS[template], context)
+            except UnencodableText as error:
+                logger.info("Added as rendered, unencodable text: %s", error)
+                self.append(templates, context)
+                return
+            overlays.append((form, mediabox, overlay))
+
+        # Stamped once all the fields are printable
+        for form, mediabox, overlay in overlays:
+            if self.fonts is None:
+                # Every page shares the font of the stamped fields
+                self.fonts = self.writer._add_object(
+                    overlay.resources()["/Font"]
+                )
+
+            content = DecodedStreamObject()
+            content.set_data(
+                b"q %s Do Q\n0 g\n" % BACKGROUND_NAME.encode()
+                + b"\n".join(overlay.operations)
+            )
+            page = self.writer.add_blank_page(mediabox.width, mediabox.height)
+            page[NameObject("/Resources")] = DictionaryObject(
+                {
+                    NameObject("/Font"): self.fonts,
+                    NameObject("/XObject"): DictionaryObject(
+                        {NameObject(BACKGROUND_NAME): form}
+                    ),
+                }
+            )
+            page[NameObject("/Contents")] = self.writer._add_object(
+                content.flate_encode()
+            )
+
+    def append(self, templates, context):
+        """Append the pages of the receipt as it is rendered"""
+        self.writer.append(io.BytesIO(self.receipt(templates, context)))
+
+    def write(self) -> bytes:
+        optimize(self.writer, self.target)
+        output = io.BytesIO()
+        self.writer.write(output)
+        return linearize(output.getvalue())
+
+
+def linearize(pdf: bytes) -> bytes:
+    """Linearized copy of ``pdf``, or ``pdf`` itself without ``qpdf``"""
+    qpdf = shutil.which("qpdf")
+    if qpdf is None:
+        logger.warning("qpdf is not installed, the PDF is not linearized")
+        return pdf
+    with tempfile.TemporaryDirectory() as directory:
+        source = Path(directory) / "source.pdf"
+        target = Path(directory) / "linearized.pdf"
+        source.write_bytes(pdf)
+        subprocess.run(
+            [
+                qpdf,
+                "--linearize",
+                "--warning-exit-0",
+                "--object-streams=generate",
+                str(source),
+                str(target),
+            ],
+            check=True,
+        )
+        return target.read_bytes()
+
+
+def merge_receipts(
+    receipts, render=None, target="print", receipt=None
+) -> bytes:
+    """Single PDF of the ``(templates, context)`` receipts, optimized for
+    ``target`` (see :mod:`.optimize`), their backgrounds drawn by ``render``
+    or the engine of the configured renderers. The receipts of the other
+    renderers come from ``receipt(templates, context)``, the cache by
+    default."""
+    batch = Batch(render, target, receipt)
+    for templates, context in receipts:
+        batch.add(templates, context)
+    return batch.write()
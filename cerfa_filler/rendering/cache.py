@@ -0,0 +1,237 @@
+"""On-disk cache of the generated receipts.
+
+A receipt is stored under ``CERFA_CACHE_ROOT/receipts`` (sharded on the
+first characters of its key), its key hashing everything it is rendered
+from: the fields of the donation, the beneficiary organization, the
+renderer and the templates. Any change thus gives a new key, and the
+receipts that are no longer used are evicted, least recently used first,
+once the cache grows over ``CERFA_RECEIPTS_CACHE_SIZE`` bytes. The size of
+the cache is counted as the receipts are written, the tree is only walked
+to evict them.
+
+The receipts rendered ahead by the background workers are stored apart,
+under ``CERFA_CACHE_ROOT/rendered``, and never evicted: they are kept until
+their job is purged (see the run_workers command), even when the cache is
+disabled.
+"""
+
+import datetime
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import get_renderer, render_receipt
+from .pages import (
+    beneficiary_version,
+    cache_root,
+    template_mtime,
+    template_version,
+    write_atomic,
+)
+
+STATS_KEY = "cerfa_filler:receipts_cache:{}"
+SIZE_KEY = STATS_KEY.format("size")
+# Evicted below the bound, not to walk the tree again on the next miss
+EVICT_RATIO = 0.9
+
+
+def receipts_root() -> Path:
+    return cache_root() / "receipts"
+
+
+def donor_version(donor) -> str:
+    """Hash of the fields of a donation, which are not always saved with a
+    new ``timestamp_update`` (see ``UpdateValidDate``), and of the objects
+    it refers to, whose labels are printed (``legal_status.label``)"""
+    fields = [donor._meta.label]
+    for field in donor._meta.concrete_fields:
+        fields.append(f"{field.attname}={field.value_to_string(donor)}")
+        related = getattr(donor, field.name) if field.is_relation else None
+        if related is not None:
+            fields.extend(
+                f"{field.name}.{related_field.attname}="
+                f"{related_field.value_to_string(related)}"
+                for related_field in related._meta.concrete_fields
+            )
+    return hashlib.sha256("\n".join(fields).encode()).hexdigest()
+
+
+def receipt_key(templates, context, renderer) -> str:
+    return hashlib.sha256(
+        ":".join(
+            (
+                renderer,
+                settings.CERFA_PDF_TARGET,
+                donor_version(context["object"]),
+                beneficiary_version(context["company"]),
+                *(
+                    f"{template}={template_version(template)}"
+                    for template in templates
+                ),
+            )
+        ).encode()
+    ).hexdigest()
+
+
+def receipt_etag(templates, context) -> str:
+    """Strong ETag of a receipt, known without rendering it"""
+    return f'"{receipt_key(templates, context, get_renderer(context))}"'
+
+
+def receipt_last_modified(templates, context) -> datetime.datetime:
+    """Last change of the donation, beneficiary organization or templates
+    of a receipt"""
+    dates = [context["object"].timestamp_update]
+    if context["company"] is not None:
+        dates.append(context["company"].timestamp_update)
+    dates.extend(template_mtime(template) for template in templates)
+    return max(dates)
+
+
+def receipt_path(key) -> Path:
+    return receipts_root() / key[:2] / key[2:4] / f"{key}.pdf"
+
+
+def rendered_root() -> Path:
+    return cache_root() / "rendered"
+
+
+def rendered_path(key) -> Path:
+    return rendered_root() / key[:2] / f"{key}.pdf"
+
+
+def render_ahead(templates, context):
+    """Render a receipt for a background job"""
+    renderer = get_renderer(context)
+    key = receipt_key(templates, context, renderer)
+    path = rendered_path(key)
+    if path.exists():
+        # Kept as long as the latest job that rendered it
+        os.utime(path)
+        return
+    try:
+        data = receipt_path(key).read_bytes()
+    except FileNotFoundError:
+        data = render_receipt(templates, context, renderer)
+    write_atomic(path, data)
+
+
+def purge_rendered(before: float):
+    """Remove the receipts rendered ahead before the ``before`` timestamp"""
+    for path in rendered_root().glob("*/*.pdf"):
+        try:
+            if path.stat().st_mtime < before:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def count(name):
+    key = STATS_KEY.format(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted in between
+        cache.set(key, 1, timeout=None)
+
+
+def stats() -> dict:
+    return {
+        name: cache.get(STATS_KEY.format(name), 0)
+        for name in ("hits", "misses", "evictions")
+    }
+
+
+def add_size(size, max_size):
+    """Count a receipt written in the cache, evicting receipts once it is
+    over ``max_size`` bytes"""
+    try:
+        total = cache.incr(SIZE_KEY, size)
+    except ValueError:
+        # Not counted yet, or evicted from the Django cache
+        total = None
+    if total is None or total > max_size:
+        evict(max_size)
+
+
+def evict(max_size):
+    """Remove the least recently used receipts until the cache fits in
+    ``EVICT_RATIO`` of ``max_size`` bytes"""
+    files = []
+    total = 0
+    for path in receipts_root().glob("*/*/*.pdf"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    if total > max_size:
+        files.sort()
+        for _, size, path in files:
+            if total <= max_size * EVICT_RATIO:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            count("evictions")
+    cache.set(SIZE_KEY, total, timeout=None)
+
+
+def open_receipt(templates, context, render=None, store=True) -> BinaryIO:
+    """Receipt file from the cache, rendered and stored on cache miss.
+
+    ``render(templates, context, renderer)`` defaults to ``render_receipt``.
+    Without ``store``, the cache is only read: a bulk run then neither
+    stores its receipts nor evicts those that are downloaded.
+    """
+    render = render or render_receipt
+    max_size = settings.CERFA_RECEIPTS_CACHE_SIZE
+    renderer = get_renderer(context)
+    key = receipt_key(templates, context, renderer)
+    try:
+        receipt = rendered_path(key).open("rb")
+    except FileNotFoundError:
+        pass
+    else:
+        count("hits")
+        return receipt
+    if not max_size:
+        return io.BytesIO(render(templates, context, renderer))
+
+    path = receipt_path(key)
+    try:
+        # Still readable if evicted in between
+        receipt = path.open("rb")
+    except FileNotFoundError:
+        pass
+    else:
+        count("hits")
+        if store:
+            # The modification time tells the least recently used receipts
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                pass
+        return receipt
+
+    count("misses")
+    data = render(templates, context, renderer)
+    if store:
+        write_atomic(path, data)
+        add_size(len(data), max_size)
+    return io.BytesIO(data)
+
+
+def cached_receipt(templates, context, store=True) -> bytes:
+    """Receipt from the cache, rendered and stored (see ``store``) on cache
+    miss"""
+    with open_receipt(templates, context, store=store) as receipt:
+        return receipt.read()
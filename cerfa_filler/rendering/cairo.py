@@ -0,0 +1,59 @@
+"""CairoSVG rendering engine.
+
+The templates are SVG documents: CairoSVG draws them directly with cairo,
+instead of going through the HTML engine of WeasyPrint (parsing, styling
+and page layout). Each template is drawn on its own page, the pages are
+then merged with pypdf.
+
+CairoSVG is an optional dependency: ``pip install cairosvg``.
+"""
+
+import io
+
+from django.core.exceptions import ImproperlyConfigured
+from pypdf import PdfReader, PdfWriter
+
+from .compiled import render_template
+from .minify import ASSET_SCHEME, read_asset
+from .preview import svg_document
+
+
+def url_fetcher(url, resource_type=None) -> bytes:
+    """Same resources as :func:`.weasy.url_fetcher`: the extracted images
+    and data URLs, nothing from the network"""
+    from cairosvg.url import fetch
+
+    if url.startswith(ASSET_SCHEME):
+        return read_asset(url[len(ASSET_SCHEME) :])
+    if url.startswith("data:"):
+        return fetch(url, resource_type)
+    raise ValueError(f"Resource not allowed in a receipt: {url}")
+
+
+def svg_to_pdf(svg_content: str) -> bytes:
+    try:
+        import cairosvg
+    except ImportError:
+        raise ImproperlyConfigured(
+            "The cairosvg renderer requires CairoSVG: pip install cairosvg"
+        )
+    return cairosvg.svg2pdf(
+        bytestring=svg_document(svg_content).encode(), url_fetcher=url_fetcher
+    )
+
+
+def render_svg(template_name, context) -> bytes:
+    """Render a SVG template to PDF with CairoSVG"""
+    return svg_to_pdf(render_template(template_name, context))
+
+
+def render_receipt(templates, context) -> bytes:
+    writer = PdfWriter()
+    for template in templates:
+        reader = PdfReader(io.BytesIO(render_svg(template, context)))
+        for page in reader.pages:
+            writer.add_page(page)
+
+    output_pdf = io.BytesIO()
+    writer.write(output_pdf)
+    return output_pdf.getvalue()
@@ -0,0 +1,122 @@
+"""Compiled SVG receipt templates.
+
+The receipt templates are hundreds of kilobytes of static markup with a few
+``{{ variable }}`` and ``{% if %}`` tags. Once parsed by Django, the static
+parts are joined into plain strings and the tags are turned into a short
+list of slots, so that rendering only resolves (and escapes) the values of
+the slots and joins the buffers.
+
+Templates using any other tag are rendered by the Django engine.
+"""
+
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from django.template import Context, VariableDoesNotExist
+from django.template.base import (
+    FilterExpression,
+    TextNode,
+    VariableNode,
+    render_value_in_context,
+)
+from django.template.defaulttags import IfNode
+from django.template.loader import get_template, render_to_string
+
+from .pages import template_version
+
+
+class Unsupported(Exception):
+    pass
+
+
+class Slot(NamedTuple):
+    """A ``{{ variable|filter }}`` tag"""
+
+    expression: FilterExpression
+
+    def render(self, context, output):
+        value = self.expression.resolve(context)
+        output.append(render_value_in_context(value, context))
+
+
+class Conditional(NamedTuple):
+    """A ``{% if %}`` tag: ``(condition, segments)`` pairs, the condition of
+    the ``{% else %}`` branch being None"""
+
+    branches: tuple
+
+    def render(self, context, output):
+        for condition, segments in self.branches:
+            try:
+                match = condition is None or condition.eval(context)
+            except VariableDoesNotExist:
+                match = False
+            if match:
+                render_segments(segments, context, output)
+                return
+
+
+def compile_nodelist(nodelist) -> tuple:
+    segments = []
+    for node in nodelist:
+        if isinstance(node, TextNode):
+            if segments and isinstance(segments[-1], str):
+                segments[-1] += node.s
+            else:
+                segments.append(node.s)
+        elif isinstance(node, VariableNode):
+            segments.append(Slot(node.filter_expression))
+        elif isinstance(node, IfNode):
+            segments.append(
+                Conditional(
+                    tuple(
+                        (condition, compile_nodelist(branch))
+                        for condition, branch in node.conditions_nodelists
+                    )
+                )
+            )
+        else:
+            raise Unsupported(type(node).__name__)
+    return tuple(segments)
+
+
+def render_segments(segments, context, output):
+    for segment in segments:
+        if isinstance(segment, str):
+            output.append(segment)
+        else:
+            segment.render(context, output)
+
+
+class CompiledTemplate(NamedTuple):
+    template: object
+    segments: tuple
+
+    def render(self, context) -> str:
+        context = Context(context, autoescape=self.template.engine.autoescape)
+        output = []
+        with context.bind_template(self.template):
+            render_segments(self.segments, context, output)
+        return "".join(output)
+
+
+@lru_cache(maxsize=16)
+def _compile(template_name, version) -> Optional[CompiledTemplate]:
+    template = get_template(template_name).template
+    try:
+        return CompiledTemplate(template, compile_nodelist(template.nodelist))
+    except Unsupported:
+        return None
+
+
+def compile_template(template_name) -> Optional[CompiledTemplate]:
+    """Compiled template, or None if it uses unsupported tags"""
+    return _compile(template_name, template_version(template_name))
+
+
+def render_template(template_name, context) -> str:
+    """Drop-in replacement of ``render_to_string`` for the receipts"""
+    compiled = compile_template(template_name)
+    if compiled is None:
+        return render_to_string(template_name, context)
+    return compiled.render(context)
@@ -0,0 +1,186 @@
+"""Coordinate maps of the dynamic fields of the SVG receipt templates.
+
+Coordinates are expressed in the user units of the templates (CSS px), with
+every parent ``transform`` already applied, so that they can be stamped on
+top of a page rendered from the same template.
+"""
+
+from typing import NamedTuple
+
+from django.template import Context, Variable, VariableDoesNotExist
+from django.utils.formats import localize
+
+
+def resolve(variable, context):
+    if not isinstance(context, Context):
+        context = Context(context)
+    try:
+        return Variable(variable).resolve(context)
+    except VariableDoesNotExist:
+        return None
+
+
+class TextSlot(NamedTuple):
+    """A ``{{ variable }}`` placeholder of a template."""
+
+    variable: str
+    x: float
+    y: float
+    size: float
+    anchor: str = "start"
+    default: str = ""
+    fill: str = "#000000"
+
+    def resolve(self, context) -> str:
+        value = resolve(self.variable, context)
+        if value is None:
+            return self.default
+        return str(localize(value))
+
+
+class CheckboxSlot(NamedTuple):
+    """A ``{% if variable == value %}☒{% else %}☐{% endif %}`` placeholder,
+    ``value`` may also be a tuple of accepted values"""
+
+    variable: str
+    value: str
+    x: float
+    y: float
+    size: float
+
+    def resolve(self, context) -> bool:
+        value = resolve(self.variable, context)
+        if isinstance(self.value, tuple):
+            return value in self.value
+        return value == self.value
+
+
+class PageLayout(NamedTuple):
+    texts: tuple = ()
+    checkboxes: tuple = ()
+
+
+# Only the order number of the first page depends on the donation, the rest
+# of the page is filled from the beneficiary organization.
+LAYOUTS = {
+    "companies_1.svg": PageLayout(
+        texts=(
+            TextSlot(
+                "object.order_number", 663.090, 170.472, 18.1086, "middle"
+            ),
+        ),
+    ),
+    "companies_2.svg": PageLayout(
+        texts=(
+            TextSlot("object.label", 265.390, 276.290, 18.3141),
+            TextSlot("object.legal_status.label", 171.995, 294.093, 18.3141),
+            TextSlot("object.repository_code", 162.684, 312.670, 18.3141),
+            TextSlot("object.additional_address", 108.513, 329.908, 14.6513),
+            TextSlot("object.street_number", 60.609, 348.908, 14.6513),
+            TextSlot("object.street", 223.247, 349.842, 14.6513),
+            TextSlot("object.postal_code", 122.783, 365.472, 14.6513),
+            TextSlot("object.municipality", 308.773, 365.490, 14.6513),
+            TextSlot("object.inkind_donation", 37.737, 456.929, 14.6513),
+            TextSlot(
+                "object.inkind_donation_as_text", 38.172, 488.460, 14.6513
+            ),
+            TextSlot(
+                "object.inkind_donation_description",
+                38.367,
+                540.266,
+                14.6667,
+                default="-",
+                fill="#333333",
+            ),
+            TextSlot("object.cash_donation", 37.570, 646.922, 14.6513),
+            TextSlot("object.cash_donation_as_text", 38.557, 679.247, 14.6513),
+            TextSlot("object.total_donation", 38.444, 747.630, 14.6513),
+            TextSlot(
+                "object.total_donation_as_text", 36.042, 778.788, 14.6513
+            ),
+            TextSlot("object.date_start", 93.011, 831.884, 14.6513),
+            TextSlot(
+                "object.date_end", 251.342, 833.859, 14.6513, default="-"
+            ),
+            TextSlot("object.valid_date", 473.885, 859.080, 14.6513),
+        ),
+        checkboxes=(
+            CheckboxSlot(
+                "object.cash_payment_type", "Cash", 38.236, 711.828, 14.6513
+            ),
+            CheckboxSlot(
+                "object.cash_payment_type",
+                "Cheque",
+                216.632,
+                711.023,
+                14.6513,
+            ),
+            CheckboxSlot(
+                "object.cash_payment_type",
+                "Bank transfer",
+                331.195,
+                711.174,
+                14.6513,
+            ),
+            CheckboxSlot(
+                "object.cash_payment_type",
+                "Other",
+                673.553,
+                712.623,
+                14.6513,
+            ),
+        ),
+    ),
+    "individuals_1.svg": PageLayout(
+        texts=(
+            TextSlot(
+                "object.order_number", 658.814, 163.779, 18.1086, "middle"
+            ),
+        ),
+    ),
+    "individuals_2.svg": PageLayout(
+        texts=(
+            TextSlot("object.last_name", 87.695, 335.199, 18.3141),
+            TextSlot("object.first_name", 469.215, 335.262, 18.3141),
+            TextSlot("object.street_number", 67.014, 374.484, 18.3141),
+            TextSlot("object.street", 178.223, 374.926, 18.3141),
+            TextSlot("object.postal_code", 126.969, 393.184, 18.3141),
+            TextSlot("object.municipality", 311.539, 394.184, 18.3141),
+            TextSlot("object.cash_donation", 61.280, 483.838, 14.6513),
+            TextSlot(
+                "object.cash_donation_as_text",
+                471.465,
+                485.157,
+                14.6667,
+                fill="#333333",
+            ),
+            TextSlot(
+                "object.date_start", 242.644, 512.879, 14.6667, fill="#333333"
+            ),
+            TextSlot(
+                "object.valid_date", 429.380, 836.601, 14.6667, fill="#333333"
+            ),
+        ),
+        checkboxes=(
+            CheckboxSlot(
+                "object.donation_nature", "Cash", 46.105, 697.361, 14.651
+            ),
+            CheckboxSlot(
+                "object.donation_nature", "Waiver", 45.434, 723.361, 14.651
+            ),
+            CheckboxSlot(
+                "object.cash_payment_type", "Cash", 45.349, 787.200, 14.651
+            ),
+            CheckboxSlot(
+                "object.cash_payment_type", "Cheque", 197.590, 786.208, 14.651
+            ),
+            CheckboxSlot(
+                "object.cash_payment_type",
+                "Bank transfer",
+                381.039,
+                787.200,
+                14.651,
+            ),
+        ),
+    ),
+}
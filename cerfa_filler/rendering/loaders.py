@@ -0,0 +1,16 @@
+from django.template.loaders.filesystem import Loader as FilesystemLoader
+
+from .minify import is_fresh, minified_root
+
+
+class Loader(FilesystemLoader):
+    """Serve the minified copy of a receipt template written by the
+    ``minify_templates`` command, as long as it is up to date with its
+    source. Other templates are left to the next loaders."""
+
+    def get_dirs(self):
+        return [minified_root()]
+
+    def get_template_sources(self, template_name):
+        if is_fresh(template_name):
+            yield from super().get_template_sources(template_name)
@@ -0,0 +1,330 @@
+"""Minifier of the SVG receipt templates.
+
+The templates are Inkscape documents, full of editor metadata and high
+precision coordinates that WeasyPrint has to parse on every rendering. The
+``minify_templates`` command writes lighter copies of them under
+``CERFA_CACHE_ROOT``, which are served by :class:`.loaders.Loader` as long
+as they are up to date.
+
+The raster images embedded in base64 are extracted into binary assets
+under ``CERFA_CACHE_ROOT`` and referenced by ``cerfa-asset:`` URLs, served
+to WeasyPrint from memory by :func:`.weasy.url_fetcher`: the templates are
+smaller and the images are no longer decoded on every rendering.
+
+The templates are not always well-formed XML (and mix HTML and template
+tags with SVG), so they are parsed with a tolerant tokenizer: text, and
+thus every ``{{ }}`` / ``{% %}`` placeholder, is kept as is.
+"""
+
+import base64
+import hashlib
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+
+from .pages import cache_root
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+
+TOKEN = re.compile(r"<!--.*?-->|<\?.*?\?>|<[^>]*>|[^<]+", re.S)
+TAG_NAME = re.compile(r"</?([^\s/>]+)")
+ATTRIBUTE = re.compile(r"""([^\s=/<>]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+REFERENCE = re.compile(r"#([\w.:-]+)")
+DATA_URI = re.compile(r"data:image/([\w.+-]+);base64,(.*)", re.S)
+
+ASSET_SCHEME = "cerfa-asset:"
+
+EDITOR_PREFIXES = (
+    "inkscape:",
+    "sodipodi:",
+    "xmlns:inkscape",
+    "xmlns:sodipodi",
+)
+EDITOR_TAGS = ("metadata",)
+# Attributes holding coordinates, the size of the root element is left as is
+GEOMETRY = {
+    "d", "points", "transform", "x", "y", "x1", "y1", "x2", "y2",
+    "cx", "cy", "r", "rx", "ry", "width", "height", "stroke-width",
+}  # fmt: skip
+# Inherited attributes that can be moved from a group to its only child
+INHERITED = {
+    "fill", "fill-opacity", "fill-rule", "stroke", "stroke-width",
+    "stroke-opacity", "stroke-linecap", "stroke-linejoin",
+    "stroke-miterlimit", "stroke-dasharray", "font-family", "font-size",
+    "font-weight",
+}  # fmt: skip
+GRAPHICS = {"g", "path", "use", "text", "image", "rect", "circle", "line"}
+# Elements whose whitespace is significant
+TEXT_TAGS = {"text", "tspan", "style"}
+
+
+class Element:
+    def __init__(self, tag, attributes=None):
+        self.tag = tag
+        self.attributes = attributes or {}
+        self.children = []
+
+    def elements(self):
+        return [child for child in self.children if isinstance(child, Element)]
+
+    def iter(self):
+        yield self
+        for child in self.elements():
+            yield from child.iter()
+
+
+def parse(source: str) -> Element:
+    root = Element(None)
+    stack = [root]
+    for token in TOKEN.findall(source):
+        if token.startswith(("<!--", "<?")):
+            continue
+        if token.startswith("</"):
+            name = TAG_NAME.match(token)[1]
+            # Unclosed elements are closed with their parent
+            for depth in range(len(stack) - 1, 0, -1):
+                if stack[depth].tag == name:
+                    del stack[depth:]
+                    break
+        elif token.startswith("<"):
+            element = Element(
+                TAG_NAME.match(token)[1],
+                {
+                    name: double if double is not None else single
+                    for name, double, single in ATTRIBUTE.findall(token)
+                    if double is not None or single is not None
+                },
+            )
+            stack[-1].children.append(element)
+            if not token.endswith("/>"):
+                stack.append(element)
+        else:
+            stack[-1].children.append(token)
+    return root
+
+
+def serialize(element: Element, skip_id=False) -> str:
+    if element.tag is None:
+        return "".join(_serialize(child) for child in element.children)
+    attributes = "".join(
+        f' {name}="{value}"' if '"' not in value else f" {name}='{value}'"
+        for name, value in element.attributes.items()
+        if not (skip_id and name == "id")
+    )
+    if not element.children and element.tag not in TEXT_TAGS:
+        return f"<{element.tag}{attributes}/>"
+    children = "".join(_serialize(child) for child in element.children)
+    return f"<{element.tag}{attributes}>{children}</{element.tag}>"
+
+
+def _serialize(node) -> str:
+    return serialize(node) if isinstance(node, Element) else node
+
+
+def strip_editor_data(element: Element, in_text=False):
+    """Drop editor elements and attributes, comments and indentation"""
+    in_text = in_text or element.tag in TEXT_TAGS
+    children = []
+    for child in element.children:
+        if isinstance(child, Element):
+            if child.tag.startswith(EDITOR_PREFIXES) or child.tag in (
+                EDITOR_TAGS
+            ):
+                continue
+            strip_editor_data(child, in_text)
+        elif not in_text and not child.strip():
+            continue
+        children.append(child)
+    element.children = children
+    element.attributes = {
+        name: value
+        for name, value in element.attributes.items()
+        if not name.startswith(EDITOR_PREFIXES)
+    }
+    if "style" in element.attributes:
+        element.attributes["style"] = ";".join(
+            declaration
+            for declaration in element.attributes["style"].split(";")
+            if declaration.strip()
+            and not declaration.strip().startswith("-inkscape-")
+        )
+
+
+def round_numbers(value: str, precision: int) -> str:
+    def format_number(match):
+        number = match[0]
+        if "." not in number or "e" in number.lower():
+            return number
+        rounded = f"{float(number):.{precision}f}".rstrip("0").rstrip(".")
+        if rounded in ("-0", ""):
+            rounded = "0"
+        if number.startswith("."):
+            # "1.5.5" is "1.5 0.5", keep the numbers apart
+            rounded = rounded[1:] if rounded.startswith("0.") else rounded
+        return rounded
+
+    return NUMBER.sub(format_number, value)
+
+
+def reduce_precision(root: Element, precision: int):
+    for element in root.iter():
+        if element.tag == "svg":
+            continue
+        for name, value in element.attributes.items():
+            if name in GEOMETRY and "{" not in value:
+                element.attributes[name] = round_numbers(
+                    value,
+                    # Scale factors are applied to whole groups
+                    precision + 3 if name == "transform" else precision,
+                )
+
+
+def drop_unused_ids(root: Element, source: str):
+    references = set(REFERENCE.findall(source))
+    for element in root.iter():
+        if element.attributes.get("id", "") not in references:
+            element.attributes.pop("id", None)
+
+
+def collapse_groups(element: Element):
+    """Unwrap groups without attributes and merge groups holding a single
+    element into it"""
+    children = []
+    for child in element.children:
+        if isinstance(child, Element):
+            collapse_groups(child)
+            if child.tag == "g" and not child.attributes:
+                children.extend(child.children)
+                continue
+            if child.tag == "g" and _mergeable(child):
+                children.append(_merge(child))
+                continue
+        children.append(child)
+    element.children = children
+
+
+def _mergeable(group: Element) -> bool:
+    return (
+        len(group.children) == 1
+        and isinstance(group.children[0], Element)
+        and group.children[0].tag in GRAPHICS
+        and set(group.attributes) <= INHERITED | {"transform"}
+    )
+
+
+def _merge(group: Element) -> Element:
+    child = group.children[0]
+    for name, value in group.attributes.items():
+        if name == "transform":
+            child.attributes["transform"] = " ".join(
+                filter(None, (value, child.attributes.get("transform")))
+            )
+        else:
+            child.attributes.setdefault(name, value)
+    return child
+
+
+def dedupe_definitions(root: Element):
+    """Replace identical definitions by the first one and drop the
+    unreferenced ones"""
+    aliases = {}
+    seen = {}
+
+    def dedupe(parent):
+        children = []
+        for child in parent.children:
+            if isinstance(child, Element):
+                if parent.tag == "defs" and "id" not in child.attributes:
+                    # Unreferenced definition
+                    continue
+                if "id" in child.attributes:
+                    key = serialize(child, skip_id=True)
+                    if key in seen:
+                        aliases[child.attributes["id"]] = seen[key]
+                        continue
+                    seen[key] = child.attributes["id"]
+                dedupe(child)
+            children.append(child)
+        parent.children = children
+
+    for defs in [element for element in root.iter() if element.tag == "defs"]:
+        dedupe(defs)
+    if not aliases:
+        return
+
+    def replace(match):
+        return "#" + aliases.get(match[1], match[1])
+
+    for element in root.iter():
+        for name, value in element.attributes.items():
+            if "#" in value:
+                element.attributes[name] = REFERENCE.sub(replace, value)
+
+
+def extract_images(root: Element) -> dict:
+    """Replace the base64 images by references to assets, returns the
+    content of the assets by name. Images with placeholders are kept."""
+    assets = {}
+    for element in root.iter():
+        for name, value in element.attributes.items():
+            if name not in ("href", "xlink:href") or "{" in value:
+                continue
+            match = DATA_URI.fullmatch(value.strip())
+            if match is None:
+                continue
+            data = base64.b64decode(match[2])
+            # Named after their content, an asset never changes
+            asset = "{}.{}".format(
+                hashlib.sha256(data).hexdigest()[:16],
+                match[1].split("+")[0],
+            )
+            assets[asset] = data
+            element.attributes[name] = ASSET_SCHEME + asset
+    return assets
+
+
+def minify_svg(source: str, precision: int = 3, assets=None) -> str:
+    """Minified ``source``, its images are extracted into ``assets`` when
+    it is a dict"""
+    root = parse(source)
+    strip_editor_data(root)
+    drop_unused_ids(root, source)
+    reduce_precision(root, precision)
+    collapse_groups(root)
+    dedupe_definitions(root)
+    if assets is not None:
+        assets.update(extract_images(root))
+    return serialize(root)
+
+
+def minified_root() -> Path:
+    return cache_root() / "templates"
+
+
+def assets_root() -> Path:
+    return minified_root() / "assets"
+
+
+@lru_cache(maxsize=32)
+def read_asset(name) -> bytes:
+    if Path(name).name != name:
+        raise ValueError(f"Invalid asset name: {name}")
+    return (assets_root() / name).read_bytes()
+
+
+def source_path(template_name) -> Path:
+    return TEMPLATES_DIR / template_name
+
+
+def is_fresh(template_name) -> bool:
+    """Whether the minified copy of a template matches its source, the
+    command gives the copy the modification time of its source"""
+    try:
+        # Not pathlib, which fails on the SafeString names of {% extends %}
+        minified = os.stat(os.path.join(minified_root(), template_name))
+        source = os.stat(os.path.join(TEMPLATES_DIR, template_name))
+    except OSError:
+        return False
+    return minified.st_mtime_ns == source.st_mtime_ns
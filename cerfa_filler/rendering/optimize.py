@@ -0,0 +1,117 @@
+"""Size optimization of the rendered receipts.
+
+The renderers write the PDF as they build it: the content streams of the
+stamped fields are left uncompressed, objects shared by the pages of a
+receipt (fonts, images) may be copied once per page and the raster images
+keep the resolution they were embedded at. Depending on where a receipt
+goes, :func:`optimize_pdf` rewrites it with:
+
+- every stream Flate-compressed and the identical objects merged, for all
+  the targets;
+- the photographic images downsampled and recompressed to JPEG for the
+  ``screen`` and ``print`` targets, the ``archive`` target keeping them as
+  they are.
+
+The fonts are not touched: WeasyPrint embeds subsets of its fonts, the
+official forms come with subsets of theirs and the stamped fields use the
+standard Helvetica, which is not embedded.
+"""
+
+import io
+import logging
+from typing import NamedTuple, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from PIL import Image
+from pypdf import PdfWriter
+from pypdf.generic import StreamObject
+
+logger = logging.getLogger(__name__)
+
+
+class Target(NamedTuple):
+    # Resolution above which images are downsampled, None keeps them
+    max_dpi: Optional[int]
+    jpeg_quality: int = 85
+
+
+TARGETS = {
+    "screen": Target(max_dpi=150, jpeg_quality=75),
+    "print": Target(max_dpi=300, jpeg_quality=90),
+    "archive": Target(max_dpi=None),
+}
+
+
+def get_target(name) -> Target:
+    try:
+        return TARGETS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown PDF optimization target: {name}")
+
+
+def compress_streams(writer: PdfWriter):
+    for number, obj in enumerate(writer._objects):
+        if (
+            isinstance(obj, StreamObject)
+            and "/Filter" not in obj
+            # Left readable for the tools indexing the documents
+            and obj.get("/Type") != "/Metadata"
+        ):
+            encoded = obj.flate_encode(level=9)
+            encoded.indirect_reference = obj.indirect_reference
+            writer._objects[number] = encoded
+
+
+def downsample_images(writer: PdfWriter, target: Target):
+    """Downsample the images having more pixels than their page at
+    ``target.max_dpi``: an image is never drawn larger than its page.
+
+    Only opaque RGB and grayscale images are replaced, the others would
+    lose their transparency or colors.
+    """
+    for page in writer.pages:
+        # Largest size of an image on this page, in pixels
+        max_size = (
+            int(float(page.mediabox.width) / 72 * target.max_dpi),
+            int(float(page.mediabox.height) / 72 * target.max_dpi),
+        )
+        for image in page.images:
+            if image.indirect_reference is None:
+                continue
+            xobject = image.indirect_reference.get_object()
+            if "/SMask" in xobject or "/Mask" in xobject:
+                continue
+            picture = image.image
+            if picture.mode not in ("RGB", "L") or (
+                picture.width <= max_size[0] and picture.height <= max_size[1]
+            ):
+                continue
+            picture.thumbnail(max_size, Image.Resampling.LANCZOS)
+            image.replace(picture, quality=target.jpeg_quality)
+
+
+def optimize(writer: PdfWriter, target="print"):
+    """Optimize the document of ``writer`` for ``target``, in place"""
+    options = get_target(target)
+    if options.max_dpi is not None:
+        downsample_images(writer, options)
+    compress_streams(writer)
+    writer.compress_identical_objects(remove_orphans=True)
+
+
+def optimize_pdf(pdf: bytes, target="print") -> bytes:
+    """Smaller copy of ``pdf`` for the ``target`` of :data:`TARGETS`, or
+    ``pdf`` itself when it can't be made smaller"""
+    writer = PdfWriter(clone_from=io.BytesIO(pdf))
+    optimize(writer, target)
+    output = io.BytesIO()
+    writer.write(output)
+    optimized = output.getvalue()
+    logger.debug(
+        "PDF optimized for %s: %d -> %d bytes (%d saved)",
+        target,
+        len(pdf),
+        len(optimized),
+        len(pdf) - len(optimized),
+    )
+    return optimized if len(optimized) < len(pdf) else pdf
@@ -0,0 +1,46 @@
+"""Overlay rendering engine.
+
+Every page of a receipt is precompiled once into a background PDF holding
+the static artwork, the beneficiary organization and its signature (see
+:mod:`.pages`). A receipt is then produced by stamping only the dynamic text
+and checkboxes of the donation on top of these backgrounds, without running
+WeasyPrint at request time.
+
+The fields are stamped in Helvetica-Bold: a receipt with text outside of
+its WinAnsi encoding is laid out by WeasyPrint in full instead.
+"""
+
+import io
+import logging
+
+from pypdf import PdfWriter
+
+from . import weasy
+from .layouts import LAYOUTS
+from .pages import static_page
+from .stamp import Overlay, UnencodableText, stamp
+
+logger = logging.getLogger(__name__)
+
+
+def render_receipt(templates, context) -> bytes:
+    try:
+        return stamp_receipt(templates, context)
+    except UnencodableText as error:
+        logger.info("Laid out by WeasyPrint, unencodable text: %s", error)
+        return weasy.render_receipt(templates, context)
+
+
+def stamp_receipt(templates, context) -> bytes:
+    writer = PdfWriter()
+    for template in templates:
+        page = writer.add_page(
+            static_page(template, context["company"], weasy.render_svg)
+        )
+        overlay = Overlay(page.mediabox.width, page.mediabox.height)
+        overlay.draw(LAYOUTS[template], context)
+        stamp(page, overlay)
+
+    output_pdf = io.BytesIO()
+    writer.write(output_pdf)
+    return output_pdf.getvalue()
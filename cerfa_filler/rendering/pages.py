@@ -0,0 +1,102 @@
+"""Cache of the donor-independent pages of the receipts.
+
+A page rendered without any donation only shows the beneficiary organization
+(and its signature). It is rendered once per beneficiary and template
+version, stored as a PDF under ``CERFA_CACHE_ROOT`` and reused for every
+receipt, the dynamic fields being stamped on top of it.
+"""
+
+import datetime
+import hashlib
+import io
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import get_template
+from pypdf import PageObject, PdfReader
+
+from .signature import signature_data
+
+
+def cache_root() -> Path:
+    return Path(settings.CERFA_CACHE_ROOT)
+
+
+def template_version(template_name) -> str:
+    """Version of a template file, changes whenever the file is edited"""
+    stat = os.stat(get_template(template_name).origin.name)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def template_mtime(template_name) -> datetime.datetime:
+    mtime = os.stat(get_template(template_name).origin.name).st_mtime
+    return datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+
+
+def beneficiary_version(company) -> str:
+    if company is None:
+        return "none"
+    return f"{company.pk}-{company.timestamp_update.isoformat()}"
+
+
+def static_page_path(template_name, company, engine) -> Path:
+    key = hashlib.sha256(
+        ":".join(
+            (
+                template_name,
+                template_version(template_name),
+                beneficiary_version(company),
+            )
+        ).encode()
+    ).hexdigest()
+    return (
+        cache_root()
+        / "pages"
+        / engine
+        / Path(template_name).stem
+        / f"{key}.pdf"
+    )
+
+
+def write_atomic(path: Path, data: bytes):
+    """Write a file so that concurrent readers never see a partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@lru_cache(maxsize=8)
+def _read(path: Path) -> bytes:
+    return path.read_bytes()
+
+
+def static_page(template_name, company, render) -> PageObject:
+    """Page of ``template_name`` rendered without any donation.
+
+    ``render(template_name, context)`` is only called on cache miss, the
+    pages are cached apart for each SVG engine (the module of ``render``).
+    """
+    engine = render.__module__.rpartition(".")[2]
+    path = static_page_path(template_name, company, engine)
+    if not path.exists():
+        context = {
+            "company": company,
+            "object": None,
+            "sign_file": signature_data(company),
+        }
+        data = render(template_name, context)
+        write_atomic(path, data)
+        # Drop the pages rendered for a previous version
+        for stale in path.parent.glob("*.pdf"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+    return PdfReader(io.BytesIO(_read(path))).pages[0]
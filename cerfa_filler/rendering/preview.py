@@ -0,0 +1,104 @@
+"""SVG preview of the receipts.
+
+The page of a receipt holding the donation (the last template) is sent to
+the browser as a SVG image, to be checked before the donation is
+validated: no PDF is generated. The previews are compressed (brotli when
+installed and accepted, or gzip) and kept in the cache of Django until the
+donation, the beneficiary organization or the template changes.
+"""
+
+import base64
+import gzip
+import mimetypes
+import re
+from typing import Optional
+
+from django.core.cache import cache
+
+from .compiled import render_template
+from .minify import ASSET_SCHEME, read_asset
+from .pages import beneficiary_version, template_version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_URL = re.compile(re.escape(ASSET_SCHEME) + r"([\w.-]+)")
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def svg_document(svg_content: str) -> str:
+    """The ``<svg>`` element of a template, without the ``@page`` style
+    only used by WeasyPrint"""
+    start = svg_content.index("<svg")
+    end = svg_content.rindex("</svg>") + len("</svg>")
+    return svg_content[start:end]
+
+
+def inline_assets(svg_content: str) -> str:
+    """Replace the images extracted by the minifier by data URLs"""
+
+    def data_url(match):
+        name = match[1]
+        data = base64.b64encode(read_asset(name)).decode()
+        return f"data:{mimetypes.guess_type(name)[0]};base64,{data}"
+
+    return ASSET_URL.sub(data_url, svg_content)
+
+
+def render_preview(template_name, context) -> bytes:
+    return svg_document(
+        inline_assets(render_template(template_name, context))
+    ).encode()
+
+
+def preferred_encoding(accept_encoding: str) -> Optional[str]:
+    """Content coding of the preview for an ``Accept-Encoding`` header"""
+    accepted = set()
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        try:
+            quality = float(params.strip().removeprefix("q=") or 1)
+        except ValueError:
+            quality = 1
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        # The highest qualities take seconds on a page
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=6)
+    if encoding == "gzip":
+        return gzip.compress(data, mtime=0)
+    return data
+
+
+def preview_key(template_name, context) -> str:
+    donor = context["object"]
+    return ":".join(
+        (
+            "cerfa_filler:preview",
+            donor._meta.label,
+            str(donor.pk),
+            donor.timestamp_update.isoformat(),
+            template_version(template_name),
+            beneficiary_version(context["company"]),
+        )
+    )
+
+
+def cached_preview(template_name, context, encoding=None) -> bytes:
+    """Preview of a receipt page, compressed with ``encoding``"""
+    key = f"{preview_key(template_name, context)}:{encoding or 'identity'}"
+    preview = cache.get(key)
+    if preview is None:
+        preview = compress(render_preview(template_name, context), encoding)
+        cache.set(key, preview, CACHE_TIMEOUT)
+    return preview
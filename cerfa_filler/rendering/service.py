@@ -0,0 +1,272 @@
+"""Local render service.
+
+A pool of long-lived processes renders the receipts for the web workers,
+which reach it over a Unix socket (``CERFA_RENDER_SOCKET``, see the
+render_service command). The processes are warmed up once (WeasyPrint and
+its fonts, compiled templates) instead of in every web worker, and a web
+worker never waits longer than ``CERFA_RENDER_TIMEOUT`` for a receipt:
+
+- requests are rejected as busy once all the processes are rendering and
+  the queue is full;
+- a render running longer than the timeout is killed along with its
+  process, which is replaced;
+- processes are recycled after a number of renders, to bound their memory.
+
+Messages are a status byte and a length-prefixed payload: a JSON request
+(donation and templates) and the PDF or an error message in response.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import receipt_context
+from . import render_receipt as render_in_process
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">cI")
+OK = b"0"
+ERROR = b"1"
+BUSY = b"2"
+TIMEOUT = b"3"
+
+
+class RenderServiceError(Exception):
+    pass
+
+
+class RenderServiceBusy(RenderServiceError):
+    pass
+
+
+class RenderServiceTimeout(RenderServiceError):
+    pass
+
+
+class RenderServiceUnavailable(RenderServiceError):
+    """Not running, or refusing the connections"""
+
+
+def send(sock, status, payload: bytes):
+    sock.sendall(HEADER.pack(status, len(payload)) + payload)
+
+
+def _read(sock, size) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed by the render service")
+        data += chunk
+    return bytes(data)
+
+
+def receive(sock):
+    status, size = HEADER.unpack(_read(sock, HEADER.size))
+    return status, _read(sock, size)
+
+
+# Render processes
+
+
+def warm_up(templates):
+    from .compiled import compile_template
+    from .weasy import svg_to_pdf
+
+    for template in templates:
+        compile_template(template)
+    # Loads the fonts configuration
+    svg_to_pdf(
+        '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">'
+        "<text>0</text></svg>"
+    )
+
+
+def render(request) -> bytes:
+    donor = apps.get_model(request["model"]).objects.get(pk=request["pk"])
+    return render_in_process(
+        request["templates"], receipt_context(donor), request["renderer"]
+    )
+
+
+def render_process(conn, templates):
+    """Main loop of a render process"""
+    django.setup()
+    try:
+        warm_up(templates)
+    except Exception:
+        logger.exception("Render process warm up failed")
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        # Connections dropped by the database, or older than CONN_MAX_AGE,
+        # are reopened, as around the requests of the web workers
+        close_old_connections()
+        try:
+            conn.send((OK, render(request)))
+        except Exception as error:
+            logger.exception("Receipt rendering failed")
+            conn.send((ERROR, str(error).encode()))
+        finally:
+            close_old_connections()
+
+
+class RenderProcess:
+    def __init__(self, context, target, args):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=target, args=(child, *args), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.jobs = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class RenderPool:
+    def __init__(
+        self,
+        workers,
+        queue_size,
+        timeout,
+        max_jobs,
+        target=render_process,
+        args=(),
+        start_method="forkserver",
+    ):
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self.target = target
+        self.args = args
+        self.context = multiprocessing.get_context(start_method)
+        # Requests being rendered or waiting for a process
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.idle = queue.Queue()
+        for _ in range(workers):
+            self.idle.put(self.spawn())
+
+    def spawn(self) -> RenderProcess:
+        return RenderProcess(self.context, self.target, self.args)
+
+    def render(self, request):
+        """Status and payload of the response to ``request``"""
+        if not self.slots.acquire(blocking=False):
+            return BUSY, b""
+        try:
+            process = self.idle.get()
+            try:
+                process.conn.send(request)
+                if not process.conn.poll(self.timeout):
+                    logger.warning("Receipt rendering timed out: %s", request)
+                    process.kill()
+                    process = self.spawn()
+                    return TIMEOUT, b""
+                status, payload = process.conn.recv()
+            except (EOFError, OSError):
+                logger.error("Render process died: %s", request)
+                process.kill()
+                process = self.spawn()
+                return ERROR, b"Render process died"
+            process.jobs += 1
+            if process.jobs >= self.max_jobs:
+                process.stop()
+                process = self.spawn()
+            return status, payload
+        finally:
+            self.idle.put(process)
+            self.slots.release()
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().stop()
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        _, payload = receive(self.request)
+        status, payload = self.server.pool.render(json.loads(payload))
+        send(self.request, status, payload)
+
+
+class RenderServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        if os.path.exists(path):
+            # Left by a previous run
+            os.unlink(path)
+        super().__init__(path, RequestHandler)
+        self.pool = pool
+
+
+# Web workers
+
+
+def render_remote(templates, context, renderer) -> bytes:
+    donor = context["object"]
+    request = {
+        "model": donor._meta.label,
+        "pk": str(donor.pk),
+        "templates": list(templates),
+        "renderer": renderer,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(settings.CERFA_RENDER_TIMEOUT)
+        try:
+            sock.connect(settings.CERFA_RENDER_SOCKET)
+        except OSError as error:
+            raise RenderServiceUnavailable(error) from error
+        try:
+            send(sock, OK, json.dumps(request).encode())
+            status, payload = receive(sock)
+        except socket.timeout:
+            raise RenderServiceTimeout
+        except OSError as error:
+            # The receipt may be rendering, it is not rendered again here
+            raise RenderServiceError(
+                f"Connection to the render service lost: {error}"
+            ) from error
+    if status == BUSY:
+        raise RenderServiceBusy
+    if status == TIMEOUT:
+        raise RenderServiceTimeout
+    if status != OK:
+        raise RenderServiceError(payload.decode())
+    return payload
+
+
+def render_receipt(templates, context, renderer) -> bytes:
+    """Render a receipt in the render service, or in process when it is not
+    configured or not running"""
+    if settings.CERFA_RENDER_SOCKET:
+        try:
+            return render_remote(templates, context, renderer)
+        except RenderServiceUnavailable as error:
+            logger.warning("The render service is not available: %s", error)
+    return render_in_process(templates, context, renderer)
@@ -0,0 +1,58 @@
+import base64
+import io
+from functools import lru_cache
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+# Box of the signature in the templates (326 x 98 px, 86 x 26 mm) at 300 dpi
+SIGNATURE_SIZE = (1020, 306)
+SIGNATURE_COLORS = 64
+
+
+def normalize_signature(data: bytes) -> bytes:
+    """Signature image resized to its printed size, as an optimized PNG
+    with a reduced palette (a signature has a few shades of ink)"""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    # Palette images give their transparent color in "transparency"
+    transparent = "A" in image.getbands() or "transparency" in image.info
+    image = image.convert("RGBA" if transparent else "RGB")
+    image.thumbnail(SIGNATURE_SIZE, Image.Resampling.LANCZOS)
+    image = image.quantize(
+        SIGNATURE_COLORS,
+        # The default method does not support transparency
+        method=(
+            Image.Quantize.FASTOCTREE
+            if image.mode == "RGBA"
+            else Image.Quantize.MEDIANCUT
+        ),
+    )
+    output = io.BytesIO()
+    image.save(output, "PNG", optimize=True)
+    return output.getvalue()
+
+
+@lru_cache(maxsize=8)
+def _encoded(storage, name, version, normalized) -> str:
+    with storage.open(name, "rb") as sign_file:
+        data = sign_file.read()
+    if not normalized:
+        # Uploaded before the signatures were normalized
+        data = normalize_signature(data)
+    return base64.b64encode(data).decode("utf-8")
+
+
+def signature_data(company) -> Optional[str]:
+    """Base64 encoded signature image of the beneficiary organization.
+
+    Encoded once per process and version of the organization.
+    """
+    if company is None or not company.sign_file:
+        return None
+    sign_file = company.sign_image or company.sign_file
+    return _encoded(
+        sign_file.storage,
+        sign_file.name,
+        company.timestamp_update,
+        bool(company.sign_image),
+    )
@@ -0,0 +1,64 @@
+import io
+import mimetypes
+
+from pypdf import PdfReader, PdfWriter
+from weasyprint import HTML, default_url_fetcher
+
+from .compiled import render_template
+from .minify import ASSET_SCHEME, read_asset
+
+PAGE_BREAK = '<div style="break-before: page"></div>'
+
+
+def url_fetcher(url, *args, **kwargs):
+    """Resources of the templates: the images extracted by the minifier,
+    read once per process, and data URLs. Anything else, and notably the
+    network, is refused."""
+    if url.startswith(ASSET_SCHEME):
+        name = url[len(ASSET_SCHEME) :]
+        return {
+            "string": read_asset(name),
+            "mime_type": mimetypes.guess_type(name)[0],
+        }
+    if url.startswith("data:"):
+        return default_url_fetcher(url, *args, **kwargs)
+    raise ValueError(f"Resource not allowed in a receipt: {url}")
+
+
+def svg_to_pdf(svg_content: str) -> bytes:
+    return HTML(string=svg_content, url_fetcher=url_fetcher).write_pdf(
+        margin_top=0, margin_right=0, margin_bottom=0, margin_left=0
+    )
+
+
+def render_svg(template_name, context) -> bytes:
+    """Render a SVG template to PDF with WeasyPrint"""
+    return svg_to_pdf(render_template(template_name, context))
+
+
+def render_document(templates, context) -> bytes:
+    """Render the pages of a receipt with a single WeasyPrint layout, each
+    template starting on a new page, without merging PDF files"""
+    return svg_to_pdf(
+        PAGE_BREAK.join(
+            render_template(template_name, context)
+            for template_name in templates
+        )
+    )
+
+
+def render_receipt(templates, context) -> bytes:
+    """Render the pages of a receipt and merge them into a single PDF.
+
+    Every page is laid out by WeasyPrint, the order number of the first one
+    included, so that all the text is set in the font of the templates.
+    """
+    writer = PdfWriter()
+    for template in templates:
+        reader = PdfReader(io.BytesIO(render_svg(template, context)))
+        for page in reader.pages:
+            writer.add_page(page)
+
+    output_pdf = io.BytesIO()
+    writer.write(output_pdf)
+    return output_pdf.getvalue()
@@ -0,0 +1,55 @@
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+from num2words import num2words
+
+from ..amounts import amount_as_text
+
+
+def expected(amount) -> str:
+    return num2words(amount, lang="fr", to="currency")
+
+
+class AmountAsTextTest(SimpleTestCase):
+    def assertSameText(self, amounts):
+        for amount in amounts:
+            self.assertEqual(
+                amount_as_text(amount), expected(amount), msg=str(amount)
+            )
+
+    def test_examples(self):
+        self.assertEqual(
+            amount_as_text(Decimal("1234.56")),
+            "mille deux cent trente-quatre euros et cinquante-six centimes",
+        )
+        self.assertEqual(
+            amount_as_text(Decimal("80000.01")),
+            "quatre-vingt mille euros et un centime",
+        )
+
+    def test_cents(self):
+        self.assertSameText(Decimal(cents) / 100 for cents in range(100))
+
+    def test_groups_at_every_scale(self):
+        # The words of a group of three digits only depend on its scale
+        # and on whether it ends the number
+        for scale in (1, 10**3, 10**6, 10**9):
+            self.assertSameText(
+                Decimal(group * scale + tail) + Decimal("0.99")
+                for group in range(1000)
+                for tail in (0, 1, 80, 200)
+                if tail < scale
+            )
+
+    def test_twelve_digits(self):
+        # max_digits=12, decimal_places=2
+        sample = random.Random(0)
+        self.assertSameText(
+            Decimal(sample.randrange(10**12)) / 100 for _ in range(2000)
+        )
+
+    def test_rounding(self):
+        self.assertSameText(
+            [Decimal("0.005"), Decimal("1.995"), Decimal("-12.5"), 0]
+        )
@@ -0,0 +1,149 @@
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ..models import (
+    BeneficiaryOrganization,
+    Companies,
+    CompanyLegalForms,
+    DeclarativeStructure,
+)
+from ..rendering import cache as receipts_cache
+from ..rendering.cache import cached_receipt, receipts_root, stats
+
+TEMPLATES = ("companies_1.svg", "companies_2.svg")
+
+
+class ReceiptsCacheTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(
+            CERFA_CACHE_ROOT=self.cache_dir.name,
+            CERFA_RECEIPTS_CACHE_SIZE=10_000,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+
+        render = mock.patch.object(
+            receipts_cache,
+            "render_receipt",
+            side_effect=lambda templates, context, renderer: (
+                context["object"].label.encode().ljust(4_000)
+            ),
+        )
+        self.render = render.start()
+        self.addCleanup(render.stop)
+
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.structure = DeclarativeStructure.objects.create(label="Test")
+        self.company = self.create_company("Test Company")
+
+    def create_company(self, label):
+        return Companies.objects.create(
+            label=label,
+            repository_code="54321",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=self.structure,
+            cash_donation=100.00,
+        )
+
+    def receipt(self, company):
+        return cached_receipt(
+            TEMPLATES, {"object": company, "company": self.beneficiary}
+        )
+
+    def test_hit(self):
+        first = self.receipt(self.company)
+        self.assertEqual(self.receipt(self.company), first)
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual(stats(), {"hits": 1, "misses": 1, "evictions": 0})
+
+    def test_sharded_layout(self):
+        self.receipt(self.company)
+        (path,) = receipts_root().glob("*/*/*.pdf")
+        self.assertEqual(path.parent.parent.name, path.stem[:2])
+        self.assertEqual(path.parent.name, path.stem[2:4])
+
+    def test_invalidated_on_queryset_update(self):
+        self.receipt(self.company)
+        Companies.objects.filter(pk=self.company.pk).update(
+            valid_date="2025-01-01"
+        )
+        self.company.refresh_from_db()
+        self.receipt(self.company)
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_invalidated_on_beneficiary_update(self):
+        self.receipt(self.company)
+        self.beneficiary.save()
+        self.receipt(self.company)
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_invalidated_on_legal_status_update(self):
+        legal_status = CompanyLegalForms.objects.create(
+            code="5499", label="SA"
+        )
+        self.company.legal_status = legal_status
+        self.company.save()
+        self.receipt(self.company)
+        legal_status.label = "SARL"
+        legal_status.save()
+        self.receipt(Companies.objects.get(pk=self.company.pk))
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_read_only(self):
+        self.receipt(self.company)
+        second = self.create_company("Second")
+        cached_receipt(
+            TEMPLATES,
+            {"object": second, "company": self.beneficiary},
+            store=False,
+        )
+        self.assertEqual(len(list(receipts_root().glob("*/*/*.pdf"))), 1)
+        self.receipt(self.company)
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_least_recently_used_evicted(self):
+        first, second, third = (
+            self.company,
+            self.create_company("Second"),
+            self.create_company("Third"),
+        )
+        self.receipt(first)
+        self.receipt(second)
+        # Mark the first receipt as recently used
+        self.receipt(first)
+        self.receipt(third)
+        self.assertEqual(stats()["evictions"], 1)
+        self.receipt(first)
+        self.receipt(second)
+        self.assertEqual(self.render.call_count, 4)
+
+    def test_tree_walked_over_the_bound_only(self):
+        self.receipt(self.company)
+        with mock.patch.object(
+            receipts_cache, "evict", wraps=receipts_cache.evict
+        ) as evict:
+            self.receipt(self.create_company("Second"))
+            evict.assert_not_called()
+            self.receipt(self.create_company("Third"))
+            evict.assert_called_once_with(10_000)
+        self.assertEqual(stats()["evictions"], 1)
+        self.assertEqual(cache.get(receipts_cache.SIZE_KEY), 8_000)
+
+    @override_settings(CERFA_RECEIPTS_CACHE_SIZE=0)
+    def test_disabled(self):
+        self.receipt(self.company)
+        self.receipt(self.company)
+        self.assertEqual(self.render.call_count, 2)
+        self.assertFalse(receipts_root().exists())
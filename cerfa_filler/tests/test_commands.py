@@ -0,0 +1,146 @@
+import datetime
+import io
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..management.commands import generate_receipts
+from ..models import (
+    BeneficiaryOrganization,
+    Companies,
+    DeclarativeStructure,
+    PrivateIndividual,
+)
+
+
+class GenerateReceiptsTest(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        self.output = Path(self.output_dir.name)
+
+        render = mock.patch.object(
+            generate_receipts,
+            "cached_receipt",
+            side_effect=lambda templates, context, store: b"%PDF-"
+            + (context["object"].order_number.encode()),
+        )
+        self.render = render.start()
+        self.addCleanup(render.stop)
+
+        BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        structure = DeclarativeStructure.objects.create(label="Test")
+        for day in (1, 2):
+            Companies.objects.create(
+                label=f"Company {day}",
+                repository_code="54321",
+                postal_code="75002",
+                municipality="Paris",
+                declarative_structure=structure,
+                cash_donation=100.00,
+                date_start=datetime.date(2024, 3, day),
+                valid_date=datetime.date(2024, 4, 1),
+            )
+        PrivateIndividual.objects.create(
+            first_name="Jean",
+            last_name="Dupont",
+            postal_code="38000",
+            municipality="Grenoble",
+            declarative_structure=structure,
+            cash_donation=50.00,
+            date_start=datetime.date(2024, 5, 1),
+            valid_date=datetime.date(2024, 6, 1),
+        )
+        # Not validated
+        PrivateIndividual.objects.create(
+            first_name="Marie",
+            last_name="Curie",
+            postal_code="38000",
+            municipality="Grenoble",
+            declarative_structure=structure,
+            cash_donation=50.00,
+            date_start=datetime.date(2024, 5, 2),
+        )
+
+    def generate(self, output, *args):
+        call_command(
+            "generate_receipts",
+            str(output),
+            "--year=2024",
+            "--workers=1",
+            *args,
+            stdout=io.StringIO(),
+        )
+
+    def test_directory(self):
+        self.generate(self.output)
+        self.assertEqual(
+            sorted(path.name for path in self.output.glob("*.pdf")),
+            [
+                "recu_fiscal_don-2024-PM-1.pdf",
+                "recu_fiscal_don-2024-PM-2.pdf",
+                "recu_fiscal_don-2024-PP-1.pdf",
+            ],
+        )
+
+    def test_filters(self):
+        self.generate(self.output, "--model=individuals", "--status=all")
+        self.assertEqual(len(list(self.output.glob("*.pdf"))), 2)
+
+    def test_tax_receipt_only(self):
+        Companies.objects.filter(label="Company 2").update(tax_receipt=False)
+        self.generate(self.output)
+        self.assertEqual(
+            sorted(path.name for path in self.output.glob("*.pdf")),
+            [
+                "recu_fiscal_don-2024-PM-1.pdf",
+                "recu_fiscal_don-2024-PP-1.pdf",
+            ],
+        )
+
+    def test_no_cache(self):
+        self.generate(self.output, "--no-cache")
+        self.assertEqual(self.render.call_count, 3)
+        for call in self.render.call_args_list:
+            self.assertIs(call.kwargs["store"], False)
+
+    def test_zip(self):
+        self.generate(self.output / "receipts.zip")
+        with zipfile.ZipFile(self.output / "receipts.zip") as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+            self.assertEqual(
+                archive.read("recu_fiscal_don-2024-PP-1.pdf"),
+                b"%PDF-2024-PP-1",
+            )
+        self.assertEqual(
+            list(self.output.iterdir()), [self.output / "receipts.zip"]
+        )
+
+    def test_resume(self):
+        self.generate(self.output, "--model=companies")
+        self.render.reset_mock()
+        self.generate(self.output)
+        self.assertEqual(self.render.call_count, 1)
+        self.generate(self.output, "--restart")
+        self.assertEqual(self.render.call_count, 4)
+
+    def test_merged(self):
+        with mock.patch.object(
+            generate_receipts,
+            "merge_receipts",
+            side_effect=lambda receipts, receipt: b"%PDF-"
+            * len(list(receipts)),
+        ):
+            self.generate(self.output / "receipts.pdf")
+        self.assertEqual(
+            (self.output / "receipts.pdf").read_bytes(), b"%PDF-" * 3
+        )
@@ -0,0 +1,66 @@
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import TestCase
+
+from ..management.commands.benchmark_templates import sample_context
+from ..models import BeneficiaryOrganization
+from ..rendering.compiled import (
+    CompiledTemplate,
+    Unsupported,
+    compile_nodelist,
+    compile_template,
+    render_template,
+)
+
+
+def compile_string(source):
+    template = engines["django"].from_string(source).template
+    return CompiledTemplate(template, compile_nodelist(template.nodelist))
+
+
+class CompiledTemplateTest(TestCase):
+    def test_static_segments_joined(self):
+        compiled = compile_string("<svg>{# note #}<g/>{{ a }}</svg>")
+        self.assertEqual(compiled.segments[0], "<svg><g/>")
+        self.assertEqual(len(compiled.segments), 3)
+
+    def test_values_escaped(self):
+        compiled = compile_string("<text>{{ a|default_if_none:'-' }}</text>")
+        self.assertEqual(
+            compiled.render({"a": "<b>"}), "<text>&lt;b&gt;</text>"
+        )
+        self.assertEqual(compiled.render({"a": None}), "<text>-</text>")
+
+    def test_conditionals(self):
+        compiled = compile_string(
+            "{% if object.type == 'Cash' %}☒{%else%}☐{% endif %}"
+        )
+        self.assertEqual(compiled.render({"object": {"type": "Cash"}}), "☒")
+        self.assertEqual(compiled.render({"object": None}), "☐")
+
+    def test_unsupported_tag(self):
+        template = engines["django"].from_string(
+            "{% for a in b %}{% endfor %}"
+        )
+        with self.assertRaises(Unsupported):
+            compile_nodelist(template.template.nodelist)
+
+    def test_receipt_templates_render_like_django(self):
+        BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        for template_name in (
+            "companies_1.svg",
+            "companies_2.svg",
+            "individuals_1.svg",
+            "individuals_2.svg",
+        ):
+            self.assertIsNotNone(compile_template(template_name))
+            context = sample_context(template_name)
+            self.assertEqual(
+                render_template(template_name, context),
+                render_to_string(template_name, context),
+            )
@@ -0,0 +1,148 @@
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..management.commands import run_workers
+from ..models import (
+    BeneficiaryOrganization,
+    Companies,
+    DeclarativeStructure,
+    RenderJob,
+)
+from ..rendering import cache as receipts_cache
+from ..rendering import receipt_context
+from ..rendering.cache import open_receipt, rendered_root
+
+
+class RenderJobTest(TestCase):
+    def setUp(self):
+        BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        structure = DeclarativeStructure.objects.create(label="Test")
+        for day in (1, 2):
+            Companies.objects.create(
+                label=f"Company {day}",
+                repository_code="54321",
+                postal_code="75002",
+                municipality="Paris",
+                declarative_structure=structure,
+                cash_donation=100.00,
+                date_start=datetime.date(2024, 3, day),
+                valid_date=datetime.date(2024, 4, 1),
+            )
+        RenderJob.enqueue(Companies.objects.all())
+
+    def test_enqueue_once(self):
+        RenderJob.enqueue(Companies.objects.all())
+        self.assertEqual(RenderJob.objects.count(), 2)
+
+    def test_claim_exclusive(self):
+        first = RenderJob.claim("worker-1", timeout=600)
+        second = RenderJob.claim("worker-2", timeout=600)
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(first.locked_by, "worker-1")
+        self.assertEqual(first.attempts, 1)
+        self.assertIsNone(RenderJob.claim("worker-3", timeout=600))
+
+    def test_stalled_job_claimed_again(self):
+        job = RenderJob.claim("worker-1", timeout=600)
+        RenderJob.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        RenderJob.claim("worker-2", timeout=600)
+        job.refresh_from_db()
+        self.assertEqual(job.locked_by, "worker-2")
+        self.assertEqual(job.attempts, 2)
+
+    def test_retry_with_backoff(self):
+        job = RenderJob.claim("worker-1", timeout=600)
+        RenderJob.objects.exclude(pk=job.pk).delete()
+        job.fail("error", max_attempts=2, backoff=30)
+        self.assertEqual(job.status, RenderJob.PENDING)
+        self.assertGreater(
+            job.run_after, timezone.now() + datetime.timedelta(seconds=25)
+        )
+
+        job.run_after = timezone.now()
+        job.save()
+        job = RenderJob.claim("worker-1", timeout=600)
+        job.fail("error", max_attempts=2, backoff=30)
+        self.assertEqual(job.status, RenderJob.FAILED)
+
+    def test_run_workers(self):
+        with mock.patch.object(
+            run_workers,
+            "render_ahead",
+            side_effect=[RuntimeError("boom"), None],
+        ) as render:
+            call_command(
+                "run_workers",
+                "--once",
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(
+            sorted(RenderJob.objects.values_list("status", flat=True)),
+            [RenderJob.DONE, RenderJob.PENDING],
+        )
+        self.assertIn(
+            "boom", RenderJob.objects.get(status=RenderJob.PENDING).last_error
+        )
+
+    def test_database_unavailable(self):
+        stderr = io.StringIO()
+        with mock.patch.object(
+            RenderJob,
+            "claim",
+            side_effect=[OperationalError("gone")] * 2 + [None],
+        ), mock.patch.object(run_workers.time, "sleep") as sleep:
+            call_command(
+                "run_workers", "--once", stdout=io.StringIO(), stderr=stderr
+            )
+        self.assertEqual(sleep.call_args_list, [mock.call(5), mock.call(10)])
+        self.assertIn("database unavailable", stderr.getvalue())
+
+    def test_rendered_ahead_kept_until_purged(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings = override_settings(
+            CERFA_CACHE_ROOT=cache_dir.name, CERFA_RECEIPTS_CACHE_SIZE=0
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        render = mock.patch.object(
+            receipts_cache, "render_receipt", return_value=b"%PDF-"
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+        call_command("run_workers", "--once", stdout=io.StringIO())
+        self.assertEqual(render.call_count, 2)
+        company = Companies.objects.first()
+        templates = run_workers.RECEIPTS["companies"][1]
+        with open_receipt(templates, receipt_context(company)) as receipt:
+            self.assertEqual(receipt.read(), b"%PDF-")
+        self.assertEqual(render.call_count, 2)
+
+        # Purged with their jobs after --keep days
+        RenderJob.objects.update(
+            timestamp_update=timezone.now() - datetime.timedelta(days=2)
+        )
+        for path in rendered_root().glob("*/*.pdf"):
+            os.utime(path, (0, 0))
+        call_command(
+            "run_workers", "--once", "--keep", "1", stdout=io.StringIO()
+        )
+        self.assertFalse(RenderJob.objects.exists())
+        self.assertFalse(list(rendered_root().glob("*/*.pdf")))
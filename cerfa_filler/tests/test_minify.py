@@ -0,0 +1,228 @@
+import base64
+import io
+import os
+import re
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.template import Context, engines
+from django.template.loader import get_template
+from django.test import TestCase, override_settings
+from pypdf import PdfWriter
+
+from ..management.commands import minify_templates
+from ..models import Companies, DeclarativeStructure
+from ..rendering.minify import (
+    ASSET_SCHEME,
+    assets_root,
+    minified_root,
+    minify_svg,
+    read_asset,
+    source_path,
+)
+from ..rendering.stamp import Overlay, stamp
+from ..rendering.weasy import url_fetcher
+
+SVG = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<!-- Created with Inkscape (http://www.inkscape.org/) -->
+<svg
+   width="210mm"
+   inkscape:version="1.4.2"
+   xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+   xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"
+   xmlns:xlink="http://www.w3.org/1999/xlink"
+   xmlns="http://www.w3.org/2000/svg">
+  <sodipodi:namedview id="namedview1" pagecolor="#ffffff">
+    <inkscape:page x="0" y="0" id="page2" />
+  </sodipodi:namedview>
+  <defs id="defs1">
+    <clipPath id="clip1"><path d="M 0,0 H 10.123456 V 10 Z" /></clipPath>
+    <clipPath id="clip2"><path d="M 0,0 H 10.123456 V 10 Z" /></clipPath>
+    <clipPath id="unused"><path d="M 0,0 H 5 V 5 Z" /></clipPath>
+  </defs>
+  <g id="layer1" inkscape:label="Calque 1">
+    <g id="g2" transform="translate(1.5,2)">
+      <path id="path3" clip-path="url(#clip2)" d="m 1.23456,.5.25" />
+    </g>
+    <rect id="rect1" clip-path="url(#clip1)" width="2" height="2" />
+    <text
+       xml:space="preserve"
+       x="12.3456789"
+       y="2"
+       style="font-size:14.6667px;-inkscape-font-specification:'Bold'"><tspan
+         id="tspan1">{{ object.label|default_if_none:''}}</tspan></text>
+    {% if sign_file %}<image xlink:href="data:image/png;base64,{{sign_file}}" />{% endif %}
+  </g>
+</svg>
+"""
+
+
+class MinifySvgTest(TestCase):
+    def setUp(self):
+        self.minified = minify_svg(SVG)
+
+    def test_editor_data_stripped(self):
+        for marker in ("inkscape", "sodipodi", "<!--", "<?xml", 'id="g2"'):
+            self.assertNotIn(marker, self.minified)
+
+    def test_placeholders_kept(self):
+        self.assertIn("{{ object.label|default_if_none:''}}", self.minified)
+        self.assertIn(
+            "{% if sign_file %}<image "
+            'xlink:href="data:image/png;base64,{{sign_file}}"/>{% endif %}',
+            self.minified,
+        )
+
+    def test_precision_reduced(self):
+        self.assertIn('x="12.346"', self.minified)
+        self.assertIn('d="m 1.235,.5.25"', self.minified)
+
+    def test_groups_collapsed(self):
+        self.assertNotIn("<g", self.minified)
+        self.assertIn('transform="translate(1.5,2)"', self.minified)
+
+    def test_definitions_deduplicated(self):
+        self.assertEqual(self.minified.count("<clipPath"), 1)
+        self.assertNotIn('clip-path="url(#clip2)"', self.minified)
+
+    def test_receipt_templates_placeholders_kept(self):
+        placeholder = re.compile(r"\{[{%].*?[}%]\}")
+        for template_name in ("companies_2.svg", "individuals_2.svg"):
+            source = source_path(template_name).read_text()
+            self.assertEqual(
+                placeholder.findall(minify_svg(source)),
+                placeholder.findall(source),
+            )
+
+
+class ExtractImagesTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(CERFA_CACHE_ROOT=self.cache_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.png = b"\x89PNG\r\n\x1a\n" + os.urandom(32)
+
+    def test_images_extracted(self):
+        encoded = base64.b64encode(self.png).decode()
+        assets = {}
+        minified = minify_svg(
+            f'<svg><image xlink:href="data:image/png;base64,{encoded}"/>'
+            '<image xlink:href="data:image/png;base64,{{sign_file}}"/></svg>',
+            assets=assets,
+        )
+        [(name, data)] = assets.items()
+        self.assertEqual(data, self.png)
+        self.assertTrue(name.endswith(".png"))
+        self.assertIn(f'xlink:href="{ASSET_SCHEME}{name}"', minified)
+        self.assertIn("base64,{{sign_file}}", minified)
+        self.assertNotIn(encoded, minified)
+
+    def test_receipt_template_images_extracted(self):
+        assets = {}
+        source = source_path("companies_1.svg").read_text()
+        minified = minify_svg(source, assets=assets)
+        self.assertEqual(len(assets), 3)
+        self.assertNotIn(";base64,", minified)
+        self.assertLess(
+            len(minified),
+            len(minify_svg(source)) - sum(map(len, assets.values())),
+        )
+
+    def test_url_fetcher(self):
+        assets_root().mkdir(parents=True)
+        (assets_root() / "0123456789abcdef.png").write_bytes(self.png)
+        read_asset.cache_clear()
+        self.addCleanup(read_asset.cache_clear)
+        self.assertEqual(
+            url_fetcher(f"{ASSET_SCHEME}0123456789abcdef.png"),
+            {"string": self.png, "mime_type": "image/png"},
+        )
+        with self.assertRaises(ValueError):
+            url_fetcher(f"{ASSET_SCHEME}../../secret.png")
+        for url in ("https://example.org/logo.png", "file:///etc/passwd"):
+            with self.assertRaises(ValueError):
+                url_fetcher(url)
+
+
+class MinifiedLoaderTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(CERFA_CACHE_ROOT=self.cache_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.path = minified_root() / "companies_1.svg"
+        self.path.parent.mkdir(parents=True)
+        self.path.write_text("<svg/>")
+
+    def origin(self):
+        # Bypass the cached loader
+        engines["django"].engine.template_loaders[0].reset()
+        return get_template("companies_1.svg").origin.name
+
+    def test_fresh_copy_served(self):
+        stat = source_path("companies_1.svg").stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.origin(), str(self.path))
+
+    def test_stale_copy_ignored(self):
+        self.assertEqual(self.origin(), str(source_path("companies_1.svg")))
+
+    def test_extends(self):
+        engines["django"].from_string(
+            "{% extends 'base.html' %}"
+        ).template.render(Context())
+
+
+def text_pdf(x):
+    writer = PdfWriter()
+    page = writer.add_blank_page(595.2756, 841.8898)
+    overlay = Overlay(page.mediabox.width, page.mediabox.height)
+    overlay.text(x, 100, "Company", 12)
+    stamp(page, overlay)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class VerifyTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(CERFA_CACHE_ROOT=self.cache_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        Companies.objects.create(
+            label="Sample Company",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test"
+            ),
+            cash_donation=100.00,
+        )
+
+    def verify(self, *pdfs):
+        with mock.patch.object(
+            minify_templates, "svg_to_pdf", side_effect=pdfs
+        ) as render:
+            call_command(
+                "minify_templates",
+                "companies_2.svg",
+                "--verify",
+                stdout=io.StringIO(),
+            )
+        # Rendered for a donation
+        self.assertIn("Sample Company", render.call_args.args[0])
+
+    def test_unchanged(self):
+        self.verify(text_pdf(100), text_pdf(100.05))
+
+    def test_moved_text(self):
+        with self.assertRaises(CommandError):
+            self.verify(text_pdf(100), text_pdf(101))
+        self.assertFalse((minified_root() / "companies_2.svg").exists())
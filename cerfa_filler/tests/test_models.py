@@ -1,15 +1,26 @@
+import datetime
+import threading
 import urllib.parse
+from unittest import mock
 
+import tablib
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
 
+from ..admin import CompaniesResource
 from ..models import (
+    BENEFICIARY_VERSION_KEY,
     BeneficiaryOrganization,
     Companies,
     CompanyLegalForms,
     DeclarativeStructure,
+    OrderCounter,
+    PrivateIndividual,
 )
+from ..views import receipt_context
 
 
 class DeclarativeStructureTest(TestCase):
@@ -57,6 +68,46 @@ class BeneficiaryOrganizationTest(TestCase):
     def test_beneficiary_string_representation(self):
         self.assertEqual(str(self.beneficiary), "Test Beneficiary")
 
+    def test_current_cached(self):
+        BeneficiaryOrganization.get_current()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                BeneficiaryOrganization.get_current(), self.beneficiary
+            )
+
+    def test_current_invalidated(self):
+        BeneficiaryOrganization.get_current()
+        self.beneficiary.label = "Updated Beneficiary"
+        self.beneficiary.save()
+        self.assertEqual(
+            BeneficiaryOrganization.get_current().label, "Updated Beneficiary"
+        )
+        self.beneficiary.delete()
+        self.assertIsNone(BeneficiaryOrganization.get_current())
+
+    def test_current_invalidated_by_other_process(self):
+        BeneficiaryOrganization.get_current()
+        # What the signal handlers of another process change
+        cache.delete(BENEFICIARY_VERSION_KEY)
+        with self.assertNumQueries(1):
+            BeneficiaryOrganization.get_current()
+
+    def test_receipt_context_without_query(self):
+        company = Companies.objects.create(
+            label="Test Company",
+            repository_code="54321",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test Structure"
+            ),
+            cash_donation=100.00,
+        )
+        receipt_context(company)
+        with self.assertNumQueries(0):
+            context = receipt_context(company)
+        self.assertEqual(context["company"], self.beneficiary)
+
 
 class CompaniesTest(TestCase):
     def setUp(self):
@@ -112,3 +163,337 @@ class CompaniesTest(TestCase):
         self.assertIsNotNone(
             self.company.order
         )  # Ensure order is set after save
+
+
+def create_company(structure, **kwargs):
+    return Companies.objects.create(
+        label="Test Company",
+        postal_code="75002",
+        municipality="Paris",
+        declarative_structure=structure,
+        cash_donation=100.00,
+        **kwargs,
+    )
+
+
+class OrderCounterTest(TestCase):
+    def setUp(self):
+        self.structure = DeclarativeStructure.objects.create(
+            label="Test Structure"
+        )
+
+    def test_sequence_per_model_and_year(self):
+        orders = [create_company(self.structure).order for _ in range(3)]
+        self.assertEqual(orders, [1, 2, 3])
+        self.assertEqual(
+            create_company(
+                self.structure, date_start=datetime.date(2020, 5, 1)
+            ).order,
+            1,
+        )
+        individual = PrivateIndividual.objects.create(
+            first_name="Jean",
+            last_name="Dupont",
+            declarative_structure=self.structure,
+        )
+        self.assertEqual(individual.order, 1)
+        self.assertEqual(
+            OrderCounter.objects.get(
+                model_name="companies", year=datetime.date.today().year
+            ).last_order,
+            3,
+        )
+
+    def test_counter_created_from_existing_orders(self):
+        create_company(self.structure, order=41)
+        self.assertFalse(OrderCounter.objects.exists())
+        self.assertEqual(create_company(self.structure).order, 42)
+
+    def test_failed_save_gives_number_back(self):
+        create_company(self.structure)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_company(self.structure, declarative_structure_id=None)
+        self.assertEqual(create_company(self.structure).order, 2)
+
+    def test_new_order_when_moved_to_another_year(self):
+        moved = create_company(
+            self.structure, date_start=datetime.date(2024, 12, 31)
+        )
+        create_company(self.structure, date_start=datetime.date(2025, 1, 2))
+        self.assertEqual(moved.order, 1)
+
+        moved = Companies.objects.get(pk=moved.pk)
+        moved.date_start = datetime.date(2025, 1, 1)
+        moved.save()
+        self.assertEqual(moved.order, 2)
+        self.assertEqual(
+            Companies.objects.get(pk=moved.pk).order_number, "2025-PM-2"
+        )
+        # Saved again in its new year, it keeps its number
+        moved.save()
+        self.assertEqual(Companies.objects.get(pk=moved.pk).order, 2)
+
+    def test_unique_order(self):
+        company = create_company(self.structure)
+        with self.assertRaises(IntegrityError):
+            create_company(self.structure, order=company.order)
+
+
+class BulkCreateTest(TestCase):
+    def setUp(self):
+        self.structure = DeclarativeStructure.objects.create(
+            label="Test Structure"
+        )
+        self.dates = [
+            datetime.date(year, month, day)
+            for year in (2023, 2024)
+            for month in (11, 2, 7)
+            for day in (3, 28, 3)
+        ]
+
+    def companies(self):
+        return [
+            Companies(
+                label=f"Company {number}",
+                date_start=date_start,
+                declarative_structure=self.structure,
+            )
+            for number, date_start in enumerate(self.dates)
+        ]
+
+    def orders(self):
+        return list(
+            Companies.objects.order_by("label").values_list(
+                "date_start", "order"
+            )
+        )
+
+    def test_same_numbers_as_save(self):
+        create_company(self.structure, date_start=datetime.date(2024, 1, 1))
+        with transaction.atomic():
+            for company in sorted(
+                self.companies(), key=lambda company: company.date_start
+            ):
+                company.save()
+            expected = self.orders()
+            transaction.set_rollback(True)
+
+        # Creation of the counter of 2023, increment of the one of 2024 and
+        # the insertion, whatever the number of donations
+        with self.assertNumQueries(12):
+            Companies.objects.bulk_create(self.companies())
+        self.assertEqual(self.orders(), expected)
+        self.assertEqual(create_company(self.structure).order, 1)
+        self.assertEqual(
+            create_company(
+                self.structure, date_start=datetime.date(2024, 1, 1)
+            ).order,
+            11,
+        )
+
+    def test_numbers_given(self):
+        companies = self.companies()
+        companies[0].order = 40
+        Companies.objects.bulk_create(companies)
+        self.assertEqual(
+            sorted(
+                Companies.objects.filter(date_start__year=2023).values_list(
+                    "order", flat=True
+                )
+            ),
+            list(range(40, 49)),
+        )
+
+    def test_import(self):
+        company = create_company(self.structure)
+        dataset = tablib.Dataset(
+            headers=["uuid", "label", "declarative_structure", "date_start"]
+        )
+        dataset.append(
+            [company.uuid, "Renamed", self.structure.pk, company.date_start]
+        )
+        for number, date_start in enumerate(self.dates):
+            dataset.append(
+                ["", f"Company {number}", self.structure.pk, date_start]
+            )
+        result = CompaniesResource().import_data(dataset, raise_errors=True)
+
+        self.assertEqual(result.totals["new"], len(self.dates))
+        renamed = Companies.objects.get(pk=company.pk)
+        self.assertEqual((renamed.label, renamed.order), ("Renamed", 1))
+        self.assertGreater(renamed.timestamp_update, company.timestamp_update)
+        self.assertEqual(
+            Companies.objects.filter(date_start__year=2023)
+            .order_by("date_start", "order")
+            .first()
+            .order,
+            1,
+        )
+
+    def test_import_unsorted_batches(self):
+        dataset = tablib.Dataset(
+            headers=["label", "declarative_structure", "date_start"]
+        )
+        for number, date_start in enumerate(reversed(self.dates)):
+            dataset.append(
+                [f"Company {number}", self.structure.pk, str(date_start)]
+            )
+        with mock.patch.object(CompaniesResource._meta, "batch_size", 4):
+            CompaniesResource().import_data(dataset, raise_errors=True)
+
+        for year in (2023, 2024):
+            donations = Companies.objects.filter(fiscal_year=year)
+            self.assertEqual(
+                list(
+                    donations.order_by("date_start", "order").values_list(
+                        "order", flat=True
+                    )
+                ),
+                list(range(1, 10)),
+            )
+
+    def test_import_without_uuid(self):
+        company = create_company(self.structure)
+        dataset = tablib.Dataset(
+            headers=["label", "declarative_structure", "date_start"]
+        )
+        for number, date_start in enumerate(self.dates[:3]):
+            dataset.append(
+                [f"Company {number}", self.structure.pk, date_start]
+            )
+        result = CompaniesResource().import_data(dataset, raise_errors=True)
+
+        self.assertEqual(result.totals["new"], 3)
+        self.assertEqual(Companies.objects.count(), 4)
+        self.assertEqual(
+            Companies.objects.get(pk=company.pk).label, company.label
+        )
+
+    def test_import_moved_to_another_year(self):
+        company = create_company(
+            self.structure, date_start=datetime.date(2024, 12, 31)
+        )
+        create_company(self.structure, date_start=datetime.date(2025, 1, 2))
+        dataset = tablib.Dataset(headers=["uuid", "label", "date_start"])
+        dataset.append([company.uuid, company.label, "2025-01-01"])
+        CompaniesResource().import_data(dataset, raise_errors=True)
+
+        self.assertEqual(Companies.objects.get(pk=company.pk).order, 2)
+
+
+class ListIndexesTest(TestCase):
+    """Query plans of the filters of the lists"""
+
+    def setUp(self):
+        self.structure = DeclarativeStructure.objects.create(
+            label="Test Structure"
+        )
+        create_company(self.structure)
+        # Donations of 5 years and 10 structures, few of them pending, and
+        # their statistics: the plans are those of a real database
+        structures = [self.structure] + [
+            DeclarativeStructure.objects.create(label=f"Structure {number}")
+            for number in range(9)
+        ]
+        for model, fields in (
+            (Companies, {"label": "Company"}),
+            (PrivateIndividual, {"first_name": "Jean", "last_name": "Dupont"}),
+        ):
+            model.objects.bulk_create(
+                model(
+                    date_start=datetime.date(2020 + number % 5, 3, 1),
+                    declarative_structure=structures[number // 5 % 10],
+                    valid_date=None if number % 19 == 0 else "2025-01-01",
+                    **fields,
+                )
+                for number in range(2000)
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+    def assertUsesIndex(self, queryset, index):
+        self.assertRegex(queryset.explain(), index)
+
+    def test_fiscal_year(self):
+        create_company(self.structure, date_start=datetime.date(2019, 5, 1))
+        self.assertEqual(
+            Companies.objects.filter(fiscal_year=2019).get().date_start,
+            datetime.date(2019, 5, 1),
+        )
+
+    def test_year_and_structure(self):
+        for model, index in (
+            (Companies, "companies_year_structure_idx"),
+            (PrivateIndividual, "individuals_year_structure_idx"),
+        ):
+            self.assertUsesIndex(
+                model.objects.filter(
+                    fiscal_year=2024, declarative_structure=self.structure
+                ),
+                index,
+            )
+
+    def test_pending_validations(self):
+        for model, index in (
+            (Companies, "companies_pending_idx"),
+            (PrivateIndividual, "individuals_pending_idx"),
+        ):
+            self.assertUsesIndex(
+                model.objects.filter(
+                    fiscal_year=2024, valid_date__isnull=True
+                ),
+                index,
+            )
+
+    def test_years(self):
+        if connection.vendor == "postgresql":
+            # Read from the index from tens of thousands of donations, a
+            # sequential scan is cheaper below
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        self.assertUsesIndex(
+            Companies.objects.order_by("fiscal_year")
+            .values_list("fiscal_year", flat=True)
+            .distinct(),
+            "companies_year_structure_idx|unique_companies_order",
+        )
+
+
+class OrderConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest(
+                "The connections of an in-memory SQLite database fail on "
+                "locked tables instead of waiting, use PostgreSQL or a file "
+                "test database"
+            )
+        self.structure = DeclarativeStructure.objects.create(
+            label="Test Structure"
+        )
+
+    def test_parallel_inserts(self):
+        threads, per_thread = 8, 10
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def insert():
+            try:
+                barrier.wait()
+                for _ in range(per_thread):
+                    create_company(self.structure)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=insert) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            sorted(Companies.objects.values_list("order", flat=True)),
+            list(range(1, threads * per_thread + 1)),
+        )
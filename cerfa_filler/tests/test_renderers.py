@@ -0,0 +1,163 @@
+import importlib.util
+import io
+import tempfile
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from pypdf import PdfReader
+
+from ..models import (
+    BeneficiaryOrganization,
+    Companies,
+    DeclarativeStructure,
+    PrivateIndividual,
+)
+from ..rendering import load_renderer, render_receipt
+from ..rendering.acroform import render_receipt as render_acroform
+from ..rendering.batch import merge_receipts
+from ..rendering.preview import svg_document
+from ..views import CompaniesCerfaToPdf, PrivateIndividualCerfaToPdf
+
+
+def page_text(pdf) -> list:
+    return [page.extract_text() for page in PdfReader(io.BytesIO(pdf)).pages]
+
+
+def page_sizes(pdf) -> list:
+    return [
+        (float(page.mediabox.width), float(page.mediabox.height))
+        for page in PdfReader(io.BytesIO(pdf)).pages
+    ]
+
+
+class RendererParityMixin:
+    """Compares the receipts of ``renderer`` with those of WeasyPrint"""
+
+    renderer = None
+    reference = "weasyprint"
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(CERFA_CACHE_ROOT=self.cache_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        structure = DeclarativeStructure.objects.create(label="Test Structure")
+        self.company = Companies.objects.create(
+            label="Test Company",
+            repository_code="54321",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=structure,
+            cash_donation=100.00,
+            cash_payment_type="Cheque",
+        )
+        self.individual = PrivateIndividual.objects.create(
+            first_name="Jean",
+            last_name="Dupont",
+            postal_code="38000",
+            municipality="Grenoble",
+            declarative_structure=structure,
+            cash_donation=50.00,
+        )
+
+    def render(self, templates, donor, renderer):
+        context = {
+            "object": donor,
+            "company": self.beneficiary,
+            "sign_file": None,
+        }
+        return render_receipt(templates, context, renderer)
+
+    def assertParity(self, templates, donor, values):
+        expected = self.render(templates, donor, self.reference)
+        actual = self.render(templates, donor, self.renderer)
+        self.assertEqual(len(page_sizes(actual)), len(page_sizes(expected)))
+        for size, expected_size in zip(
+            page_sizes(actual), page_sizes(expected)
+        ):
+            for value, expected_value in zip(size, expected_size):
+                self.assertAlmostEqual(value, expected_value, delta=1)
+        text, expected_text = page_text(actual), page_text(expected)
+        for number, value in values:
+            self.assertIn(value, expected_text[number])
+            self.assertIn(value, text[number])
+
+    def test_companies_receipt(self):
+        self.assertParity(
+            CompaniesCerfaToPdf.templates,
+            self.company,
+            [
+                (0, self.company.order_number),
+                (0, "Test Beneficiary"),
+                (1, "Test Company"),
+                (1, "75002"),
+            ],
+        )
+
+    def test_mailing(self):
+        templates = CompaniesCerfaToPdf.templates
+        context = {
+            "object": self.company,
+            "company": self.beneficiary,
+            "sign_file": None,
+        }
+        with override_settings(CERFA_RENDERERS={"companies": self.renderer}):
+            text = page_text(merge_receipts([(templates, context)]))
+        self.assertIn(self.company.order_number, text[0])
+        self.assertIn("Test Beneficiary", text[0])
+        self.assertIn("Test Company", text[1])
+
+    def test_individuals_receipt(self):
+        self.assertParity(
+            PrivateIndividualCerfaToPdf.templates,
+            self.individual,
+            [
+                (0, self.individual.order_number),
+                (1, "Dupont"),
+                (1, "Grenoble"),
+            ],
+        )
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("cairosvg"), "CairoSVG is not installed"
+)
+class CairoSvgParityTest(RendererParityMixin, TestCase):
+    renderer = "cairosvg"
+
+
+class SinglePassParityTest(RendererParityMixin, TestCase):
+    renderer = "weasyprint-single"
+
+
+class LoadRendererTest(TestCase):
+    def test_registered_name(self):
+        self.assertIs(load_renderer("acroform"), render_acroform)
+
+    def test_dotted_path(self):
+        self.assertIs(
+            load_renderer("cerfa_filler.rendering.acroform.render_receipt"),
+            render_acroform,
+        )
+
+    def test_unknown_renderer(self):
+        with self.assertRaises(ImproperlyConfigured):
+            load_renderer("cerfa_filler.rendering.nope")
+
+    def test_svg_document(self):
+        self.assertEqual(
+            svg_document(
+                '<?xml version="1.0"?>\n<style>@page { margin: 0 }</style>'
+                '<svg width="1"><text>a</text></svg>\n'
+            ),
+            '<svg width="1"><text>a</text></svg>',
+        )
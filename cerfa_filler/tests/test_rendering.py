@@ -0,0 +1,609 @@
+import base64
+import io
+import random
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+
+from ..models import (
+    BeneficiaryOrganization,
+    Companies,
+    DeclarativeStructure,
+    PrivateIndividual,
+)
+from ..rendering import render_receipt
+from ..rendering.acroform import FormField
+from ..rendering.batch import merge_receipts
+from ..rendering.layouts import LAYOUTS, CheckboxSlot, TextSlot
+from ..rendering.optimize import optimize_pdf
+from ..rendering.pages import static_page
+from ..rendering.signature import (
+    SIGNATURE_SIZE,
+    normalize_signature,
+    signature_data,
+)
+from ..rendering.stamp import Overlay, UnencodableText, stamp
+from ..rendering.weasy import PAGE_BREAK
+
+
+def text_positions(pdf):
+    """Position of every text run of a PDF, keyed by page and text"""
+    positions = {}
+    for number, page in enumerate(PdfReader(io.BytesIO(pdf)).pages):
+
+        def visitor(text, cm, tm, font_dict, font_size):
+            if text.strip():
+                x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+                y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+                positions[(number, text.strip())] = (x, y)
+
+        page.extract_text(visitor_text=visitor)
+    return positions
+
+
+def blank_pdf(*args, **kwargs):
+    writer = PdfWriter()
+    writer.add_blank_page(595.2756, 841.8898)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class TextSlotTest(TestCase):
+    def test_resolve_value(self):
+        slot = TextSlot("object.label", 0, 0, 10)
+        self.assertEqual(slot.resolve({"object": {"label": "LPO"}}), "LPO")
+
+    def test_resolve_default(self):
+        slot = TextSlot("object.label", 0, 0, 10, default="-")
+        self.assertEqual(slot.resolve({"object": None}), "-")
+
+    def test_checkbox(self):
+        slot = CheckboxSlot("object.cash_payment_type", "Cheque", 0, 0, 10)
+        self.assertTrue(
+            slot.resolve({"object": {"cash_payment_type": "Cheque"}})
+        )
+        self.assertFalse(slot.resolve({"object": None}))
+
+    def test_checkbox_values(self):
+        slot = CheckboxSlot(
+            "object.cash_payment_type", ("Bank transfer", "CB"), 0, 0, 10
+        )
+        self.assertTrue(slot.resolve({"object": {"cash_payment_type": "CB"}}))
+
+
+class OverlayTest(TestCase):
+    def test_stamp_text(self):
+        page = PdfWriter(clone_from=io.BytesIO(blank_pdf())).pages[0]
+        overlay = Overlay()
+        overlay.draw(
+            LAYOUTS["companies_1.svg"],
+            {"object": {"order_number": "2025-PM-12"}},
+        )
+        stamp(page, overlay)
+        self.assertIn("2025-PM-12", page.extract_text())
+
+    def test_checked_box(self):
+        overlay = Overlay()
+        overlay.draw(
+            LAYOUTS["companies_2.svg"],
+            {"object": {"cash_payment_type": "Cash"}},
+        )
+        checks = [op for op in overlay.operations if op.endswith(b"S Q")]
+        self.assertEqual(len(checks), 1)
+
+    def test_empty_overlay(self):
+        overlay = Overlay()
+        overlay.text(10, 10, "", 12)
+        self.assertEqual(overlay.operations, [])
+
+
+class StaticPageTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.calls = []
+
+    def render(self, template_name, context):
+        self.calls.append((template_name, context))
+        return blank_pdf()
+
+    def test_first_page_rendered_once(self):
+        with override_settings(CERFA_CACHE_ROOT=self.cache_dir.name):
+            static_page("companies_1.svg", self.beneficiary, self.render)
+            static_page("companies_1.svg", self.beneficiary, self.render)
+        self.assertEqual(len(self.calls), 1)
+        self.assertIsNone(self.calls[0][1]["object"])
+
+    def test_first_page_invalidated_on_beneficiary_update(self):
+        with override_settings(CERFA_CACHE_ROOT=self.cache_dir.name):
+            static_page("companies_1.svg", self.beneficiary, self.render)
+            self.beneficiary.label = "Updated Beneficiary"
+            self.beneficiary.save()
+            static_page("companies_1.svg", self.beneficiary, self.render)
+        self.assertEqual(len(self.calls), 2)
+
+
+class OverlayParityTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.company = Companies.objects.create(
+            label="Test Company",
+            repository_code="54321",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test Structure"
+            ),
+            cash_donation=100.00,
+            cash_payment_type="Cheque",
+        )
+        self.context = {"object": self.company, "company": self.beneficiary}
+
+    def test_fields_positions_match_weasyprint(self):
+        templates = ("companies_1.svg", "companies_2.svg")
+        with override_settings(CERFA_CACHE_ROOT=self.cache_dir.name):
+            expected = text_positions(
+                render_receipt(templates, self.context, "weasyprint")
+            )
+            actual = text_positions(
+                render_receipt(templates, self.context, "overlay")
+            )
+        for key in (
+            (0, self.company.order_number),
+            (1, "Test Company"),
+            (1, "54321"),
+            (1, "75002"),
+        ):
+            self.assertIn(key, actual)
+            for expected_coord, actual_coord in zip(
+                expected[key], actual[key]
+            ):
+                self.assertAlmostEqual(expected_coord, actual_coord, delta=3)
+
+
+class UnencodableTextTest(TestCase):
+    def test_no_replacement_character(self):
+        with self.assertRaises(UnencodableText):
+            Overlay().text(10, 10, "Nguyễn", 12)
+        Overlay().text(10, 10, "Zoë Müller N° 1 €", 12)
+
+    def test_overlay_laid_out_by_weasyprint(self):
+        beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        company = Companies.objects.create(
+            label="Łukasz Nguyễn",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test Structure"
+            ),
+            cash_donation=100.00,
+        )
+        # The backgrounds, then the whole receipt
+        with mock.patch(
+            "cerfa_filler.rendering.weasy.render_svg", side_effect=blank_pdf
+        ), mock.patch(
+            "cerfa_filler.rendering.weasy.render_receipt",
+            side_effect=blank_pdf,
+        ) as weasy_render:
+            render_receipt(
+                ("companies_1.svg", "companies_2.svg"),
+                {"object": company, "company": beneficiary},
+                "overlay",
+            )
+        weasy_render.assert_called_once()
+
+
+class SinglePassTest(TestCase):
+    def setUp(self):
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.individual = PrivateIndividual.objects.create(
+            first_name="Jean",
+            last_name="Dupont",
+            postal_code="38000",
+            municipality="Grenoble",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test Structure"
+            ),
+            cash_donation=50.00,
+        )
+        self.context = {"object": self.individual, "company": self.beneficiary}
+
+    def test_first_page_laid_out_by_weasyprint(self):
+        with mock.patch(
+            "cerfa_filler.rendering.weasy.svg_to_pdf", return_value=blank_pdf()
+        ) as svg_to_pdf:
+            render_receipt(
+                ("individuals_1.svg", "individuals_2.svg"),
+                self.context,
+                "weasyprint",
+            )
+        first, second = (call[0][0] for call in svg_to_pdf.call_args_list)
+        self.assertIn(self.individual.order_number, first)
+        self.assertIn("Dupont", second)
+
+    def test_pages_laid_out_at_once(self):
+        with mock.patch(
+            "cerfa_filler.rendering.weasy.svg_to_pdf", return_value=blank_pdf()
+        ) as svg_to_pdf:
+            render_receipt(
+                ("individuals_1.svg", "individuals_2.svg"),
+                self.context,
+                "weasyprint-single",
+            )
+        svg_to_pdf.assert_called_once()
+        [first, second] = svg_to_pdf.call_args[0][0].split(PAGE_BREAK)
+        self.assertIn(self.individual.order_number, first)
+        self.assertIn("Dupont", second)
+
+
+class AcroformTest(TestCase):
+    def setUp(self):
+        structure = DeclarativeStructure.objects.create(label="Test Structure")
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.company = Companies.objects.create(
+            label="Test Company",
+            repository_code="98765432100012",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=structure,
+            cash_donation=100.00,
+            cash_payment_type="CB",
+        )
+        self.individual = PrivateIndividual.objects.create(
+            first_name="Jean",
+            last_name="Dupont",
+            postal_code="38000",
+            municipality="Grenoble",
+            declarative_structure=structure,
+            cash_donation=50.00,
+        )
+
+    def render(self, donor):
+        return render_receipt(
+            (), {"object": donor, "company": self.beneficiary}, "acroform"
+        )
+
+    def test_companies_form_filled_and_flattened(self):
+        pdf = self.render(self.company)
+        reader = PdfReader(io.BytesIO(pdf))
+        self.assertIsNone(reader.get_fields())
+        text = "\n".join(page.extract_text() for page in reader.pages)
+        for value in (self.company.order_number, "Test Company", "987654321"):
+            self.assertIn(value, text)
+        self.assertNotIn("98765432100012", text)
+
+    def test_individuals_form_stamped(self):
+        text = "\n".join(
+            page.extract_text()
+            for page in PdfReader(
+                io.BytesIO(self.render(self.individual))
+            ).pages
+        )
+        for value in (self.individual.order_number, "Dupont", "Grenoble"):
+            self.assertIn(value, text)
+
+    def test_byte_stable(self):
+        self.assertEqual(self.render(self.company), self.render(self.company))
+
+    def test_unencodable_text_laid_out_by_weasyprint(self):
+        self.company.label = "Łukasz Nguyễn"
+        self.individual.last_name = "Ştefan"
+        for donor in (self.company, self.individual):
+            with mock.patch(
+                "cerfa_filler.rendering.weasy.render_receipt",
+                side_effect=blank_pdf,
+            ) as weasy_render:
+                self.render(donor)
+            weasy_render.assert_called_once()
+
+    @override_settings(CERFA_RENDERERS={"companies": "acroform"})
+    def test_renderer_per_model(self):
+        pdf = render_receipt(
+            ("companies_1.svg", "companies_2.svg"),
+            {"object": self.company, "company": self.beneficiary},
+        )
+        self.assertIn(
+            "Test Company", PdfReader(io.BytesIO(pdf)).pages[1].extract_text()
+        )
+
+    def test_field_overflow(self):
+        field = FormField("b16", "value", overflow="b17", wrap=12)
+        self.assertEqual(
+            field.resolve({"value": "cent euros et zéro centimes"}),
+            {"b16": "cent euros", "b17": "et zéro centimes"},
+        )
+
+
+def artwork_pdf(template_name, context):
+    """Background page holding an image, like the logos of the templates"""
+    image = io.BytesIO()
+    noise = random.Random(0).randbytes(64 * 64 * 3)
+    Image.frombytes("RGB", (64, 64), noise).save(image, "PNG")
+    writer = PdfWriter()
+    page = writer.add_blank_page(595.2756, 841.8898)
+    overlay = Overlay(page.mediabox.width, page.mediabox.height)
+    overlay.image(((0, 0), (200, 200)), image.getvalue())
+    overlay.text(300, 100, template_name, 12)
+    stamp(page, overlay)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(CERFA_CACHE_ROOT=self.cache_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        structure = DeclarativeStructure.objects.create(label="Test Structure")
+        self.companies = [
+            Companies.objects.create(
+                label=f"Company {number}",
+                repository_code="54321",
+                postal_code="75002",
+                municipality="Paris",
+                declarative_structure=structure,
+                cash_donation=100.00,
+            )
+            for number in range(10)
+        ]
+
+    def merge(self, companies):
+        templates = ("companies_1.svg", "companies_2.svg")
+        return merge_receipts(
+            (
+                (templates, {"object": company, "company": self.beneficiary})
+                for company in companies
+            ),
+            artwork_pdf,
+        )
+
+    def test_receipts_merged(self):
+        reader = PdfReader(io.BytesIO(self.merge(self.companies)))
+        self.assertEqual(len(reader.pages), 20)
+        self.assertIn("Company 9", reader.pages[19].extract_text())
+        self.assertIn("companies_2.svg", reader.pages[19].extract_text())
+
+    def test_artwork_shared(self):
+        single = len(self.merge(self.companies[:1]))
+        batch = len(self.merge(self.companies))
+        self.assertLess(batch, 2 * single)
+
+    def test_unencodable_name_added_as_rendered(self):
+        company = Companies.objects.create(
+            label="Łukasz Nguyễn",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=self.companies[0].declarative_structure,
+            cash_donation=100.00,
+        )
+        receipt = mock.Mock(side_effect=blank_pdf)
+        pdf = merge_receipts(
+            (
+                (
+                    ("companies_1.svg", "companies_2.svg"),
+                    {"object": donor, "company": self.beneficiary},
+                )
+                for donor in (self.companies[0], company)
+            ),
+            artwork_pdf,
+            receipt=receipt,
+        )
+        receipt.assert_called_once()
+        self.assertIs(receipt.call_args.args[1]["object"], company)
+        pages = PdfReader(io.BytesIO(pdf)).pages
+        self.assertEqual(len(pages), 3)
+        self.assertNotIn("?", "".join(page.extract_text() for page in pages))
+
+    @override_settings(CERFA_RENDERERS={"companies": "weasyprint"})
+    def test_receipts_of_the_configured_renderer(self):
+        with mock.patch(
+            "cerfa_filler.rendering.batch.cached_receipt",
+            side_effect=blank_pdf,
+        ) as receipt:
+            pdf = merge_receipts(
+                (
+                    (
+                        ("companies_1.svg", "companies_2.svg"),
+                        {"object": company, "company": self.beneficiary},
+                    )
+                    for company in self.companies[:2]
+                )
+            )
+        self.assertEqual(receipt.call_count, 2)
+        self.assertEqual(len(PdfReader(io.BytesIO(pdf)).pages), 2)
+
+    def test_configured_renderer(self):
+        templates = ("companies_1.svg", "companies_2.svg")
+        context = {
+            "object": self.companies[0],
+            "company": self.beneficiary,
+            "sign_file": None,
+        }
+        with override_settings(CERFA_RENDERERS={"companies": "acroform"}):
+            merged = merge_receipts([(templates, context)])
+            receipt = render_receipt(templates, context)
+        # The official form, not the SVG templates
+        text = [
+            page.extract_text() for page in PdfReader(io.BytesIO(merged)).pages
+        ]
+        self.assertIn("2041-MEC-SD", text[0])
+        self.assertIn("Company 0", text[1])
+        self.assertEqual(
+            text,
+            [
+                page.extract_text()
+                for page in PdfReader(io.BytesIO(receipt)).pages
+            ],
+        )
+
+
+class OptimizeTest(TestCase):
+    def setUp(self):
+        # A photo larger than the page at 150 dpi, and the same stamped
+        # field twice, uncompressed
+        image = io.BytesIO()
+        noise = random.Random(0).randbytes(1500 * 1000 * 3)
+        Image.frombytes("RGB", (1500, 1000), noise).save(image, "PNG")
+        writer = PdfWriter()
+        for _ in range(2):
+            page = writer.add_blank_page(595.2756, 841.8898)
+            overlay = Overlay(page.mediabox.width, page.mediabox.height)
+            overlay.image(((0, 0), (595, 400)), image.getvalue())
+            overlay.text(300, 100, "N° 2024-00001", 12)
+            stamp(page, overlay)
+        output = io.BytesIO()
+        writer.write(output)
+        self.pdf = output.getvalue()
+
+    def image_sizes(self, pdf):
+        return [
+            image.image.size
+            for page in PdfReader(io.BytesIO(pdf)).pages
+            for image in page.images
+        ]
+
+    def test_archive_keeps_images(self):
+        pdf = optimize_pdf(self.pdf, "archive")
+        self.assertLess(len(pdf), len(self.pdf))
+        self.assertEqual(self.image_sizes(pdf), [(1500, 1000)] * 2)
+        self.assertEqual(text_positions(pdf), text_positions(self.pdf))
+
+    def test_screen_downsamples_images(self):
+        pdf = optimize_pdf(self.pdf, "screen")
+        self.assertLess(len(pdf), len(optimize_pdf(self.pdf, "archive")))
+        self.assertEqual(self.image_sizes(pdf), [(1240, 827)] * 2)
+        # Identical images are only stored once
+        reader = PdfReader(io.BytesIO(pdf))
+        self.assertEqual(
+            *(
+                page["/Resources"]["/XObject"].raw_get("/CerfaIm0")
+                for page in reader.pages
+            )
+        )
+
+
+class SignatureTest(TestCase):
+    def setUp(self):
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        # A phone photo of a signature
+        photo = io.BytesIO()
+        Image.frombytes(
+            "RGBA", (1500, 1000), random.Random(0).randbytes(1500 * 1000 * 4)
+        ).save(photo, "PNG")
+        self.photo = photo.getvalue()
+        self.beneficiary = BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+            sign_file=SimpleUploadedFile("signature.png", self.photo),
+        )
+
+    def test_normalized_on_upload(self):
+        image = Image.open(self.beneficiary.sign_image)
+        self.assertEqual(image.size, (459, 306))
+        self.assertEqual(image.mode, "P")
+        self.assertLess(self.beneficiary.sign_image.size, len(self.photo) / 10)
+
+    def test_replaced_image_deleted(self):
+        storage = self.beneficiary.sign_image.storage
+        first = self.beneficiary.sign_image.name
+        self.beneficiary.sign_file = SimpleUploadedFile(
+            "signature.png", self.photo
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.beneficiary.save()
+        second = self.beneficiary.sign_image.name
+        self.assertFalse(storage.exists(first))
+        self.assertTrue(storage.exists(second))
+
+        self.beneficiary.sign_file = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.beneficiary.save()
+        self.assertFalse(storage.exists(second))
+
+    def test_palette_transparency_kept(self):
+        image = Image.new("P", (2040, 612), 0)
+        image.putpalette([255, 255, 255, 0, 0, 128])
+        image.paste(1, (100, 100, 1900, 500))
+        scan = io.BytesIO()
+        image.save(scan, "PNG", transparency=0)
+
+        normalized = Image.open(
+            io.BytesIO(normalize_signature(scan.getvalue()))
+        )
+        self.assertEqual(normalized.size, SIGNATURE_SIZE)
+        normalized = normalized.convert("RGBA")
+        self.assertEqual(normalized.getpixel((0, 0))[3], 0)
+        red, green, blue, alpha = normalized.getpixel((510, 153))
+        self.assertEqual((red, green, blue), (0, 0, 128))
+        self.assertGreater(alpha, 250)
+
+    def test_encoded_once(self):
+        data = signature_data(self.beneficiary)
+        with mock.patch.object(
+            self.beneficiary.sign_image.storage, "open"
+        ) as storage_open:
+            self.assertEqual(signature_data(self.beneficiary), data)
+        storage_open.assert_not_called()
+        self.assertEqual(
+            base64.b64decode(data), self.beneficiary.sign_image.read()
+        )
+
+    def test_previous_uploads_normalized(self):
+        BeneficiaryOrganization.objects.filter(pk=self.beneficiary.pk).update(
+            sign_image=None
+        )
+        self.beneficiary.refresh_from_db()
+        image = Image.open(
+            io.BytesIO(base64.b64decode(signature_data(self.beneficiary)))
+        )
+        self.assertEqual(image.size, (459, 306))
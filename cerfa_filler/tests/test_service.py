@@ -0,0 +1,115 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from ..models import Companies
+from ..rendering import service
+
+
+def fake_render_process(conn):
+    """Render process answering with its pid, after a while for the "slow"
+    template"""
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        if request["templates"] == ["slow"]:
+            time.sleep(request.get("delay", 10))
+        conn.send((service.OK, str(os.getpid()).encode()))
+
+
+class RenderServiceTest(SimpleTestCase):
+    def setUp(self):
+        socket_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(socket_dir.cleanup)
+        self.socket_path = os.path.join(socket_dir.name, "render.sock")
+        settings = override_settings(
+            CERFA_RENDER_SOCKET=self.socket_path, CERFA_RENDER_TIMEOUT=5
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.context = {"object": Companies(uuid=uuid.uuid4())}
+
+    def start(self, workers=1, queue_size=0, timeout=5, max_jobs=100):
+        pool = service.RenderPool(
+            workers,
+            queue_size,
+            timeout,
+            max_jobs,
+            target=fake_render_process,
+            start_method="fork",
+        )
+        self.addCleanup(pool.close)
+        server = service.RenderServer(self.socket_path, pool)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def render(self, templates=("companies_1.svg",)):
+        return service.render_receipt(templates, self.context, "weasyprint")
+
+    def test_rendered_by_service(self):
+        self.start()
+        self.assertEqual(self.render(), self.render())
+        self.assertNotEqual(int(self.render()), os.getpid())
+
+    def test_recycled(self):
+        self.start(max_jobs=2)
+        pids = [self.render() for _ in range(3)]
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_timeout(self):
+        self.start(timeout=0.5)
+        pid = self.render()
+        with self.assertRaises(service.RenderServiceTimeout):
+            self.render(["slow"])
+        # The process was replaced
+        self.assertNotEqual(self.render(), pid)
+
+    def test_busy(self):
+        self.start(timeout=2)
+        slow = threading.Thread(
+            target=self.assertRaises,
+            args=(service.RenderServiceTimeout, self.render, ["slow"]),
+        )
+        slow.start()
+        self.addCleanup(slow.join)
+        time.sleep(0.2)
+        with self.assertRaises(service.RenderServiceBusy):
+            self.render()
+
+    def test_fallback_without_service(self):
+        with mock.patch.object(
+            service, "render_in_process", return_value=b"%PDF-"
+        ):
+            self.assertEqual(self.render(), b"%PDF-")
+
+    def test_connection_closed_not_rendered_again(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.socket_path)
+            server.listen()
+            threading.Thread(
+                target=lambda: server.accept()[0].close(), daemon=True
+            ).start()
+            with mock.patch.object(
+                service, "render_in_process", return_value=b"%PDF-"
+            ) as render:
+                with self.assertRaises(service.RenderServiceError):
+                    self.render()
+            render.assert_not_called()
+
+    def test_fallback_on_connection_refused(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            # Bound, not listening
+            server.bind(self.socket_path)
+            with mock.patch.object(
+                service, "render_in_process", return_value=b"%PDF-"
+            ):
+                self.assertEqual(self.render(), b"%PDF-")
@@ -1,8 +1,24 @@
-from django.contrib.auth.models import Group, User
-from django.test import Client, TestCase
+import datetime
+import gzip
+import io
+import zipfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
-from ..models import BeneficiaryOrganization, Companies, DeclarativeStructure
+from ..models import (
+    BeneficiaryOrganization,
+    Companies,
+    DeclarativeStructure,
+    RenderJob,
+)
+from ..pagination import decode_cursor, encode_cursor, following, paginate
+from ..views import BaseListView
 
 
 class CompaniesViewTest(TestCase):
@@ -115,3 +131,425 @@ class CompaniesViewTest(TestCase):
         self.assertIsNotNone(
             self.company.valid_date
         )  # Check if valid_date is updated
+
+
+class CerfaToZipViewTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email="test@example.com", password="testpassword"
+        )
+        user.user_permissions.set(
+            Permission.objects.filter(
+                codename="send_email", content_type__model="companies"
+            )
+        )
+        self.client.force_login(user)
+
+        render = mock.patch(
+            "cerfa_filler.views.cached_receipt",
+            side_effect=lambda templates, context: b"%PDF-"
+            + (context["object"].order_number.encode()),
+        )
+        self.render = render.start()
+        self.addCleanup(render.stop)
+
+        BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        structure = DeclarativeStructure.objects.create(label="Test")
+        self.companies = [
+            Companies.objects.create(
+                label=f"Company {day}",
+                repository_code="54321",
+                postal_code="75002",
+                municipality="Paris",
+                declarative_structure=structure,
+                cash_donation=100.00,
+                date_start=datetime.date(2024, 3, day),
+                valid_date=datetime.date(2024, 4, 1),
+            )
+            for day in (1, 2, 3)
+        ]
+        # Not validated, skipped
+        self.companies[2].valid_date = None
+        self.companies[2].save()
+
+    def post(self):
+        return self.client.post(
+            reverse("cerfa_filler:companies-cerfa-zip"),
+            {
+                "selected_companies": [
+                    company.uuid for company in self.companies
+                ]
+            },
+        )
+
+    def test_receipts_streamed(self):
+        response = self.post()
+        self.assertTrue(response.streaming)
+        chunks = iter(response.streaming_content)
+        first = next(chunks)
+        # The first receipt is sent before the next one is rendered
+        self.assertEqual(self.render.call_count, 1)
+
+        content = first + b"".join(chunks)
+        self.assertEqual(self.render.call_count, 2)
+
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertEqual(
+            archive.namelist(),
+            [
+                "recu_fiscal_don-2024-PM-1.pdf",
+                "recu_fiscal_don-2024-PM-2.pdf",
+            ],
+        )
+        self.assertEqual(
+            archive.read("recu_fiscal_don-2024-PM-2.pdf"),
+            b"%PDF-2024-PM-2",
+        )
+
+    def test_empty_selection(self):
+        response = self.client.post(
+            reverse("cerfa_filler:companies-cerfa-zip")
+        )
+        self.assertRedirects(
+            response,
+            reverse("cerfa_filler:companies-list"),
+            fetch_redirect_response=False,
+        )
+
+    def test_permission_required(self):
+        self.client.logout()
+        self.assertEqual(self.post().status_code, 302)
+
+
+class CerfaToPdfViewTest(TestCase):
+    def setUp(self):
+        render = mock.patch(
+            "cerfa_filler.views.open_receipt",
+            side_effect=lambda templates, context, render: io.BytesIO(
+                b"%PDF-0123456789"
+            ),
+        )
+        self.render = render.start()
+        self.addCleanup(render.stop)
+
+        BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.company = Companies.objects.create(
+            label="Test Company",
+            repository_code="54321",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test"
+            ),
+            cash_donation=100.00,
+        )
+        self.url = reverse(
+            "cerfa_filler:companies-cerfa-pdf", args=[self.company.pk]
+        )
+
+    def test_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], "15")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(b"".join(response), b"%PDF-0123456789")
+
+        response = self.client.get(
+            self.url, headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_etag_changes_with_donation(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.company.cash_donation = 200
+        self.company.save()
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_range(self):
+        response = self.client.get(self.url, headers={"Range": "bytes=5-8"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 5-8/15")
+        self.assertEqual(response.content, b"0123")
+
+        response = self.client.get(self.url, headers={"Range": "bytes=-3"})
+        self.assertEqual(response.content, b"789")
+
+        response = self.client.get(self.url, headers={"Range": "bytes=20-"})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */15")
+
+    def test_outdated_if_range(self):
+        response = self.client.get(
+            self.url, headers={"Range": "bytes=5-8", "If-Range": '"outdated"'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class CerfaPreviewViewTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email="test@example.com", password="testpassword"
+        )
+        user.user_permissions.set(
+            Permission.objects.filter(
+                codename="view_companies", content_type__model="companies"
+            )
+        )
+        self.client.force_login(user)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        BeneficiaryOrganization.objects.create(
+            label="Test Beneficiary",
+            repository_code="12345",
+            postal_code="75001",
+            municipality="Paris",
+        )
+        self.company = Companies.objects.create(
+            label="Test Company",
+            repository_code="54321",
+            postal_code="75002",
+            municipality="Paris",
+            declarative_structure=DeclarativeStructure.objects.create(
+                label="Test"
+            ),
+            cash_donation=100.00,
+        )
+        self.url = reverse(
+            "cerfa_filler:companies-cerfa-preview", args=[self.company.uuid]
+        )
+
+    def test_svg_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertNotIn("Content-Encoding", response)
+        svg = response.content.decode()
+        self.assertTrue(svg.startswith("<svg"))
+        self.assertIn("Test Company", svg)
+        self.assertNotIn("cerfa-asset:", svg)
+
+    def test_compressed(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(
+            "Test Company", gzip.decompress(response.content).decode()
+        )
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_cached_until_updated(self):
+        with mock.patch(
+            "cerfa_filler.rendering.preview.render_preview",
+            return_value=b"<svg/>",
+        ) as render:
+            etag = self.client.get(self.url)["ETag"]
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.client.get(self.url)
+            self.assertEqual(render.call_count, 1)
+
+            self.company.label = "Renamed"
+            self.company.save()
+            self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+            self.assertEqual(render.call_count, 2)
+
+    def test_permission_required(self):
+        self.client.force_login(
+            get_user_model().objects.create_user(
+                email="other@example.com", password="testpassword"
+            )
+        )
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+@override_settings(CERFA_LIST_PAGE_SIZE=2)
+class ListPaginationTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email="test@example.com", password="testpassword"
+        )
+        user.user_permissions.set(
+            Permission.objects.filter(
+                codename__in=["view_companies", "change_validation"],
+                content_type__model="companies",
+            )
+        )
+        self.client.force_login(user)
+
+        self.structure = DeclarativeStructure.objects.create(label="Test")
+        # Same date for the last ones, ordered by their order number
+        self.companies = [
+            Companies.objects.create(
+                label=f"Company {number}",
+                postal_code="75002",
+                municipality="Paris",
+                declarative_structure=self.structure,
+                cash_donation=100.00,
+                # Totals of 100, 400, 300, 200 and 100
+                inkind_donation=(0, 300, 200, 100, 0)[number],
+                date_start=datetime.date(2024, 3, min(number, 3) + 1),
+            )
+            for number in range(5)
+        ]
+        Companies.objects.create(
+            label="Other year",
+            declarative_structure=self.structure,
+            date_start=datetime.date(2023, 3, 1),
+        )
+        self.url = reverse("cerfa_filler:companies-list")
+
+    def labels(self, response):
+        return [company.label for company in response.context["companies"]]
+
+    def test_pages(self):
+        response = self.client.get(self.url, {"year": 2024})
+        pages = [self.labels(response)]
+        while response.context.get("next_page"):
+            self.assertIn("year=2024", response.context["next_page"])
+            response = self.client.get(
+                self.url + response.context["next_page"]
+            )
+            pages.append(self.labels(response))
+        self.assertEqual(
+            pages,
+            [
+                ["Company 0", "Company 1"],
+                ["Company 2", "Company 3"],
+                ["Company 4"],
+            ],
+        )
+
+        previous = []
+        while response.context.get("previous_page"):
+            response = self.client.get(
+                self.url + response.context["previous_page"]
+            )
+            previous.append(self.labels(response))
+        self.assertEqual(previous, pages[-2::-1])
+
+    def test_filters_kept_in_session(self):
+        self.client.get(self.url, {"year": 2024})
+        response = self.client.get(self.url)
+        self.assertRedirects(
+            response, f"{self.url}?year=2024", fetch_redirect_response=False
+        )
+
+    def test_invalid_cursor(self):
+        for cursor in ("nope", "WyJ4IiwxLCJ5Il0"):
+            response = self.client.get(
+                self.url, {"year": 2024, "after": cursor}
+            )
+            self.assertEqual(self.labels(response), ["Company 0", "Company 1"])
+
+    def test_tampered_cursor_values(self):
+        for value in ([1], {"a": 1}, 1.5, True, None):
+            cursor = encode_cursor(["2024-01-01", value, 1])
+            response = self.client.get(
+                self.url, {"year": 2024, "after": cursor}
+            )
+            self.assertEqual(self.labels(response), ["Company 0", "Company 1"])
+
+    def test_select_all_pages(self):
+        response = self.client.post(
+            reverse("cerfa_filler:companies-update-valid-date"),
+            {"select_all": "year=2024&validation=false"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            Companies.objects.filter(valid_date__isnull=False).count(), 5
+        )
+        self.assertEqual(RenderJob.objects.count(), 5)
+
+    def test_select_all_pages_with_rows(self):
+        url = reverse("cerfa_filler:companies-update-valid-date")
+        rows = [company.uuid for company in self.companies[:2]]
+        self.client.post(url, {"selected_companies": rows})
+        self.assertEqual(
+            Companies.objects.filter(valid_date__isnull=False).count(), 2
+        )
+
+        # The rows of the page, and the donations of the other pages
+        self.client.post(
+            url,
+            {
+                "selected_companies": rows,
+                "select_all": "year=2024&validation=false",
+            },
+        )
+        self.assertEqual(
+            Companies.objects.filter(
+                date_start__year=2024, valid_date__isnull=False
+            ).count(),
+            5,
+        )
+        self.assertFalse(
+            Companies.objects.filter(
+                date_start__year=2023, valid_date__isnull=False
+            ).exists()
+        )
+
+    def test_next_page_seeks_index(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        ordering = BaseListView.orderings["date"]
+        page = paginate(Companies.objects.all(), ordering, {}, 2)
+        queryset = Companies.objects.order_by(*ordering).filter(
+            following(ordering, decode_cursor(page.next_cursor, 3))
+        )
+        self.assertIn("companies_list_idx", queryset.explain())
+
+    def all_pages(self, params):
+        response = self.client.get(self.url, params)
+        labels = self.labels(response)
+        while response.context.get("next_page"):
+            response = self.client.get(
+                self.url + response.context["next_page"]
+            )
+            labels += self.labels(response)
+        return labels
+
+    def test_sort_by_name(self):
+        self.assertEqual(
+            self.all_pages({"ordering": "name"}),
+            [f"Company {number}" for number in range(5)] + ["Other year"],
+        )
+
+    def test_sort_by_order_number(self):
+        self.assertEqual(
+            self.all_pages({"ordering": "-order"}),
+            [f"Company {number}" for number in range(4, -1, -1)]
+            + ["Other year"],
+        )
+
+    def test_invalid_ordering(self):
+        # The total is not indexed, see ListIndexesTest
+        for ordering in ("-uuid", "total"):
+            response = self.client.get(self.url, {"ordering": ordering})
+            self.assertEqual(response.context["ordering"], "date")
+            self.assertEqual(
+                self.labels(response), ["Other year", "Company 0"]
+            )
+
+    def test_sort_links(self):
+        response = self.client.get(
+            self.url, {"year": 2024, "ordering": "name"}
+        )
+        links = response.context["sort_links"]
+        self.assertEqual(links["name"], "?year=2024&ordering=-name")
+        self.assertEqual(links["order"], "?year=2024&ordering=order")
+        self.assertIn("ordering=name", response.context["next_page"])
+        self.assertEqual(
+            response.context["filterForm"]["ordering"].value(), "name"
+        )
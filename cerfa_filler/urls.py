@@ -1,13 +1,17 @@
 from django.urls import path
 
 from .views import (
+    CompaniesCerfaPreview,
     CompaniesCerfaToPdf,
+    CompaniesCerfaToZip,
     CompaniesCreateView,
     CompaniesListView,
     CompaniesUpdateValidDateView,
     CompaniesUpdateView,
     Home,
+    PrivateIndividualCerfaPreview,
     PrivateIndividualCerfaToPdf,
+    PrivateIndividualCerfaToZip,
     PrivateIndividualCreateView,
     PrivateIndividualListView,
     PrivateIndividualUpdateValidDateView,
@@ -23,6 +27,16 @@ urlpatterns = [
         CompaniesCerfaToPdf.as_view(),
         name="companies-cerfa-pdf",
     ),
+    path(
+        "companies/cerfa/preview/<uuid:pk>",
+        CompaniesCerfaPreview.as_view(),
+        name="companies-cerfa-preview",
+    ),
+    path(
+        "companies/cerfa/zip/",
+        CompaniesCerfaToZip.as_view(),
+        name="companies-cerfa-zip",
+    ),
     path(
         "companies/list/", CompaniesListView.as_view(), name="companies-list"
     ),
@@ -47,6 +61,16 @@ urlpatterns = [
         PrivateIndividualCerfaToPdf.as_view(),
         name="private-individual-cerfa-pdf",
     ),
+    path(
+        "individuals/cerfa/preview/<uuid:pk>",
+        PrivateIndividualCerfaPreview.as_view(),
+        name="private-individual-cerfa-preview",
+    ),
+    path(
+        "individuals/cerfa/zip/",
+        PrivateIndividualCerfaToZip.as_view(),
+        name="private-individual-cerfa-zip",
+    ),
     path(
         "individuals/list/",
         PrivateIndividualListView.as_view(),
@@ -1,17 +1,26 @@
-import base64
-import io
+import hashlib
 from datetime import datetime
+from decimal import Decimal
 from urllib.parse import urlencode
 
+from django.conf import settings
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import FieldError
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Max, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, QueryDict, StreamingHttpResponse
 from django.shortcuts import redirect
-from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views import View
 from django.views.generic import (
     CreateView,
@@ -20,8 +29,6 @@ from django.views.generic import (
     TemplateView,
     UpdateView,
 )
-from pypdf import PdfReader, PdfWriter
-from weasyprint import HTML
 
 from .forms import (
     BaseFilterForm,
@@ -30,7 +37,22 @@ from .forms import (
     IndividualFilterForm,
     PrivateIndividualForm,
 )
-from .models import BeneficiaryOrganization, Companies, PrivateIndividual
+from .http import file_response
+from .models import (
+    Companies,
+    PrivateIndividual,
+    RenderJob,
+)
+from .pagination import paginate, reverse_ordering
+from .rendering import receipt_context, service
+from .rendering.archive import stream_zip
+from .rendering.cache import (
+    cached_receipt,
+    open_receipt,
+    receipt_etag,
+    receipt_last_modified,
+)
+from .rendering.preview import cached_preview, preferred_encoding, preview_key
 
 # HOME
 
@@ -41,24 +63,15 @@ class Home(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        company_max_year = (
-            Companies.objects.values("date_start__year")
-            .distinct()
-            .order_by("-date_start")
-            .first()
-        )
-        context["company_max_year"] = company_max_year.get(
-            "date_start__year", datetime.now().year
-        )
-
-        individual_max_year = (
-            PrivateIndividual.objects.values("date_start__year")
-            .distinct()
-            .order_by("-date_start")
-            .first()
+        context["company_max_year"] = (
+            Companies.objects.aggregate(year=Max("fiscal_year"))["year"]
+            or datetime.now().year
         )
-        context["individual_max_year"] = individual_max_year.get(
-            "date_start__year", datetime.now().year
+        context["individual_max_year"] = (
+            PrivateIndividual.objects.aggregate(year=Max("fiscal_year"))[
+                "year"
+            ]
+            or datetime.now().year
         )
         return context
 
@@ -67,8 +80,17 @@ class Home(TemplateView):
 
 
 class BaseListView(ListView):
-    ignore_params = ("page",)
+    ignore_params = ("page", "after", "before")
     session_key = "cerfaFiller:list:filters"
+    # Values of the ``ordering`` parameter, "-" prefixed for a descending
+    # sort, and the keysets of the pages they give (see pagination.py)
+    orderings = {
+        "order": ("fiscal_year", "order", "uuid"),
+        "date": ("date_start", "order", "uuid"),
+    }
+    default_ordering = "date"
+    # Annotated as "total" for the lists
+    total = None
 
     def get_filter_querystring(self):
         # Return encoded querystring of filter params (exclude ignored)
@@ -93,17 +115,14 @@ class BaseListView(ListView):
                 return redirect(f"{request.path}?{qs}")
         return super().get(request, *args, **kwargs)
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        params = self.request.GET
-
+    def filter_queryset(self, queryset, params):
         # get parameters
         year = params.get("year")
         declarative_structure = params.get("declarative_structure")
         validation = params.get("validation")
 
         if year:
-            queryset = queryset.filter(date_start__year=year)
+            queryset = queryset.filter(fiscal_year=year)
         if declarative_structure:
             queryset = queryset.filter(
                 declarative_structure=declarative_structure
@@ -117,71 +136,220 @@ class BaseListView(ListView):
                 pass
         return queryset
 
+    def get_queryset(self):
+        # Sorted by paginate(), once annotated
+        return self.filter_queryset(
+            self.model.objects.annotate(total=self.total), self.request.GET
+        )
+
+    def get_ordering_param(self):
+        ordering = self.request.GET.get("ordering", "")
+        if ordering.removeprefix("-") not in self.orderings:
+            return self.default_ordering
+        return ordering
+
+    def get_ordering(self):
+        ordering = self.get_ordering_param()
+        keyset = self.orderings[ordering.removeprefix("-")]
+        if ordering.startswith("-"):
+            return reverse_ordering(keyset)
+        return keyset
+
+    def sort_link(self, ordering):
+        # Ascending first, then descending when already sorted by it
+        params = self.request.GET.copy()
+        for param in self.ignore_params:
+            params.pop(param, None)
+        params["ordering"] = (
+            f"-{ordering}"
+            if self.get_ordering_param() == ordering
+            else ordering
+        )
+        return f"?{params.urlencode()}"
+
+    def page_link(self, **cursor):
+        # The filters are kept in the links, which are not saved in session
+        filters = self.get_filter_querystring()
+        return f"?{urlencode(cursor)}" + (f"&{filters}" if filters else "")
+
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+        page = paginate(
+            self.object_list,
+            self.get_ordering(),
+            self.request.GET,
+            settings.CERFA_LIST_PAGE_SIZE,
+        )
+        context = super().get_context_data(object_list=page.object_list)
+        context["filter_querystring"] = self.get_filter_querystring()
+        context["ordering"] = self.get_ordering_param()
+        context["sort_links"] = {
+            ordering: self.sort_link(ordering) for ordering in self.orderings
+        }
+        if page.next_cursor:
+            context["next_page"] = self.page_link(after=page.next_cursor)
+        if page.previous_cursor:
+            context["previous_page"] = self.page_link(
+                before=page.previous_cursor
+            )
         context["filterForm"] = BaseFilterForm(
             self.request.GET, model=self.model
         )
         return context
 
 
-class CompaniesCerfaToPdf(DetailView):
-    template_name = "companies_cerfa.svg"
-    model = Companies
+def selected_donations(request, list_view, selection):
+    """Donations checked in a list. When the donations of every page were
+    selected, ``select_all`` holds the filters of the list instead."""
+    if "select_all" in request.POST:
+        return list_view().filter_queryset(
+            list_view.model.objects.all(),
+            QueryDict(request.POST["select_all"]),
+        )
+    return list_view.model.objects.filter(
+        uuid__in=request.POST.getlist(selection)
+    )
+
+
+def receipt_filename(donor) -> str:
+    return f"recu_fiscal_don-{donor.order_number}.pdf"
+
+
+class BaseCerfaToPdf(DetailView):
+    templates = ()
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         context = self.get_context_data()
 
-        # Generate PDF files from SVG templates
-        pdfs = []
-        for template in ("companies_1.svg", "companies_2.svg"):
-            svg_content = render_to_string(template, context)
-            pdf_bytes = HTML(string=svg_content).write_pdf(
-                margin_top=0, margin_right=0, margin_bottom=0, margin_left=0
+        # Validators known without rendering the receipt
+        etag = receipt_etag(self.templates, context)
+        last_modified = receipt_last_modified(self.templates, context)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp())
+        )
+        if response is None:
+            try:
+                # Usually already rendered by a worker on validation
+                receipt = open_receipt(
+                    self.templates, context, service.render_receipt
+                )
+            except service.RenderServiceBusy:
+                response = HttpResponse(
+                    "Trop de reçus en cours de génération, réessayez dans "
+                    "quelques instants.",
+                    status=503,
+                )
+                response["Retry-After"] = "5"
+                return response
+            except service.RenderServiceTimeout:
+                return HttpResponse(
+                    "La génération du reçu a pris trop de temps.", status=504
+                )
+            response = file_response(
+                request,
+                receipt,
+                receipt_filename(self.object),
+                "application/pdf",
+                etag,
             )
-            pdfs.append(
-                io.BytesIO(pdf_bytes)
-            )  # Use BytesIO to create a file-like object
-
-        # Merge the generated PDF files
-        writer = PdfWriter()
-        for pdf in pdfs:
-            reader = PdfReader(pdf)
-            for page in reader.pages:
-                writer.add_page(page)
-
-        filename = f"recu_fiscal_don-{self.object.order_number}.pdf"
-        # Create a response with the merged PDF
-        response = HttpResponse(content_type="application/pdf")
-        response[
-            "Content-Disposition"
-        ] = f'attachment; filename="{filename}"'  # noqa: E702
-
-        # Write the merged PDF to the response
-        output_pdf = io.BytesIO()  # Create a BytesIO object for the output
-        writer.write(output_pdf)
-        output_pdf.seek(0)  # Move to the beginning of the BytesIO stream
-
-        response.write(
-            output_pdf.read()
-        )  # Write the PDF content to the response
-
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+        # Cached by the browser, but always revalidated
+        patch_cache_control(response, private=True, no_cache=True)
         return response
 
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
-        company = BeneficiaryOrganization.objects.first()
-        data["company"] = company
-        if company.sign_file:
-            with open(company.sign_file.path, "rb") as sign_file:
-                print(sign_file)
-                data["sign_file"] = base64.b64encode(sign_file.read()).decode(
-                    "utf-8"
-                )
+        data.update(receipt_context(self.object))
         return data
 
 
+class CompaniesCerfaToPdf(BaseCerfaToPdf):
+    model = Companies
+    templates = ("companies_1.svg", "companies_2.svg")
+
+
+class BaseCerfaPreview(LoginRequiredMixin, DetailView):
+    """Page of a receipt holding the donation, as a SVG image to be checked
+    before validating the donation"""
+
+    templates = ()
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        context = receipt_context(self.object)
+        template_name = self.templates[-1]
+
+        etag = (
+            '"%s"'
+            % hashlib.sha256(
+                preview_key(template_name, context).encode()
+            ).hexdigest()
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            encoding = preferred_encoding(
+                request.headers.get("Accept-Encoding", "")
+            )
+            response = HttpResponse(
+                cached_preview(template_name, context, encoding),
+                content_type="image/svg+xml",
+            )
+            if encoding:
+                response["Content-Encoding"] = encoding
+            # The SVG is shown on its own, nothing is loaded or run from it
+            response["Content-Security-Policy"] = (
+                "default-src 'none'; img-src data:; style-src 'unsafe-inline'"
+            )
+        response["ETag"] = etag
+        patch_vary_headers(response, ("Accept-Encoding",))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+@method_decorator(
+    permission_required("cerfa_filler.view_companies"), name="dispatch"
+)
+class CompaniesCerfaPreview(BaseCerfaPreview):
+    model = Companies
+    templates = CompaniesCerfaToPdf.templates
+
+
+class BaseCerfaToZip(LoginRequiredMixin, View):
+    """Receipts of the donations selected in a list, streamed in a ZIP"""
+
+    list_view = None
+    templates = ()
+    selection = None
+    list_url = None
+
+    def get_queryset(self):
+        # Same conditions as the Cerfa button of the lists
+        return (
+            selected_donations(self.request, self.list_view, self.selection)
+            .filter(valid_date__isnull=False, tax_receipt=True)
+            .order_by("date_start", "order")
+        )
+
+    def receipts(self, queryset):
+        # Rendered one at a time, as the archive is sent
+        for donor in queryset.iterator():
+            pdf = cached_receipt(self.templates, receipt_context(donor))
+            yield receipt_filename(donor), pdf
+
+    def post(self, request):
+        queryset = self.get_queryset()
+        if not queryset.exists():
+            return redirect(self.list_url)
+        response = StreamingHttpResponse(
+            stream_zip(self.receipts(queryset)),
+            content_type="application/zip",
+        )
+        filename = f"recus_fiscaux-{timezone.localdate():%Y%m%d}.zip"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
 @method_decorator(
     permission_required("cerfa_filler.view_companies"), name="dispatch"
 )
@@ -189,6 +357,10 @@ class CompaniesListView(LoginRequiredMixin, BaseListView):
     model = Companies
     template_name = "company_list.html"
     context_object_name = "companies"
+    orderings = {**BaseListView.orderings, "name": ("label", "uuid")}
+    total = Coalesce("cash_donation", Value(Decimal(0))) + Coalesce(
+        "inkind_donation", Value(Decimal(0))
+    )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -197,12 +369,11 @@ class CompaniesListView(LoginRequiredMixin, BaseListView):
         )
         return context
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
+    def filter_queryset(self, queryset, params):
+        queryset = super().filter_queryset(queryset, params)
 
-        donation_kind = self.request.GET.get("donation_kind")
+        donation_kind = params.get("donation_kind")
         if donation_kind:
-            print("donation kind", donation_kind)
             try:
                 if donation_kind == "cash":
                     queryset = queryset.filter(
@@ -217,6 +388,16 @@ class CompaniesListView(LoginRequiredMixin, BaseListView):
         return queryset
 
 
+@method_decorator(
+    permission_required("cerfa_filler.send_email"), name="dispatch"
+)
+class CompaniesCerfaToZip(BaseCerfaToZip):
+    list_view = CompaniesListView
+    templates = CompaniesCerfaToPdf.templates
+    selection = "selected_companies"
+    list_url = "cerfa_filler:companies-list"
+
+
 @method_decorator(
     permission_required("cerfa_filler.add_companies"), name="dispatch"
 )
@@ -242,14 +423,22 @@ class CompaniesUpdateView(LoginRequiredMixin, UpdateView):
 )
 class CompaniesUpdateValidDateView(LoginRequiredMixin, View):
     def post(self, request):
-        selected_uuids = request.POST.getlist("selected_companies")
+        selected = selected_donations(
+            request, CompaniesListView, "selected_companies"
+        )
         # Assuming you want to set the valid_date to the current date
         valid_date = timezone.now()
 
-        # Update the valid_date for selected companies
-        Companies.objects.filter(uuid__in=selected_uuids).update(
-            valid_date=valid_date
-        )
+        with transaction.atomic():
+            # Render the receipts in the background (see run_workers),
+            # queued first as the selection may be on the validation status
+            RenderJob.enqueue(selected.filter(tax_receipt=True))
+            # Update the valid_date for selected companies
+            # update() leaves timestamp_update, the Last-Modified of the
+            # receipts
+            selected.update(
+                valid_date=valid_date, timestamp_update=timezone.now()
+            )
 
         return redirect(
             "cerfa_filler:companies-list"
@@ -267,6 +456,11 @@ class PrivateIndividualListView(LoginRequiredMixin, BaseListView):
     model = PrivateIndividual
     template_name = "private_individual_list.html"
     context_object_name = "individuals"
+    orderings = {
+        **BaseListView.orderings,
+        "name": ("last_name", "first_name", "uuid"),
+    }
+    total = Coalesce("cash_donation", Value(Decimal(0)))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -275,14 +469,12 @@ class PrivateIndividualListView(LoginRequiredMixin, BaseListView):
         )
         return context
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
+    def filter_queryset(self, queryset, params):
+        queryset = super().filter_queryset(queryset, params)
 
-        donation_nature = self.request.GET.get("donation_nature")
+        donation_nature = params.get("donation_nature")
         if donation_nature:
-            print("donation kind", donation_nature)
             queryset = queryset.filter(donation_nature=donation_nature)
-        print(queryset.query)
         return queryset
 
 
@@ -313,72 +505,47 @@ class PrivateIndividualUpdateView(LoginRequiredMixin, UpdateView):
 )
 class PrivateIndividualUpdateValidDateView(LoginRequiredMixin, View):
     def post(self, request):
-        selected_uuids = request.POST.getlist("selected_individuals")
+        selected = selected_donations(
+            request, PrivateIndividualListView, "selected_individuals"
+        )
         # Assuming you want to set the valid_date to the current date
         valid_date = timezone.now()
 
-        # Update the valid_date for selected PrivateIndividual
-        PrivateIndividual.objects.filter(uuid__in=selected_uuids).update(
-            valid_date=valid_date
-        )
+        with transaction.atomic():
+            # Render the receipts in the background (see run_workers),
+            # queued first as the selection may be on the validation status
+            RenderJob.enqueue(selected.filter(tax_receipt=True))
+            # Update the valid_date for selected PrivateIndividual
+            # update() leaves timestamp_update, the Last-Modified of the
+            # receipts
+            selected.update(
+                valid_date=valid_date, timestamp_update=timezone.now()
+            )
 
         return redirect(
             "cerfa_filler:private-individual-list"
         )  # Redirect to the PrivateIndividual list page
 
 
-class PrivateIndividualCerfaToPdf(DetailView):
-    template_name = "individuals_cerfa.svg"
+class PrivateIndividualCerfaToPdf(BaseCerfaToPdf):
     model = PrivateIndividual
+    templates = ("individuals_1.svg", "individuals_2.svg")
 
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        context = self.get_context_data()
 
-        # Generate PDF files from SVG templates
-        pdfs = []
-        for template in ("individuals_1.svg", "individuals_2.svg"):
-            svg_content = render_to_string(template, context)
-            pdf_bytes = HTML(string=svg_content).write_pdf(
-                margin_top=0, margin_right=0, margin_bottom=0, margin_left=0
-            )
-            pdfs.append(
-                io.BytesIO(pdf_bytes)
-            )  # Use BytesIO to create a file-like object
-
-        # Merge the generated PDF files
-        writer = PdfWriter()
-        for pdf in pdfs:
-            reader = PdfReader(pdf)
-            for page in reader.pages:
-                writer.add_page(page)
-
-        filename = f"recu_fiscal_don-{self.object.order_number}.pdf"
-        # Create a response with the merged PDF
-        response = HttpResponse(content_type="application/pdf")
-        response[
-            "Content-Disposition"
-        ] = f'attachment; filename="{filename}"'  # noqa: E702
-
-        # Write the merged PDF to the response
-        output_pdf = io.BytesIO()  # Create a BytesIO object for the output
-        writer.write(output_pdf)
-        output_pdf.seek(0)  # Move to the beginning of the BytesIO stream
-
-        response.write(
-            output_pdf.read()
-        )  # Write the PDF content to the response
+@method_decorator(
+    permission_required("cerfa_filler.view_privateindividual"),
+    name="dispatch",
+)
+class PrivateIndividualCerfaPreview(BaseCerfaPreview):
+    model = PrivateIndividual
+    templates = PrivateIndividualCerfaToPdf.templates
 
-        return response
 
-    def get_context_data(self, **kwargs):
-        data = super().get_context_data(**kwargs)
-        company = BeneficiaryOrganization.objects.first()
-        data["company"] = company
-        if company.sign_file:
-            with open(company.sign_file.path, "rb") as sign_file:
-                print(sign_file)
-                data["sign_file"] = base64.b64encode(sign_file.read()).decode(
-                    "utf-8"
-                )
-        return data
+@method_decorator(
+    permission_required("cerfa_filler.send_email"), name="dispatch"
+)
+class PrivateIndividualCerfaToZip(BaseCerfaToZip):
+    list_view = PrivateIndividualListView
+    templates = PrivateIndividualCerfaToPdf.templates
+    selection = "selected_individuals"
+    list_url = "cerfa_filler:private-individual-list"
@@ -7,8 +7,15 @@ cd /app
 
 python3 -m manage migrate
 python3 -m manage collectstatic --noinput
+python3 -m manage minify_templates
 python3 -m manage loaddata legal_forms.json group.json
 
+if [ -n "$CERFA_RENDER_SOCKET" ]
+then
+    echo "Starting render service"
+    python3 -m manage render_service &
+fi
+
 if [ $DEBUG = true ]
 then
     echo "Starting dev mode"
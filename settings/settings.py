@@ -75,13 +75,23 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],  # new
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            # Minified receipt templates first, see `minify_templates`
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "cerfa_filler.rendering.loaders.Loader",
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                )
+            ],
         },
     },
 ]
@@ -174,6 +184,77 @@ SERVER_EMAIL = config("SERVER_EMAIL", default=EMAIL_HOST_USER)
 PDF_EMAILS = config("PDF_EMAILS", default=EMAIL_HOST_USER, cast=Csv())
 
 
+# Donations per page of the lists
+CERFA_LIST_PAGE_SIZE = config("CERFA_LIST_PAGE_SIZE", default=100, cast=int)
+
 MEDIA_UPLOAD = "media/"
 MEDIA_ROOT = BASE_DIR / MEDIA_UPLOAD
 # print("MEDIA_ROOT", MEDIA_ROOT)
+
+# RECEIPTS RENDERING
+
+CERFA_CACHE_ROOT = config("CERFA_CACHE_ROOT", default=MEDIA_ROOT / "cache")
+
+# Shared by all the processes (gunicorn workers, run_workers), e.g. to
+# invalidate the beneficiary organization they keep in memory
+CACHE_BACKEND = config(
+    "CACHE_BACKEND",
+    default="django.core.cache.backends.filebased.FileBasedCache",
+)
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKEND,
+        "LOCATION": config(
+            "CACHE_LOCATION", default=str(Path(CERFA_CACHE_ROOT) / "django")
+        ),
+    }
+}
+if CACHE_BACKEND.endswith(("FileBasedCache", "LocMemCache")):
+    # Past MAX_ENTRIES (300 by default), 1 / CULL_FREQUENCY of the entries
+    # are dropped at random, the counters of the receipts cache included
+    CACHES["default"]["OPTIONS"] = {
+        "MAX_ENTRIES": config("CACHE_MAX_ENTRIES", default=10000, cast=int),
+        "CULL_FREQUENCY": 10,
+    }
+
+# Keeps the uploads and caches of the tests out of MEDIA_ROOT
+TEST_RUNNER = "cerfa_filler.tests.runner.TestRunner"
+
+# Unix socket of the render service (see the render_service command), the
+# receipts are rendered by the web workers when empty or not running
+CERFA_RENDER_SOCKET = config("CERFA_RENDER_SOCKET", default="")
+
+# Seconds a web worker waits for the render service
+CERFA_RENDER_TIMEOUT = config("CERFA_RENDER_TIMEOUT", default=60, cast=float)
+
+# Total size of the generated receipts kept in cache, in bytes (0 disables)
+CERFA_RECEIPTS_CACHE_SIZE = config(
+    "CERFA_RECEIPTS_CACHE_SIZE", default=500 * 1024 * 1024, cast=int
+)
+
+# "weasyprint" renders every receipt from the SVG templates, one page at a
+# time ("weasyprint-single" lays out all the pages at once),
+# "cairosvg" draws the SVG templates without WeasyPrint (CairoSVG must be
+# installed), "overlay" only stamps the donation fields on pre-rendered
+# backgrounds and "acroform" fills the official CERFA forms. The dotted path
+# of a function rendering a receipt is also accepted.
+CERFA_RENDERER = config("CERFA_RENDERER", default="weasyprint")
+
+# Renderer by donor model, e.g. "companies=acroform,privateindividual=overlay"
+CERFA_RENDERERS = config(
+    "CERFA_RENDERERS",
+    default="",
+    cast=Csv(cast=lambda item: item.split("="), post_process=dict),
+)
+
+# Values of the fields of the beneficiary organization on the first page of
+# the AcroForms (organism type checkboxes), e.g. "CAC0=/1"
+CERFA_ACROFORM_FIELDS = config(
+    "CERFA_ACROFORM_FIELDS",
+    default="",
+    cast=Csv(cast=lambda item: item.split("="), post_process=dict),
+)
+
+# Output the receipts are optimized for: "screen" (images downsampled to
+# 150 dpi), "print" (300 dpi) or "archive" (images left as they are)
+CERFA_PDF_TARGET = config("CERFA_PDF_TARGET", default="print")